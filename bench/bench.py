@@ -5,7 +5,8 @@ Usage:
   bench.py [options]
 
 Options:
- --scenario <scenario>  # publish-ack-<size> | publish-noack-<size> | subscribe
+ --scenario <scenario>  # publish-ack-<size> | publish-noack-<size> | publish-batch-<size> | subscribe
+ --batch <batch>        # messages per publish_many call [default: 100]
  --channel <channel>
  --endpoint <endpoint>
  --appkey <appkey>
@@ -40,6 +41,7 @@ test_endpoint, test_appkey = get_test_endpoint_and_appkey()
 
 publish_ack_re = re.compile(r'publish-ack-(\d+)')
 publish_noack_re = re.compile(r'publish-noack-(\d+)')
+publish_batch_re = re.compile(r'publish-batch-(\d+)')
 
 sampling_interval = 5 # in seconds
 
@@ -53,6 +55,7 @@ def main():
 
     publish_ack_match = publish_ack_re.match(scenario)
     publish_noack_match = publish_noack_re.match(scenario)
+    publish_batch_match = publish_batch_re.match(scenario)
 
     if scenario == 'subscribe':
         channel = args['--channel']
@@ -67,6 +70,12 @@ def main():
         size = int(publish_noack_match.group(1))
         channel = args['--channel'] or make_channel_name('publish_no_ack')
         return bench_publish_noack(endpoint, appkey, channel, size, profile)
+    elif publish_batch_match:
+        size = int(publish_batch_match.group(1))
+        batch = int(args['--batch'])
+        channel = args['--channel'] or make_channel_name('publish_batch')
+        return bench_publish_batch(
+            endpoint, appkey, channel, size, profile, batch)
     else:
         print('Unknown scenario {}'.format(scenario))
         return 1
@@ -80,26 +89,41 @@ def bench_publish_noack(*args):
     return bench_publish(*args, ack=False)
 
 
-def bench_publish(endpoint, appkey, channel, size, profile, ack=True):
-    publisher = satori.rtm.connection.Connection(endpoint + '?appkey=' + appkey)
+def bench_publish_batch(endpoint, appkey, channel, size, profile, batch):
+    return bench_publish(
+        endpoint, appkey, channel, size, profile, ack=True, batch=batch)
+
+
+def bench_publish(
+        endpoint, appkey, channel, size, profile, ack=True, batch=None):
+    publisher = satori.rtm.connection.Connection(endpoint, appkey)
     publisher.start()
 
     message = binascii.hexlify(os.urandom(size // 2)).decode('ascii')
     print('Message size is {}'.format(len(message)))
 
     last_usage = [resource.getrusage(resource.RUSAGE_SELF)]
-    print('Duration, s\tRate, msgs/s\tMax RSS, MB\tUser time, s\tSystem time, s')
+    header = 'Duration, s\tRate, msgs/s\tMax RSS, MB\tUser time, s\tSystem time, s'
+    if ack:
+        header += '\tAck p50, ms\tAck p99, ms\tAck p999, ms'
+    print(header)
     def report(duration, count):
         usage = resource.getrusage(resource.RUSAGE_SELF)
         maxrss = usage.ru_maxrss // 1024
         if sys.platform == 'darwin':
             maxrss = maxrss // 1024
-        print('{0:2.2f}\t\t{1}\t\t{2}\t\t{3:2.2f}\t\t{4:2.2f}'.format(
+        line = '{0:2.2f}\t\t{1}\t\t{2}\t\t{3:2.2f}\t\t{4:2.2f}'.format(
             duration,
             int(count / duration),
             maxrss,
             usage.ru_utime - last_usage[0].ru_utime,
-            usage.ru_stime - last_usage[0].ru_stime))
+            usage.ru_stime - last_usage[0].ru_stime)
+        # replies keep being recorded into a fresh histogram meanwhile
+        latency = publisher.metrics.take_ack_latency(u'rtm/publish')
+        if ack and latency.count:
+            line += '\t\t{0:2.2f}\t\t{1:2.2f}\t\t{2:2.2f}'.format(
+                *[latency.percentile(p) * 1000 for p in (50, 99, 99.9)])
+        print(line)
         sys.stdout.flush()
         last_usage[0] = usage
 
@@ -114,7 +138,16 @@ def bench_publish(endpoint, appkey, channel, size, profile, ack=True):
             count[0] += 1
         publisher.publish(channel, message, callback)
 
-    publish = publish_with_ack if ack else publish_without_ack
+    def publish_batch_with_ack():
+        def callback(ack):
+            count[0] += 1
+        publisher.publish_many(channel, messages, callback)
+
+    if batch:
+        messages = [message] * batch
+        publish = publish_batch_with_ack
+    else:
+        publish = publish_with_ack if ack else publish_without_ack
 
     before = time.time()
     try:
@@ -139,7 +172,7 @@ def bench_publish(endpoint, appkey, channel, size, profile, ack=True):
 
 def bench_subscribe(endpoint, appkey, channel):
     print('subscribe')
-    subscriber = satori.rtm.connection.Connection(endpoint + '?appkey=' + appkey)
+    subscriber = satori.rtm.connection.Connection(endpoint, appkey)
     counter = [0]
 
     class CountingThingy(object):
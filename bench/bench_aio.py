@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Compares N threaded connections with N asyncio connections: number of
+threads, resident memory and publish throughput.
+
+Usage:
+  bench_aio.py [options]
+
+Options:
+ --mode <mode>                # threads | aio [default: aio]
+ --connections <connections>  [default: 100]
+ --size <size>                # message size [default: 128]
+ --duration <duration>        # in seconds [default: 10]
+ --endpoint <endpoint>
+ --appkey <appkey>
+ --uvloop
+"""
+
+import asyncio
+import binascii
+import docopt
+import os
+import resource
+import sys
+import threading
+import time
+
+if '--uvloop' in sys.argv:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+import satori.rtm.aio
+import satori.rtm.connection
+from test.utils import get_test_endpoint_and_appkey, make_channel_name
+
+test_endpoint, test_appkey = get_test_endpoint_and_appkey()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+
+    endpoint = args['--endpoint'] or test_endpoint
+    appkey = args['--appkey'] or test_appkey
+    connections = int(args['--connections'])
+    size = int(args['--size'])
+    duration = float(args['--duration'])
+    mode = args['--mode']
+
+    message = binascii.hexlify(os.urandom(size // 2)).decode('ascii')
+    channel = make_channel_name('bench_aio')
+
+    if mode == 'threads':
+        count = bench_threads(
+            endpoint, appkey, channel, message, connections, duration)
+    elif mode == 'aio':
+        count = asyncio.get_event_loop().run_until_complete(
+            bench_aio(
+                endpoint, appkey, channel, message, connections, duration))
+    else:
+        print('Unknown mode {}'.format(mode))
+        return 1
+
+    print('Connections\tThreads\tRSS, MB\tRate, msgs/s')
+    print('{0}\t\t{1}\t{2}\t{3}'.format(
+        connections, report[0], report[1], int(count / duration)))
+
+
+report = [None, None]
+
+
+def take_snapshot():
+    report[0] = threading.active_count()
+    report[1] = rss_in_megabytes()
+
+
+def rss_in_megabytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    if sys.platform == 'darwin':
+        maxrss = maxrss // 1024
+    return maxrss
+
+
+def bench_threads(endpoint, appkey, channel, message, connections, duration):
+    pool = []
+    for _ in range(connections):
+        connection = satori.rtm.connection.Connection(endpoint, appkey)
+        connection.start()
+        pool.append(connection)
+    take_snapshot()
+
+    count = [0]
+    lock = threading.Lock()
+
+    def callback(ack):
+        with lock:
+            count[0] += 1
+
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for connection in pool:
+            connection.publish(channel, message, callback)
+
+    for connection in pool:
+        connection.stop()
+    return count[0]
+
+
+async def bench_aio(endpoint, appkey, channel, message, connections, duration):
+    pool = [
+        satori.rtm.aio.Connection(endpoint, appkey)
+        for _ in range(connections)]
+    await asyncio.gather(*[c.start() for c in pool])
+    take_snapshot()
+
+    count = [0]
+    deadline = time.time() + duration
+
+    async def publish_until_deadline(connection):
+        while time.time() < deadline:
+            await connection.publish(channel, message)
+            count[0] += 1
+
+    await asyncio.gather(*[publish_until_deadline(c) for c in pool])
+    await asyncio.gather(*[c.stop() for c in pool])
+    return count[0]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Compares the codecs of satori.rtm.codec on representative PDUs: encoding a
+message into a complete rtm/publish PDU the way Connection.publish does and
+decoding an incoming rtm/subscription/data PDU. Codecs whose package is not
+installed are skipped.
+
+Usage:
+  bench_codec.py [options]
+
+Options:
+ --size <size>          # message size [default: 128]
+ --batch <batch>        # messages per subscription data PDU [default: 10]
+ --count <count>        # number of PDUs [default: 100000]
+ --repeat <repeat>      # [default: 3]
+"""
+
+import docopt
+import sys
+import time
+
+from satori.rtm.codec import get_codec
+from satori.rtm.connection import Connection
+
+codecs = [
+    ('json', 'json'), ('stdlib-json', 'json'), ('rapidjson', 'json'),
+    ('ujson', 'json'), ('orjson', 'json'), ('cbor', 'cbor')]
+
+
+def make_message(size):
+    return {
+        u'payload': u'x' * max(size - 60, 0), u'n': 1, u'ratio': 0.25,
+        u'tags': [u'a', u'b'], u'ok': True}
+
+
+def bench_encode(conn, message, count):
+    dumps = conn._dumps
+    before = time.time()
+    for _ in range(count):
+        conn._make_channel_payload(
+            u'rtm/publish', u'channel', dumps(message), None)
+    return time.time() - before
+
+
+def bench_decode(conn, pdu, count):
+    loads = conn._loads
+    before = time.time()
+    for _ in range(count):
+        loads(pdu)
+    return time.time() - before
+
+
+def bench(name, protocol, size, batch, count):
+    try:
+        get_codec(name, protocol)
+    except ImportError:
+        return
+    conn = Connection(
+        'ws://localhost', 'appkey', protocol=protocol, codec=name)
+    message = make_message(size)
+    pdu = conn._dumps({
+        u'action': u'rtm/subscription/data',
+        u'body': {
+            u'channel': u'channel', u'position': u'1234567890:0',
+            u'messages': [message] * batch}})
+    if protocol == 'json' and isinstance(pdu, bytes):
+        # text frames reach the codec as text
+        pdu = pdu.decode('utf8')
+
+    encode = bench_encode(conn, message, count)
+    decode = bench_decode(conn, pdu, count)
+    print('{0:<12}\t{1}\t\t{2}'.format(
+        name, int(count / encode), int(count / decode)))
+    sys.stdout.flush()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    size = int(args['--size'])
+    batch = int(args['--batch'])
+    count = int(args['--count'])
+
+    print('Codec\t\tPublish PDUs/s\tData PDUs/s')
+    for _ in range(int(args['--repeat'])):
+        for name, protocol in codecs:
+            bench(name, protocol, size, batch, count)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
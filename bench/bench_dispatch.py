@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Measures how many subscription data events per second the client event
+loop dispatches: a producer thread plays the WebSocket reader and puts
+ChannelData events while the event loop thread takes them with
+InternalClient.process_one_message and hands them to the subscription.
+'legacy' is the queue.Queue based queue of satori-rtm-sdk 1.5. 'batch'
+drains the queue with InternalClient.process_many instead, 'merged' also
+passes a run of data events of one subscription in a single call. Each
+event carries --messages messages; the last column is the time the loop
+spends per message.
+
+Usage:
+  bench_dispatch.py [options]
+
+Options:
+ --count <count>        # number of events [default: 200000]
+ --producers <n>        # number of producer threads [default: 1]
+ --messages <n>         # number of messages in an event [default: 1]
+ --repeat <repeat>      # [default: 3]
+"""
+
+import docopt
+import sys
+import threading
+import time
+
+from six.moves import queue as six_queue
+
+import satori.rtm.internal_client_action as a
+from satori.rtm.internal_client import InternalClient
+import satori.rtm.internal_queue as queue
+
+
+class LegacyQueue(six_queue.Queue):
+    def __init__(self, maxsize):
+        self.softmaxsize = maxsize
+        six_queue.Queue.__init__(self)
+
+    def _put(self, item):
+        is_user_action = type(item) in list(queue.user_actions)
+        if len(self.queue) >= self.softmaxsize and is_user_action:
+            raise queue.Full
+        six_queue.Queue._put(self, item)
+
+
+class LegacyClient(InternalClient):
+    def process_one_message(self, timeout=1):
+        m = self._queue.get(block=True, timeout=timeout)
+        result = self.process_message(m)
+        self._queue.task_done()
+        return result
+
+
+class CountingSubscription(object):
+    def __init__(self):
+        self.count = 0
+
+    def on_subscription_data(self, data):
+        self.count += len(data[u'messages'])
+
+
+def bench(name, make_queue, client_class, count, producers, messages,
+          batch=False, merge=False):
+    q = make_queue(20000)
+    client = client_class(
+        q, 'ws://localhost', 'appkey', merge_subscription_data=merge)
+    subscription = CountingSubscription()
+    client.subscriptions[u'channel'] = subscription
+    data = {
+        u'subscription_id': u'channel',
+        u'messages': [None] * messages,
+        u'position': 1}
+    per_producer = count // producers
+    total = per_producer * producers * messages
+
+    def produce():
+        event = a.ChannelData(data)
+        for _ in range(per_producer):
+            q.put(event)
+
+    threads = [threading.Thread(target=produce) for _ in range(producers)]
+    before = time.time()
+    for t in threads:
+        t.start()
+    if batch:
+        while subscription.count < total:
+            client.process_many(timeout=None)
+    else:
+        for _ in range(per_producer * producers):
+            client.process_one_message(timeout=None)
+    duration = time.time() - before
+    for t in threads:
+        t.join()
+    assert subscription.count == total
+    print('{0}\t{1:.3f}\t\t{2}\t\t{3:.0f}'.format(
+        name, duration, int(per_producer * producers / duration),
+        duration * 1e9 / total))
+    sys.stdout.flush()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    count = int(args['--count'])
+    producers = int(args['--producers'])
+    messages = int(args['--messages'])
+
+    print('Queue\tDuration, s\tRate, events/s\tns/message')
+    for _ in range(int(args['--repeat'])):
+        bench('legacy', LegacyQueue, LegacyClient, count, producers, messages)
+        bench('deque', queue.Queue, InternalClient, count, producers, messages)
+        bench(
+            'batch', queue.Queue, InternalClient, count, producers, messages,
+            batch=True)
+        bench(
+            'merged', queue.Queue, InternalClient, count, producers, messages,
+            batch=True, merge=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Measures how long it takes to wrap an already serialized message into
+a complete rtm/publish PDU, with and without an id, for both protocols.
+'legacy' is the builder of satori-rtm-sdk 1.5 that encoded the whole
+envelope for every PDU, 'cached' is the one of Connection that caches
+everything but the id and the message per channel, 'publisher' is
+a Connection.publisher handle that holds the envelope of its channel.
+
+Usage:
+  bench_envelope.py [options]
+
+Options:
+ --count <count>        # number of PDUs [default: 200000]
+ --repeat <repeat>      # [default: 3]
+"""
+
+import cbor2
+import docopt
+import itertools
+import json
+import sys
+import time
+
+from satori.rtm.connection import Connection
+
+
+def legacy_payload(protocol, action_ids, name, channel, message, callback):
+    if protocol == 'json':
+        body = u'{{"channel":"{0}","message": {1}}}'.format(channel, message)
+    else:
+        body = b''.join([
+            b'\xa2',
+            cbor2.dumps(u'channel'),
+            cbor2.dumps(channel),
+            cbor2.dumps(u'message'),
+            message])
+    if callback:
+        action_id = next(action_ids)
+        if protocol == 'cbor':
+            return b''.join([
+                b'\xa3',
+                cbor2.dumps(u'action'),
+                cbor2.dumps(name),
+                cbor2.dumps(u'id'),
+                cbor2.dumps(action_id),
+                cbor2.dumps(u'body'),
+                body])
+        return u''.join([
+            u'{"action":"',
+            name,
+            u'","id":',
+            str(action_id),
+            u',"body":',
+            body,
+            u'}']).encode('utf8')
+    if protocol == 'cbor':
+        return b''.join([
+            b'\xa2',
+            cbor2.dumps(u'action'),
+            cbor2.dumps(name),
+            cbor2.dumps(u'body'),
+            body])
+    return u''.join([
+        u'{"action":"',
+        name,
+        u'","body":',
+        body,
+        u'}']).encode('utf8')
+
+
+def bench_legacy(protocol, message, callback, count):
+    action_ids = itertools.count()
+    # Connection keeps callbacks by id too
+    callbacks = {}
+    before = time.time()
+    for _ in range(count):
+        legacy_payload(
+            protocol, action_ids, u'rtm/publish', u'channel', message,
+            callback)
+        if callback:
+            callbacks[len(callbacks)] = callback
+    return time.time() - before
+
+
+def bench_cached(protocol, message, callback, count):
+    conn = Connection('ws://localhost', 'appkey', protocol=protocol)
+    before = time.time()
+    for _ in range(count):
+        conn._make_channel_payload(
+            u'rtm/publish', u'channel', message, callback)
+    return time.time() - before
+
+
+def bench_publisher(protocol, message, callback, count):
+    conn = Connection('ws://localhost', 'appkey', protocol=protocol)
+    envelope = conn.publisher(u'channel')._envelope
+    before = time.time()
+    for _ in range(count):
+        conn._make_message_payload(
+            u'rtm/publish', envelope, message, callback)
+    return time.time() - before
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    count = int(args['--count'])
+    value = {u'text': u'hello', u'n': 42}
+    messages = {'json': json.dumps(value), 'cbor': cbor2.dumps(value)}
+
+    print('Protocol\tAck\tLegacy, ns/PDU\tCached, ns/PDU\tPublisher, ns/PDU')
+    for _ in range(int(args['--repeat'])):
+        for protocol in ['json', 'cbor']:
+            for callback in [None, lambda ack: None]:
+                message = messages[protocol]
+                legacy = bench_legacy(protocol, message, callback, count)
+                cached = bench_cached(protocol, message, callback, count)
+                publisher = bench_publisher(
+                    protocol, message, callback, count)
+                print('{0}\t\t{1}\t{2:.0f}\t\t{3:.0f}\t\t{4:.0f}'.format(
+                    protocol, 'yes' if callback else 'no',
+                    legacy / count * 1e9, cached / count * 1e9,
+                    publisher / count * 1e9))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Measures what disabled logging costs per subscription data message on
+the way from an incoming text frame to the observer: Connection parses
+the frame, the client event loop dispatches it and the subscription
+hands it to the observer. The satori.rtm logger is set to WARNING.
+'unguarded' forces the cached level flags on so that every logger.debug
+and logger.info call is made and rejected by the logger itself, as in
+satori-rtm-sdk 1.5; 'guarded' skips them by checking the flags.
+
+Usage:
+  bench_logging.py [options]
+
+Options:
+ --count <count>        # number of messages [default: 100000]
+ --repeat <repeat>      # [default: 3]
+"""
+
+import docopt
+import json
+import logging
+import sys
+import time
+
+import satori.rtm.internal_logger as internal_logger
+from satori.rtm.connection import Connection
+from satori.rtm.internal_client import InternalClient
+from satori.rtm.internal_subscription import Subscription, SubscriptionMode
+import satori.rtm.internal_queue as queue
+
+
+class CountingObserver(object):
+    def __init__(self):
+        self.count = 0
+
+    def on_subscription_data(self, data):
+        self.count += len(data[u'messages'])
+
+
+def make_pipeline():
+    q = queue.Queue(maxsize=float('inf'))
+    client = InternalClient(q, 'ws://localhost', 'appkey')
+    connection = Connection('ws://localhost', 'appkey', protocol='json')
+    connection.delegate = client
+    observer = CountingObserver()
+    subscription = Subscription(
+        SubscriptionMode.ADVANCED, lambda args: None, lambda: None,
+        observer=observer)
+    subscription.connect()
+    subscription.on_subscribe_ok({u'body': {}})
+    client.subscriptions[u'channel'] = subscription
+    return connection, client, observer
+
+
+def bench(name, count, frame, guarded):
+    connection, client, observer = make_pipeline()
+    if not guarded:
+        internal_logger.levels.debug = internal_logger.levels.info = True
+
+    before = time.time()
+    for _ in range(count):
+        connection.on_incoming_text_frame(frame)
+        client.process_one_message(timeout=None)
+    duration = time.time() - before
+
+    assert observer.count == count
+    print('{0}\t{1:.3f}\t\t{2:.0f}'.format(
+        name, duration, duration * 1e9 / count))
+    sys.stdout.flush()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    count = int(args['--count'])
+
+    logger = logging.getLogger('satori.rtm')
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.NullHandler())
+
+    frame = json.dumps({
+        u'action': u'rtm/subscription/data',
+        u'body': {
+            u'subscription_id': u'channel',
+            u'position': u'1485444476:0',
+            u'messages': [{u'text': u'hello', u'n': 1}]}})
+
+    print('Logging\tDuration, s\tns/message')
+    for _ in range(int(args['--repeat'])):
+        bench('unguarded', count, frame, guarded=False)
+        bench('guarded', count, frame, guarded=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Compares masking implementations from miniws4py.framing
+(and wsaccel if it is installed) across payload sizes, as well
+as building whole masked frames.
+
+Usage:
+  bench_mask.py [options]
+
+Options:
+ --sizes <sizes>        # comma separated payload sizes in bytes [default: 64,1024,16384,65536,1048576]
+ --bytes <bytes>        # amount of data to mask per measurement [default: 16777216]
+"""
+
+import docopt
+import os
+import sys
+import time
+
+from miniws4py.framing import Frame, OPCODE_BINARY, mask_implementations
+
+
+def implementations():
+    result = dict(mask_implementations)
+    try:
+        import wsaccel.xormask
+    except ImportError:
+        pass
+    else:
+        def wsaccel_mask_into(buf, offset, data, key):
+            masker = wsaccel.xormask.XorMaskerSimple(key)
+            buf[offset:offset + len(data)] = masker.process(data)
+        result['wsaccel'] = wsaccel_mask_into
+    return result
+
+
+def build_frame(buf, offset, data, key):
+    Frame(opcode=OPCODE_BINARY, body=data, fin=1, masked=True).build()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    sizes = [int(s) for s in args['--sizes'].split(',')]
+    total = int(args['--bytes'])
+
+    print('Implementation\tSize, B\t\tRate, frames/s\tThroughput, MB/s')
+    for size in sizes:
+        data = os.urandom(size)
+        key = os.urandom(4)
+        buf = bytearray(size)
+        count = max(total // size, 1)
+        candidates = sorted(implementations().items())
+        candidates.append(('frame', build_frame))
+        for name, mask_into in candidates:
+            # the byte loop takes ages on big totals, give it less work
+            n = max(count // 64, 1) if name == 'loop' else count
+            before = time.time()
+            for _ in range(n):
+                mask_into(buf, 0, data, key)
+            duration = time.time() - before
+            print('{0}\t\t{1}\t\t{2}\t\t{3:.1f}'.format(
+                name, size, int(n / duration),
+                n * size / duration / 1024 / 1024))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Feeds a stream of incoming WebSocket frames through the generator based
+stream parser (WebSocket.once) and the zero-copy frame reader
+(WebSocket.receive). No network involved, only parsing and dispatching.
+
+Usage:
+  bench_parser.py [options]
+
+Options:
+ --size <size>          # message size [default: 128]
+ --count <count>        # number of messages [default: 100000]
+ --chunk <chunk>        # max bytes returned by a single recv [default: 65536]
+ --input <file>         # raw server to client bytes recorded after handshake
+ --repeat <repeat>      # [default: 3]
+ --skip-utf8            # leave UTF-8 validation to the consumer
+"""
+
+import docopt
+import struct
+import sys
+import time
+
+from miniws4py.websocket import WebSocket
+
+
+def server_frame(payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x81, length)
+    elif length < (1 << 16):
+        header = struct.pack('!BBH', 0x81, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, length)
+    return header + payload
+
+
+def recorded_stream(size, count):
+    pdu = '{{"action":"rtm/subscription/data","body":{{"messages":["{0}"]}}}}'
+    payload = pdu.format('x' * max(size - len(pdu) + 6, 0)).encode('utf8')
+    return server_frame(payload) * count
+
+
+class MemorySocket(object):
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.position = 0
+        self.chunk = chunk
+
+    def recv(self, size, flags=0):
+        size = min(size, self.chunk)
+        result = self.data[self.position:self.position + size].tobytes()
+        self.position += len(result)
+        return result
+
+    def recv_into(self, buf):
+        size = min(len(buf), self.chunk, len(self.data) - self.position)
+        buf[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def exhausted(self):
+        return self.position >= len(self.data)
+
+
+class CountingWebSocket(WebSocket):
+    def __init__(self, sock):
+        WebSocket.__init__(self, sock)
+        self.count = 0
+
+    def received_message(self, message):
+        self.count += 1
+
+
+def bench(name, data, chunk, read, validate_utf8):
+    ws = CountingWebSocket(MemorySocket(data, chunk))
+    ws.stream.validate_utf8 = validate_utf8
+    step = getattr(ws, read)
+    before = time.time()
+    while not ws.sock.exhausted():
+        step()
+    duration = time.time() - before
+    print('{0}\t{1:.3f}\t\t{2}\t\t{3:.1f}'.format(
+        name, duration, int(ws.count / duration),
+        len(data) / duration / 1024 / 1024))
+    sys.stdout.flush()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    chunk = int(args['--chunk'])
+    validate_utf8 = not args['--skip-utf8']
+
+    if args['--input']:
+        with open(args['--input'], 'rb') as f:
+            data = f.read()
+    else:
+        data = recorded_stream(int(args['--size']), int(args['--count']))
+
+    print('Parser\tDuration, s\tRate, msgs/s\tThroughput, MB/s')
+    for _ in range(int(args['--repeat'])):
+        bench('once', data, chunk, 'once', validate_utf8)
+        bench('receive', data, chunk, 'receive', validate_utf8)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
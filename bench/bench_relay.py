@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+__doc__ = """
+Relays subscription data from one connection to another the way a gateway
+would: every incoming rtm/subscription/data PDU is republished with
+publish_many. Compares decoding and encoding the messages again with
+forwarding them as RTM encoded them (keep_raw_messages and
+publish_many_preserialized_messages). No network involved, outgoing frames
+are masked and written to a socket that drops them.
+
+Usage:
+  bench_relay.py [options]
+
+Options:
+ --size <size>          # message size [default: 128]
+ --batch <batch>        # messages per subscription data PDU [default: 10]
+ --count <count>        # number of messages [default: 100000]
+ --repeat <repeat>      # [default: 3]
+"""
+
+import cbor2
+import docopt
+import json
+import sys
+import time
+
+from miniws4py.websocket import WebSocket
+from satori.rtm.connection import Connection
+
+
+class NullSocket(object):
+    def __init__(self):
+        self.written = 0
+
+    def sendall(self, data, flags=0):
+        self.written += len(data)
+
+
+def make_message(size):
+    return {u'payload': u'x' * max(size - 15, 0), u'n': 1}
+
+
+def incoming_pdus(protocol, size, batch, count):
+    body = {
+        u'channel': u'source', u'position': u'1234567890:0',
+        u'messages': [make_message(size)] * batch}
+    pdu = {u'action': u'rtm/subscription/data', u'body': body}
+    if protocol == 'json':
+        encoded = json.dumps(pdu)
+    else:
+        encoded = cbor2.dumps(pdu)
+    return [encoded] * (count // batch)
+
+
+class Relay(object):
+    def __init__(self, protocol, raw):
+        self.raw = raw
+        self.inbound = Connection(
+            'ws://localhost', 'appkey', protocol=protocol,
+            keep_raw_messages=raw)
+        self.inbound.delegate = self
+        self.outbound = Connection(
+            'ws://localhost', 'appkey', protocol=protocol)
+        self.outbound.ws = WebSocket(NullSocket())
+        self.outbound.ws.masked = True
+        self.count = 0
+
+    def on_subscription_data(self, data):
+        messages = data[u'messages']
+        if self.raw:
+            self.outbound.publish_many_preserialized_messages(
+                u'target', messages.raw)
+        else:
+            self.outbound.publish_many(u'target', messages)
+        self.count += len(messages)
+
+    def feed(self, pdus):
+        if self.inbound.protocol == 'json':
+            receive = self.inbound.on_incoming_text_frame
+        else:
+            receive = self.inbound.on_incoming_binary_frame
+        for pdu in pdus:
+            receive(pdu)
+
+
+def bench(protocol, raw, pdus):
+    relay = Relay(protocol, raw)
+    before = time.time()
+    relay.feed(pdus)
+    duration = time.time() - before
+    print('{0}\t\t{1}\t{2:.3f}\t\t{3}\t\t{4:.1f}'.format(
+        protocol, 'raw' if raw else 'decoded', duration,
+        int(relay.count / duration),
+        relay.outbound.ws.sock.written / duration / 1024 / 1024))
+    sys.stdout.flush()
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    size = int(args['--size'])
+    batch = int(args['--batch'])
+    count = int(args['--count'])
+
+    print('Protocol\tMode\tDuration, s\tRate, msgs/s\tOutput, MB/s')
+    for _ in range(int(args['--repeat'])):
+        for protocol in ['json', 'cbor']:
+            pdus = incoming_pdus(protocol, size, batch, count)
+            bench(protocol, False, pdus)
+            bench(protocol, True, pdus)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,15 @@
 
 from __future__ import print_function
 
+import cbor2
 import docopt
 try:
     import rapidjson as json
 except ImportError:
     import json
+from contextlib import contextmanager
 import logging
+import multiprocessing
 import os
 from six.moves import queue
 import sys
@@ -15,10 +18,16 @@ import threading
 import time
 import toml
 from xdg import XDG_CONFIG_HOME
+import zlib
 
 import satori.rtm.connection
 from satori.rtm.client import make_client, SubscriptionMode
 from satori.rtm.auth import RoleSecretAuthDelegate
+from satori.rtm.metrics import Histogram
+from satori_rtm_cli import sink
+from satori_rtm_cli.recording import (
+    RecordingReader, get_compressor, is_recording)
+from satori_rtm_cli.scheduler import ReplayScheduler
 
 try:
     satori.rtm.connection.enable_wsaccel()
@@ -56,11 +65,25 @@ Options:
     --count <count>  # include this many past messages in the subscription data
     --age <age>  # include this many past seconds worth of messages in the subscription data
     -l <N|inf> --loop <N|inf>  # loop playback N times, `--loop inf` means loop forever, compatible only with --input_file option
+    -f <json|binary> --format <json|binary>  # format of the recording, a JSON object per line (default) or binary with a time index for seeking
+    --compression <compression>  # compression of binary recordings, one of none (default), zlib, zstd (needs zstandard package) or lz4 (needs lz4 package)
+    --rotate_size <size>  # start a new file every time the recording grows by this many bytes, like 100M, files are named like the output file with a sequence number appended, needs --output_file
+    --rotate_interval <seconds>  # start a new file every this many seconds, needs --output_file
+    --buffer_size <pdus>  # subscription data waiting to be written, default is 10000
+    --backpressure <drop|block>  # what to do with subscription data when the buffer is full, drop it (default) or wait for the writer
+    --from <seconds>  # replay from this many seconds since the start of the recording
+    --to <seconds>  # replay up to this many seconds since the start of the recording
+    --max_rate <messages_per_second>  # never replay faster than this many messages per second, like 1000 or 1000/s, combine with --rate unlimited for a constant rate
+    --connections <N>  # replay over N connections, each channel is published over one of them to keep its messages in order, default is 1
+    --processes <N>  # replay from N processes with --connections connections each, channels are split between them like between connections, default is 1, needs --input_file
 '''
 
 
 default_endpoint = 'wss://open-data.api.satori.com'
 
+# most messages of a channel that replay publishes with a single write
+max_replay_batch = 1024
+
 
 logger = logging.getLogger('satori-rtm-cli')
 
@@ -138,6 +161,14 @@ def main():
     else:
         rate = 1
 
+    try:
+        start = parse_seconds(args['--from'])
+        end = parse_seconds(args['--to'])
+        max_rate = parse_rate(args['--max_rate'])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
     if role_name and role_secret:
         auth_delegate = RoleSecretAuthDelegate(role_name, role_secret)
     else:
@@ -161,9 +192,57 @@ def main():
 
     enable_acks = not args['--disable_acks']
 
+    try:
+        connections = parse_count(args['--connections'])
+        processes = parse_count(args['--processes'])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if (args['--connections'] or args['--processes']) and not args['replay']:
+        print('--connections and --processes only work with replay',
+              file=sys.stderr)
+        sys.exit(1)
+    if processes > 1 and not args['--input_file']:
+        print('--processes needs --input_file', file=sys.stderr)
+        sys.exit(1)
+
+    if args['record']:
+        try:
+            rotate_size = parse_size(args['--rotate_size'])
+            rotate_interval = parse_seconds(args['--rotate_interval'])
+            buffer_size = parse_count(
+                args['--buffer_size'] or str(sink.default_buffer_size))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if (rotate_size or rotate_interval) and not args['--output_file']:
+            print('Rotation needs --output_file', file=sys.stderr)
+            sys.exit(1)
+        backpressure = args['--backpressure'] or 'drop'
+        if backpressure not in ('drop', 'block'):
+            print('Invalid backpressure {0}'.format(backpressure),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if args['replay']:
+        if args['--loop'] == 'inf':
+            loop = float('inf')
+        else:
+            loop = int(args['--loop'] or 1)
+        replay_kwargs = dict(
+            override_channel=args['--override_channel'], rate=rate,
+            loop=loop,
+            input_file=args['--input_file'], enable_acks=enable_acks,
+            start=start, end=end, max_rate=max_rate)
+
     observer = ClientObserver()
     logger.warning('Connecting to %s using appkey %s', endpoint, appkey)
 
+    if args['replay'] and (connections > 1 or processes > 1):
+        return parallel_replay(
+            endpoint, appkey, auth_delegate, connections, processes,
+            replay_kwargs, int_to_loglevel[verbosity])
+
     with make_client(
             endpoint, appkey,
             auth_delegate=auth_delegate, observer=observer) as client:
@@ -223,18 +302,14 @@ def main():
                 args['<channels>'],
                 size_limit=size_limit, count_limit=count_limit,
                 time_limit=time_limit, output_file=args['--output_file'],
+                output_format=args['--format'] or 'json',
+                compression=args['--compression'] or 'none',
+                rotate_size=rotate_size, rotate_interval=rotate_interval,
+                buffer_size=buffer_size, backpressure=backpressure,
                 extra_args=extra_args,
                 delivery=delivery)
         elif args['replay']:
-            if args['--loop'] == 'inf':
-                loop = float('inf')
-            else:
-                loop = int(args['--loop'] or 1)
-            return replay(
-                client,
-                override_channel=args['--override_channel'], rate=rate,
-                loop=loop,
-                input_file=args['--input_file'], enable_acks=enable_acks)
+            return replay(client, **replay_kwargs)
         elif args['read']:
             return kv_read(
                 client,
@@ -315,6 +390,46 @@ assert parse_size('1g') == 1000000000
 assert parse_size('24k') == 24000
 
 
+def parse_seconds(seconds_string):
+    if seconds_string is None:
+        return None
+    try:
+        return float(seconds_string)
+    except ValueError:
+        raise ValueError('Invalid number of seconds {0}'.format(
+            seconds_string))
+
+
+def parse_rate(rate_string):
+    if rate_string is None:
+        return None
+    try:
+        rate = float(rate_string[:-2] if rate_string.endswith('/s')
+                     else rate_string)
+    except ValueError:
+        rate = 0
+    if not rate > 0:
+        raise ValueError('Invalid rate {0}'.format(rate_string))
+    return rate
+
+
+def parse_count(count_string):
+    if count_string is None:
+        return 1
+    try:
+        count = int(count_string)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise ValueError('Invalid count {0}'.format(count_string))
+    return count
+
+
+assert parse_rate(None) is None
+assert parse_rate('1000') == 1000
+assert parse_rate('2.5/s') == 2.5
+
+
 def publish(client, channel, enable_acks):
     print('Sending input to {0}, press C-d or C-c to stop'.format(channel))
 
@@ -360,7 +475,11 @@ def publish(client, channel, enable_acks):
             logger.info('%s publishes remain unacked', counter.value())
 
 
-def replay(client, override_channel=None, rate=1.0, loop=1, input_file=None, enable_acks=True):
+def replay(
+        client, override_channel=None, rate=1.0, loop=1, input_file=None,
+        enable_acks=True, start=None, end=None, max_rate=None,
+        channel_filter=None):
+    reader = None
     try:
         publish_counter = Counter()
         publish_ack_counter = Counter()
@@ -375,65 +494,61 @@ def replay(client, override_channel=None, rate=1.0, loop=1, input_file=None, ena
         else:
             callback = None
 
-        input_stream = sys.stdin
+        if input_file is not None and is_recording(input_file):
+            # mapped once for all the playback cycles
+            reader = RecordingReader(input_file)
+            publish = make_recording_publisher(client, reader.protocol)
+        else:
+            def publish(channel, messages, callback):
+                for message in messages:
+                    try:
+                        client.publish(channel, message, callback=callback)
+                    except queue.Full:
+                        logger.error('Publish queue is full')
+
+        if channel_filter:
+            def keep(channel):
+                return channel_filter(override_channel or channel)
+        else:
+            keep = None
 
-        while loop >= 1:
-            first_message_send_date = None
-            first_message_recv_date = None
+        scheduler = ReplayScheduler(
+            rate=rate, max_rate=max_rate,
+            max_batch=max_replay_batch if input_file else 1, keep=keep)
 
-            if input_file:
+        while loop >= 1:
+            if reader:
+                records = read_binary_recording(reader, start, end, rate)
+            elif input_file:
                 input_stream = open(input_file)
+                records = read_json_lines(input_stream, start, end)
+            else:
+                records = read_json_lines(sys.stdin, start, end)
 
-            while True:
-                line = input_stream.readline()
-                if not line:
-                    if input_file:
-                        input_stream.close()
-                        loop -= 1
-                        logger.warning(
-                            'Messages published: %d', publish_counter.value())
-                        if loop == float('inf'):
-                            logger.warning('Playback cycle finished')
-                        elif loop > 0:
-                            logger.warning(
-                                'Playback cycle finished, %d to go', loop)
-                    else:
-                        loop = 0
-                    break
-                line = line.rstrip()
-                try:
-                    data = json.loads(line)
-                    current_message_recv_date = data['timestamp']
-                    channel = override_channel or data['subscription_id']
-                    messages = data['messages']
-                    now = time.time()
-
-                    if first_message_send_date is not None:
-                        sleep_amount =\
-                            ((current_message_recv_date - first_message_recv_date) / rate)\
-                            - (now - first_message_send_date)
-                    else:
-                        sleep_amount = 0
-
-                    if sleep_amount > 0:
-                        time.sleep(sleep_amount)
-
-                    if first_message_send_date is None:
-                        first_message_send_date = time.time()
-                        first_message_recv_date = current_message_recv_date
-
-                    for message in messages:
-                        try:
-                            publish_counter.increment()
-                            client.publish(channel, message, callback=callback)
-                        except queue.Full as e:
-                            logger.error('Publish queue is full')
-
-                except ValueError:
-                    logger.error('Bad line: %s', line)
-                except Exception as e:
-                    logger.error('Exception: %s', e)
-                    stop_main_thread()
+            def publish_due(channel, messages):
+                publish_counter.increment(len(messages))
+                publish(override_channel or channel, messages, callback)
+
+            try:
+                stats = scheduler.run(records, publish_due)
+                logger.warning('Replayed %s', stats.report())
+            except Exception as e:
+                logger.error('Exception: %s', e)
+                stop_main_thread()
+
+            if input_file:
+                if not reader:
+                    input_stream.close()
+                loop -= 1
+                logger.warning(
+                    'Messages published: %d', publish_counter.value())
+                if loop == float('inf'):
+                    logger.warning('Playback cycle finished')
+                elif loop > 0:
+                    logger.warning(
+                        'Playback cycle finished, %d to go', loop)
+            else:
+                loop = 0
 
         logger.warning(
             'Playback finished, total time: %.2f seconds',
@@ -441,6 +556,9 @@ def replay(client, override_channel=None, rate=1.0, loop=1, input_file=None, ena
 
     except KeyboardInterrupt:
         pass
+    finally:
+        if reader:
+            reader.close()
     if not enable_acks:
         return
 
@@ -457,9 +575,239 @@ def replay(client, override_channel=None, rate=1.0, loop=1, input_file=None, ena
                 logger.info('%s publishes remain unacked', unacked_count())
 
 
+def read_json_lines(input_stream, start=None, end=None):
+    '''Yields (timestamp, channel, messages) from a recording with a JSON
+       object per line. start and end are in seconds since the first
+       line.'''
+    first_timestamp = None
+    while True:
+        line = input_stream.readline()
+        if not line:
+            return
+        line = line.rstrip()
+        try:
+            data = json.loads(line)
+        except ValueError:
+            logger.error('Bad line: %s', line)
+            continue
+        timestamp = data['timestamp']
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if start is not None and timestamp - first_timestamp < start:
+            continue
+        if end is not None and timestamp - first_timestamp > end:
+            return
+        yield timestamp, data['subscription_id'], data['messages']
+
+
+def read_binary_recording(reader, start=None, end=None, rate=1.0):
+    '''Yields (timestamp, channel, payloads) from a binary recording,
+       seeking to start with its index. start and end are in seconds since
+       the first record. Payloads are the recorded messages, not decoded.
+       When replaying as fast as possible consecutive messages of a
+       channel are published together.'''
+    first_timestamp = reader.first_timestamp
+    if first_timestamp is None:
+        return iter([])
+    if start is not None:
+        start += first_timestamp
+    if end is not None:
+        end += first_timestamp
+    max_batch = max_replay_batch if rate == float('inf') else 1
+    return reader.batches(start, end, max_batch)
+
+
+def make_recording_publisher(client, protocol):
+    '''Returns a function publishing payloads of a binary recording with
+       a single write, waiting for room in the client queue instead of
+       dropping them'''
+    if protocol == client.protocol:
+        publish_many = client.publish_many_preserialized_messages
+    else:
+        # recorded in the other protocol, the payloads need a conversion
+        loads = cbor2.loads if protocol == 'cbor' else json.loads
+
+        def publish_many(channel, payloads, callback):
+            client.publish_many(
+                channel, [loads(bytes(p)) for p in payloads], callback)
+
+    def publish(channel, payloads, callback):
+        while True:
+            try:
+                return publish_many(channel, payloads, callback)
+            except queue.Full:
+                time.sleep(0.001)
+    return publish
+
+
+def shard_of(channel, count):
+    # stable across processes unlike hash()
+    return (zlib.crc32(channel.encode('utf8')) & 0xffffffff) % count
+
+
+class ShardedClient(object):
+    '''Publishes through one of several clients picked by the channel, so
+       that messages of a channel go over the same connection in order.
+       Channels are split between processes the same way, a process only
+       owns the channels of its shards.'''
+
+    def __init__(self, clients, process_index=0, processes=1):
+        self.clients = clients
+        self._process_index = process_index
+        self._processes = processes
+        self._shards = len(clients) * processes
+        self._client_by_channel = {}
+
+    @property
+    def protocol(self):
+        return self.clients[0].protocol
+
+    def owns(self, channel):
+        shard = shard_of(channel, self._shards)
+        return shard % self._processes == self._process_index
+
+    def client_for(self, channel):
+        client = self._client_by_channel.get(channel)
+        if client is None:
+            shard = shard_of(channel, self._shards)
+            client = self._client_by_channel[channel] =\
+                self.clients[shard // self._processes]
+        return client
+
+    def publish(self, channel, message, callback=None):
+        self.client_for(channel).publish(channel, message, callback=callback)
+
+    def publish_many(self, channel, messages, callback=None):
+        self.client_for(channel).publish_many(channel, messages, callback)
+
+    def publish_many_preserialized_messages(
+            self, channel, messages, callback=None):
+        self.client_for(channel).publish_many_preserialized_messages(
+            channel, messages, callback)
+
+
+@contextmanager
+def make_clients(count, *args, **kwargs):
+    if not count:
+        yield []
+        return
+    with make_client(*args, **kwargs) as client:
+        with make_clients(count - 1, *args, **kwargs) as clients:
+            yield [client] + clients
+
+
+def replay_shard(
+        endpoint, appkey, auth_delegate, connections, replay_kwargs,
+        process_index=0, processes=1, ready=None, go=None):
+    '''Replays the channels of a process over its connections, returns
+       how many messages they published, how long it took and their ack
+       latencies'''
+    with make_clients(
+            connections, endpoint, appkey,
+            auth_delegate=auth_delegate, observer=ClientObserver()) as clients:
+        sharded = ShardedClient(clients, process_index, processes)
+        if ready is not None:
+            # every process starts replaying at once to keep the timing
+            ready.put(process_index)
+            go.wait()
+        started = time.time()
+        replay(
+            sharded,
+            channel_filter=sharded.owns if processes > 1 else None,
+            **replay_kwargs)
+        ack_latency = Histogram()
+        for client in clients:
+            ack_latency.merge(client.metrics.publish_ack_latency)
+        return {
+            'messages': sum(c.metrics.messages_out for c in clients),
+            'elapsed': time.time() - started,
+            'ack_latency': ack_latency}
+
+
+def replay_worker(
+        endpoint, appkey, auth_delegate, connections, replay_kwargs,
+        process_index, processes, ready, go, results, loglevel):
+    if not logger.handlers:
+        configure_logger(loglevel)
+    summary = None
+    try:
+        summary = replay_shard(
+            endpoint, appkey, auth_delegate, connections, replay_kwargs,
+            process_index, processes, ready, go)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error('Replay process %d failed: %s', process_index, e)
+        ready.put(None)
+    results.put(summary)
+
+
+def parallel_replay(
+        endpoint, appkey, auth_delegate, connections, processes,
+        replay_kwargs, loglevel):
+    if processes == 1:
+        summaries = [replay_shard(
+            endpoint, appkey, auth_delegate, connections, replay_kwargs)]
+        return report_parallel_replay(summaries, connections)
+
+    ready = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=replay_worker,
+            args=(
+                endpoint, appkey, auth_delegate, connections, replay_kwargs,
+                i, processes, ready, go, results, loglevel))
+        for i in range(processes)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    summaries = []
+    try:
+        for _ in range(processes):
+            ready.get()
+        go.set()
+        for _ in range(processes):
+            summaries.append(results.get())
+    except KeyboardInterrupt:
+        # workers got the interrupt too and report what they have done
+        for _ in range(processes - len(summaries)):
+            try:
+                summaries.append(results.get(timeout=5))
+            except queue.Empty:
+                break
+    for worker in workers:
+        worker.join(1)
+    report_parallel_replay(summaries, connections * processes)
+
+
+def report_parallel_replay(summaries, connections):
+    summaries = [s for s in summaries if s]
+    if not summaries:
+        return
+    messages = sum(s['messages'] for s in summaries)
+    elapsed = max(s['elapsed'] for s in summaries)
+    ack_latency = Histogram()
+    for s in summaries:
+        ack_latency.merge(s['ack_latency'])
+    logger.warning(
+        'Published %d messages over %d connections in %.2f seconds, '
+        '%.1f msgs/s', messages, connections, elapsed,
+        messages / elapsed if elapsed > 0 else 0)
+    if ack_latency.count:
+        logger.warning(
+            'Ack latency of %d publishes: p50 %.2f ms, p99 %.2f ms, '
+            'p999 %.2f ms, max %.2f ms', ack_latency.count,
+            *[v * 1000 for v in (
+                ack_latency.percentile(50), ack_latency.percentile(99),
+                ack_latency.percentile(99.9), ack_latency.max)])
+
+
 def generic_subscribe(
         client, handle_channel_data, channels,
-        extra_args=None, delivery=None):
+        extra_args=None, delivery=None, raw=False):
     logger.info(
         'Subscribing to %s, press C-c to stop',
         channels[0] if len(channels) == 1 else '{0} channels'.format(
@@ -476,7 +824,11 @@ def generic_subscribe(
         def on_subscription_data(self, data):
             handle_channel_data(data)
 
-    so = SubscriptionObserver()
+    class RawSubscriptionObserver(SubscriptionObserver):
+        def on_subscription_raw_data(self, data):
+            handle_channel_data(data)
+
+    so = RawSubscriptionObserver() if raw else SubscriptionObserver()
 
     delivery = delivery or SubscriptionMode.ADVANCED
 
@@ -529,32 +881,79 @@ def record(client, *args, **kwargs):
     del kwargs['count_limit']
     del kwargs['time_limit']
 
-    if kwargs.get('output_file') is not None:
-        output_stream = open(kwargs.get('output_file'), 'w')
-    else:
-        output_stream = sys.stdout
+    output_format = kwargs.pop('output_format', 'json')
+    compression = kwargs.pop('compression', 'none')
+    if output_format not in ('json', 'binary'):
+        logger.error('Unknown recording format %s', output_format)
+        sys.exit(1)
+    if output_format == 'json' and compression != 'none':
+        logger.error('Only binary recordings can be compressed')
+        sys.exit(1)
 
-    del kwargs['output_file']
+    if output_format == 'binary':
+        try:
+            get_compressor(compression)
+        except (ValueError, ImportError) as e:
+            logger.error('Unsupported compression %s: %s', compression, e)
+            sys.exit(1)
+
+    output_file = kwargs.pop('output_file')
+
+    def open_file(sequence):
+        binary = output_format == 'binary'
+        if output_file is None:
+            stream = getattr(sys.stdout, 'buffer', sys.stdout)\
+                if binary else sys.stdout
+            close_stream = False
+        else:
+            path = output_file if sequence is None else\
+                '{0}.{1:06d}'.format(output_file, sequence)
+            logger.info('Recording to %s', path)
+            stream = open(path, 'wb' if binary else 'w')
+            close_stream = True
+        if binary:
+            # the payloads are recorded in the protocol of the client
+            return sink.BinaryFile(
+                stream, compression, close_stream, client.protocol)
+        return sink.JsonLinesFile(stream, close_stream)
+
+    def on_written(size):
+        if size_limit['size_limit'] is not None:
+            size_limit['size_limit'] -= size
+            if size_limit['size_limit'] <= 0:
+                size_limit['size_limit'] = None
+                logger.info('Log size limit reached')
+                stop_main_thread()
+
+    def on_error(e):
+        stop_main_thread()
+
+    recording_sink = sink.RecordingSink(
+        open_file,
+        rotate_size=kwargs.pop('rotate_size', None),
+        rotate_interval=kwargs.pop('rotate_interval', None),
+        buffer_size=kwargs.pop('buffer_size', sink.default_buffer_size),
+        backpressure=kwargs.pop('backpressure', 'drop'),
+        on_written=on_written, on_error=on_error)
 
     def on_subscription_data(data):
-        data['timestamp'] = time.time()
-        output = json.dumps(data)
-        print(output, file=output_stream)
-        output_stream.flush()
+        # messages are recorded as RTM sent them
+        messages = data.pop('messages')
+        recording_sink.put(time.time(), data, messages)
 
         if count_limit['count_limit'] is not None:
-            count_limit['count_limit'] -= len(data['messages'])
+            count_limit['count_limit'] -= len(messages)
             if count_limit['count_limit'] <= 0:
+                count_limit['count_limit'] = None
                 logger.info('Message count limit reached')
                 stop_main_thread()
 
-        if size_limit['size_limit'] is not None:
-            size_limit['size_limit'] -= len(output)
-            if size_limit['size_limit'] <= 0:
-                logger.info('Log size limit reached')
-                stop_main_thread()
-
-    generic_subscribe(client, on_subscription_data, *args, **kwargs)
+    try:
+        generic_subscribe(
+            client, on_subscription_data, *args, raw=True, **kwargs)
+    finally:
+        recording_sink.close()
+        logger.warning('%s', recording_sink.stats.report())
 
 
 def kv_read(client, key, prettify_json=False):
@@ -651,9 +1050,9 @@ class Counter(object):
         with self._lock:
             return self._value
 
-    def increment(self):
+    def increment(self, n=1):
         with self._lock:
-            self._value += 1
+            self._value += n
 
     def decrement(self):
         with self._lock:
@@ -0,0 +1,328 @@
+'''Binary recording format of the record and replay subcommands.
+
+A recording is a file header followed by blocks of records and, when the
+recording was closed properly, an index of the blocks and a trailer:
+
+    header:  magic 'SRTMREC\\x01', compression id, protocol id, 6 bytes
+             reserved
+    block:   'BLCK', compression id, compressed size, uncompressed size,
+             record count, first and last timestamp, then the (possibly
+             compressed) records
+    record:  timestamp, channel size, payload size, channel (UTF-8),
+             payload (the message as RTM sent it)
+    index:   'INDX', block count, then offset, first and last timestamp
+             of every block
+    trailer: index offset, magic 'SRTMIDX\\x01'
+
+All numbers are little endian. A block is written out every
+`block_size` bytes of records or `block_interval` seconds, so the index
+has an entry every second or so and a reader seeks to a point in time
+by reading the index only. Recordings cut short (the recorder got
+killed) have no index; it is then rebuilt from the block headers without
+reading the records. A block that was being written when the recorder
+died is ignored.
+
+Readers memory map the recording, so replaying it publishes slices of the
+file without reading it into memory or decoding the messages.
+
+Compression is done per block: 'zlib' comes with Python, 'zstd' needs the
+zstandard package and 'lz4' the lz4 package.
+'''
+
+import bisect
+import importlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+magic = b'SRTMREC\x01'
+index_magic = b'SRTMIDX\x01'
+block_magic = b'BLCK'
+index_block_magic = b'INDX'
+
+header_struct = struct.Struct('<8sBB6x')
+block_struct = struct.Struct('<4sBIIIdd')
+record_struct = struct.Struct('<dHI')
+index_struct = struct.Struct('<4sI')
+index_entry_struct = struct.Struct('<Qdd')
+trailer_struct = struct.Struct('<Q8s')
+
+protocols = ['json', 'cbor']
+compressions = ['none', 'zlib', 'zstd', 'lz4']
+
+default_block_size = 64 * 1024
+default_block_interval = 1.0
+
+
+class RecordingError(ValueError):
+    pass
+
+
+def get_compressor(name):
+    '''Returns (compress, decompress) functions for a compression name,
+       raises ImportError when its package is not installed'''
+    if name == 'none':
+        return _identity, _identity
+    if name == 'zlib':
+        return zlib.compress, zlib.decompress
+    if name == 'zstd':
+        zstandard = importlib.import_module('zstandard')
+        return (
+            zstandard.ZstdCompressor().compress,
+            zstandard.ZstdDecompressor().decompress)
+    if name == 'lz4':
+        lz4_frame = importlib.import_module('lz4.frame')
+        return lz4_frame.compress, lz4_frame.decompress
+    raise RecordingError('Unknown compression {0}'.format(name))
+
+
+def _identity(data):
+    return data
+
+
+def is_recording(path):
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+class RecordingWriter(object):
+    '''Appends records to a binary recording. write and close may be
+       called from different threads.'''
+
+    def __init__(
+            self, stream, protocol='json', compression='none',
+            block_size=default_block_size,
+            block_interval=default_block_interval):
+        self._stream = stream
+        self._compress = get_compressor(compression)[0]
+        self._compression_id = compressions.index(compression)
+        self._block_size = block_size
+        self._block_interval = block_interval
+        self._lock = threading.Lock()
+        self._block = []
+        self._block_bytes = 0
+        self._block_count = 0
+        self._first_timestamp = None
+        self._last_timestamp = None
+        self._block_started_at = None
+        self._index = []
+        header = header_struct.pack(
+            magic, self._compression_id, protocols.index(protocol))
+        stream.write(header)
+        self._offset = len(header)
+        self.closed = False
+
+    def write(self, timestamp, channel, payloads):
+        '''Adds a record per payload (text or bytes), returns the number
+           of bytes they take uncompressed'''
+        channel = channel.encode('utf8')
+        written = 0
+        with self._lock:
+            if self.closed:
+                return 0
+            for payload in payloads:
+                if not isinstance(payload, bytes):
+                    payload = payload.encode('utf8')
+                self._block.append(record_struct.pack(
+                    timestamp, len(channel), len(payload)))
+                self._block.append(channel)
+                self._block.append(payload)
+                written += record_struct.size + len(channel) + len(payload)
+                self._block_count += 1
+            if not self._block_count:
+                return written
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._block_started_at = time.time()
+            self._last_timestamp = timestamp
+            self._block_bytes += written
+            if self._block_bytes >= self._block_size or\
+                    time.time() - self._block_started_at >=\
+                    self._block_interval:
+                self._write_block()
+        return written
+
+    def flush(self):
+        with self._lock:
+            if not self.closed:
+                self._write_block()
+
+    def close(self):
+        '''Writes out the last block, the index and the trailer'''
+        with self._lock:
+            if self.closed:
+                return
+            self._write_block()
+            index = [index_struct.pack(index_block_magic, len(self._index))]
+            index.extend(
+                index_entry_struct.pack(*entry) for entry in self._index)
+            index.append(trailer_struct.pack(self._offset, index_magic))
+            self._stream.write(b''.join(index))
+            self._stream.flush()
+            self.closed = True
+
+    def _write_block(self):
+        if not self._block_count:
+            return
+        records = b''.join(self._block)
+        compressed = self._compress(records)
+        self._stream.write(block_struct.pack(
+            block_magic, self._compression_id, len(compressed),
+            len(records), self._block_count,
+            self._first_timestamp, self._last_timestamp))
+        self._stream.write(compressed)
+        self._stream.flush()
+        self._index.append(
+            (self._offset, self._first_timestamp, self._last_timestamp))
+        self._offset += block_struct.size + len(compressed)
+        self._block = []
+        self._block_bytes = 0
+        self._block_count = 0
+        self._first_timestamp = None
+        self._last_timestamp = None
+
+
+class RecordingReader(object):
+    '''Reads records of a binary recording, seeking by time with the
+       index. The file is memory mapped once and payloads are handed out
+       as slices of the mapping (of the decompressed block for compressed
+       recordings) without copying, they stay valid until close.'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < header_struct.size:
+                raise RecordingError('{0} is not a recording'.format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._data = memoryview(self._map)
+        except TypeError:
+            # Python 2 mmap has no buffer interface, slices are copies
+            self._data = self._map
+        file_magic, compression_id, protocol_id =\
+            header_struct.unpack_from(self._map, 0)
+        if file_magic != magic:
+            self.close()
+            raise RecordingError('{0} is not a recording'.format(path))
+        self.compression = compressions[compression_id]
+        self.protocol = protocols[protocol_id]
+        self._decompress = get_compressor(self.compression)[1]
+        self.index = self._read_index() or self._rebuild_index()
+        self._first_timestamps = [entry[1] for entry in self.index]
+
+    def close(self):
+        try:
+            if self._data is not self._map:
+                self._data.release()
+            self._map.close()
+        except BufferError:
+            # payloads still referenced (queued publishes), the mapping
+            # goes away with the last of them
+            pass
+
+    @property
+    def first_timestamp(self):
+        return self.index[0][1] if self.index else None
+
+    @property
+    def last_timestamp(self):
+        return self.index[-1][2] if self.index else None
+
+    def records(self, start=None, end=None):
+        '''Yields (timestamp, channel, payload) of the records with
+           start <= timestamp <= end, timestamps are absolute'''
+        first = 0
+        if start is not None:
+            first = max(
+                0, bisect.bisect_right(self._first_timestamps, start) - 1)
+        for offset, first_timestamp, last_timestamp in self.index[first:]:
+            if end is not None and first_timestamp > end:
+                return
+            if start is not None and last_timestamp < start:
+                continue
+            for record in self._read_block(offset):
+                timestamp = record[0]
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    return
+                yield record
+
+    def batches(self, start=None, end=None, max_batch=1024):
+        '''Yields (timestamp, channel, payloads) for runs of up to
+           max_batch consecutive records of the same channel, timestamp is
+           the one of the first record of the run'''
+        batch = []
+        batch_channel = None
+        batch_timestamp = None
+        for timestamp, channel, payload in self.records(start, end):
+            if batch and (
+                    channel != batch_channel or len(batch) >= max_batch):
+                yield batch_timestamp, batch_channel, batch
+                batch = []
+            if not batch:
+                batch_channel = channel
+                batch_timestamp = timestamp
+            batch.append(payload)
+        if batch:
+            yield batch_timestamp, batch_channel, batch
+
+    def _read_block(self, offset):
+        (_, _, compressed_size, _, count, _, _) =\
+            block_struct.unpack_from(self._map, offset)
+        offset += block_struct.size
+        data = self._decompress(self._data[offset:offset + compressed_size])
+        if self._data is not self._map and not isinstance(data, memoryview):
+            data = memoryview(data)
+        channels = {}
+        position = 0
+        for _ in range(count):
+            timestamp, channel_size, payload_size =\
+                record_struct.unpack_from(data, position)
+            position += record_struct.size
+            raw_channel = bytes(data[position:position + channel_size])
+            channel = channels.get(raw_channel)
+            if channel is None:
+                channel = channels[raw_channel] = raw_channel.decode('utf8')
+            position += channel_size
+            payload = data[position:position + payload_size]
+            position += payload_size
+            yield timestamp, channel, payload
+
+    def _read_index(self):
+        size = len(self._map)
+        if size < header_struct.size + trailer_struct.size:
+            return None
+        index_offset, trailer_magic = trailer_struct.unpack_from(
+            self._map, size - trailer_struct.size)
+        if trailer_magic != index_magic:
+            return None
+        if index_offset + index_struct.size > size:
+            return None
+        index_block_magic_, count = index_struct.unpack_from(
+            self._map, index_offset)
+        if index_block_magic_ != index_block_magic:
+            return None
+        offset = index_offset + index_struct.size
+        return [
+            index_entry_struct.unpack_from(
+                self._map, offset + i * index_entry_struct.size)
+            for i in range(count)]
+
+    def _rebuild_index(self):
+        index = []
+        size = len(self._map)
+        offset = header_struct.size
+        while offset + block_struct.size <= size:
+            (block_magic_, _, compressed_size, _, _,
+                first_timestamp, last_timestamp) =\
+                block_struct.unpack_from(self._map, offset)
+            end = offset + block_struct.size + compressed_size
+            if block_magic_ != block_magic or end > size:
+                break
+            index.append((offset, first_timestamp, last_timestamp))
+            offset = end
+        return index
@@ -0,0 +1,167 @@
+'''Paces replayed messages like they were recorded.
+
+Every message is due at a fixed offset from the start of the playback:
+its offset in the recording divided by the rate. Offsets are measured
+with a monotonic clock from a single origin, so time spent publishing or
+oversleeping does not add up over a long replay. Messages that are due
+within the next `time_slice` are released together, consecutive messages
+of a channel in a single publish of up to `max_batch` messages, so the
+scheduler sleeps at most once per time slice instead of once per message
+and releases messages at most `time_slice` early.
+
+`max_rate` additionally shapes the stream with a token bucket holding up
+to `time_slice` worth of messages, for constant rate load tests.
+'''
+
+import time
+
+# Python 2 has no monotonic clock in the standard library
+monotonic = getattr(time, 'monotonic', time.time)
+
+default_time_slice = 0.01
+default_max_batch = 1024
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, clock=monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def take(self, n):
+        '''Takes n tokens, sleeping until the bucket has refilled enough.
+           Batches larger than the bucket go into debt.'''
+        now = self._clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+        self.tokens -= n
+        if self.tokens < 0:
+            self._sleep(-self.tokens / self.rate)
+
+
+class ReplayStats(object):
+    def __init__(self):
+        self.messages = 0
+        self.publishes = 0
+        self.elapsed = 0.0
+        # time between the first and the last message in the recording
+        self.recorded_span = 0.0
+        # the latest a message was released after it was due, in seconds
+        self.max_lag = 0.0
+        self.target_rate = None
+
+    @property
+    def achieved_rate(self):
+        if self.elapsed <= 0:
+            return None
+        return self.messages / self.elapsed
+
+    def report(self):
+        target = 'as fast as possible' if self.target_rate is None else\
+            '{0:.1f} msgs/s'.format(self.target_rate)
+        achieved = self.achieved_rate
+        return (
+            '{0} messages in {1} publishes, {2:.2f} seconds, achieved '
+            '{3} msgs/s, target {4}, max lag {5:.3f} seconds').format(
+                self.messages, self.publishes, self.elapsed,
+                'n/a' if achieved is None else '{0:.1f}'.format(achieved),
+                target, self.max_lag)
+
+
+class ReplayScheduler(object):
+    def __init__(
+            self, rate=1.0, max_rate=None, time_slice=default_time_slice,
+            max_batch=default_max_batch, keep=None, clock=monotonic,
+            sleep=time.sleep):
+        self.rate = rate
+        # when given, records of channels it returns False for are skipped
+        # without changing the timing of the others
+        self.keep = keep
+        self.max_rate = max_rate
+        self.time_slice = time_slice
+        self.max_batch = max_batch
+        self._clock = clock
+        self._sleep = sleep
+
+    def run(self, records, publish):
+        '''Calls publish(channel, messages) for the (timestamp, channel,
+           messages) records as they come due, returns ReplayStats'''
+        clock = self._clock
+        rate = self.rate
+        unlimited = rate == float('inf')
+        bucket = None
+        if self.max_rate:
+            bucket = TokenBucket(
+                self.max_rate, self.max_rate * self.time_slice,
+                clock, self._sleep)
+        stats = ReplayStats()
+
+        origin = None
+        first_timestamp = None
+        last_timestamp = None
+        pending = []
+        pending_channel = None
+        pending_due = None
+
+        def flush():
+            if bucket:
+                bucket.take(len(pending))
+            publish(pending_channel, pending)
+            stats.messages += len(pending)
+            stats.publishes += 1
+            if not unlimited:
+                lag = clock() - pending_due
+                if lag > stats.max_lag:
+                    stats.max_lag = lag
+
+        for timestamp, channel, messages in records:
+            if origin is None:
+                origin = clock()
+                first_timestamp = timestamp
+            last_timestamp = timestamp
+            if self.keep is not None and not self.keep(channel):
+                continue
+            if unlimited:
+                due = origin
+            else:
+                due = origin + (timestamp - first_timestamp) / rate
+
+            if pending:
+                too_many = len(pending) + len(messages) > self.max_batch
+                too_late = due > pending_due + self.time_slice
+                if channel != pending_channel or too_many or too_late:
+                    flush()
+                    pending = []
+
+            delay = due - clock()
+            if delay > self.time_slice:
+                self._sleep(delay)
+
+            if not pending:
+                pending_channel = channel
+                pending_due = due
+            pending.extend(messages)
+            # a reader of a pipe may block for a while before the next
+            # record, max_batch=1 publishes every record right away
+            if len(pending) >= self.max_batch:
+                flush()
+                pending = []
+
+        if pending:
+            flush()
+
+        if origin is not None:
+            stats.elapsed = clock() - origin
+            stats.recorded_span = last_timestamp - first_timestamp
+            if not unlimited and stats.recorded_span > 0:
+                stats.target_rate =\
+                    stats.messages * rate / stats.recorded_span
+            if self.max_rate and stats.target_rate is None:
+                stats.target_rate = self.max_rate
+            elif self.max_rate:
+                stats.target_rate = min(stats.target_rate, self.max_rate)
+        return stats
@@ -0,0 +1,230 @@
+'''Background writer of the record subcommand.
+
+Subscription data is put into a bounded queue by the client event loop
+thread and written out by a writer thread, so a slow disk never holds up
+reading from RTM. The writer takes everything queued at once and writes
+it with a single writelines and flush.
+
+When the queue is full, incoming subscription data is either dropped
+('drop') or waited for ('block', which holds up the client like writing
+synchronously did). Both are counted and reported when recording stops.
+
+With `rotate_size` or `rotate_interval` the recording goes to a sequence
+of files named like the output file with a number appended
+(big-rss.recording.000001, big-rss.recording.000002 and so on), the next
+one is started when the current one gets that big or that old.
+'''
+
+try:
+    import rapidjson as json
+except ImportError:
+    import json
+import logging
+import sys
+import threading
+import time
+
+from six.moves import queue
+
+from satori_rtm_cli.recording import RecordingWriter
+
+logger = logging.getLogger('satori-rtm-cli')
+
+default_buffer_size = 10000
+max_write_batch = 1000
+
+_stop = object()
+
+
+def format_json_line(timestamp, data, messages):
+    '''One line of a JSON lines recording, messages as RTM sent them'''
+    data['timestamp'] = timestamp
+    line = u'{0},"messages":[{1}]}}\n'.format(
+        json.dumps(data)[:-1], u','.join(messages))
+    if sys.version_info[0] < 3:
+        line = line.encode('utf8')
+    return line
+
+
+class JsonLinesFile(object):
+    def __init__(self, stream, close_stream=True):
+        self._stream = stream
+        self._close_stream = close_stream
+
+    def write_many(self, items):
+        '''Writes (timestamp, data, messages) items, returns the size'''
+        lines = [format_json_line(*item) for item in items]
+        self._stream.writelines(lines)
+        self._stream.flush()
+        return sum(len(line) for line in lines)
+
+    def close(self):
+        if self._close_stream:
+            self._stream.close()
+
+
+class BinaryFile(object):
+    def __init__(
+            self, stream, compression='none', close_stream=True,
+            protocol='json'):
+        self._stream = stream
+        self._close_stream = close_stream
+        self._writer = RecordingWriter(
+            stream, protocol=protocol, compression=compression)
+
+    def write_many(self, items):
+        return sum(
+            self._writer.write(timestamp, data['subscription_id'], messages)
+            for timestamp, data, messages in items)
+
+    def close(self):
+        self._writer.close()
+        if self._close_stream:
+            self._stream.close()
+
+
+class SinkStats(object):
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.files = 0
+        # messages dropped because the writer fell behind or failed,
+        # each counter is only updated by one thread
+        self.dropped_by_client = 0
+        self.dropped_by_writer = 0
+        # times the client waited for room in the queue
+        self.waits = 0
+
+    @property
+    def dropped(self):
+        return self.dropped_by_client + self.dropped_by_writer
+
+    def report(self):
+        return (
+            'Recorded {0} messages, {1} bytes to {2} file(s), dropped {3} '
+            'messages, waited for the writer {4} times').format(
+                self.messages, self.bytes, self.files, self.dropped,
+                self.waits)
+
+
+class RecordingSink(object):
+    '''Writes subscription data to files opened by open_file(sequence),
+       sequence is a number starting from 1 when rotating, None otherwise.
+       on_written(size) is called from the writer thread after every
+       write, on_error(exception) if writing fails. Subscription data
+       that comes after that is dropped.'''
+
+    def __init__(
+            self, open_file, rotate_size=None, rotate_interval=None,
+            buffer_size=default_buffer_size, backpressure='drop',
+            on_written=None, on_error=None):
+        if backpressure not in ('drop', 'block'):
+            raise ValueError(
+                'Backpressure must be "drop" or "block", not {0}'.format(
+                    backpressure))
+        self._open_file = open_file
+        self._rotate_size = rotate_size
+        self._rotate_interval = rotate_interval
+        self._rotating = bool(rotate_size or rotate_interval)
+        self._block = backpressure == 'block'
+        self._on_written = on_written
+        self._on_error = on_error
+        self._failed = False
+        self._queue = queue.Queue(buffer_size)
+        self._file = None
+        self._sequence = 0
+        self._file_size = 0
+        self._file_opened_at = None
+        self.stats = SinkStats()
+        self._thread = threading.Thread(
+            target=self._run, name='RecordingWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, timestamp, data, messages):
+        '''Queues subscription data for writing, returns False if it was
+           dropped'''
+        if self._failed:
+            self.stats.dropped_by_client += len(messages)
+            return False
+        item = (timestamp, data, messages)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if not self._block:
+                self.stats.dropped_by_client += len(messages)
+                return False
+        self.stats.waits += 1
+        self._queue.put(item)
+        return True
+
+    def close(self):
+        '''Writes out everything queued so far and closes the file'''
+        if self._thread.is_alive():
+            self._queue.put(_stop)
+            self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                items = [self._queue.get()]
+                try:
+                    while len(items) < max_write_batch:
+                        items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                stop = items[-1] is _stop
+                if stop:
+                    items.pop()
+                if items and self._failed:
+                    self.stats.dropped_by_writer += sum(
+                        len(i[2]) for i in items)
+                elif items:
+                    try:
+                        self._write(items)
+                    except Exception as e:
+                        # keep taking items so that put never blocks
+                        logger.error('Writing the recording failed: %s', e)
+                        self._failed = True
+                        self.stats.dropped_by_writer += sum(
+                            len(i[2]) for i in items)
+                        if self._on_error:
+                            self._on_error(e)
+                if stop:
+                    return
+        finally:
+            if self._file:
+                try:
+                    self._file.close()
+                except Exception as e:
+                    logger.error('Closing the recording failed: %s', e)
+
+    def _write(self, items):
+        if self._file is None or self._rotation_due():
+            self._next_file()
+        size = self._file.write_many(items)
+        self._file_size += size
+        self.stats.bytes += size
+        self.stats.messages += sum(len(item[2]) for item in items)
+        if self._on_written:
+            self._on_written(size)
+
+    def _rotation_due(self):
+        if self._rotate_size and self._file_size >= self._rotate_size:
+            return True
+        if not self._rotate_interval:
+            return False
+        return time.time() - self._file_opened_at >= self._rotate_interval
+
+    def _next_file(self):
+        if self._file:
+            self._file.close()
+        if self._rotating:
+            self._sequence += 1
+            self._file = self._open_file(self._sequence)
+        else:
+            self._file = self._open_file(None)
+        self._file_size = 0
+        self._file_opened_at = time.time()
+        self.stats.files += 1
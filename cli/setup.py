@@ -32,7 +32,8 @@ setup(
         'console_scripts': ['satori-rtm-cli=satori_rtm_cli:main']
     },
     packages=['satori_rtm_cli'],
-    install_requires=['satori-rtm-sdk >=1.5.0', 'docopt', 'toml', 'xdg>=1.0.4,<2', 'cbor2'],
+    install_requires=['satori-rtm-sdk >=1.6.0', 'docopt', 'toml', 'xdg>=1.0.4,<2', 'cbor2'],
+    extras_require={'zstd': ['zstandard'], 'lz4': ['lz4']},
     classifiers=classifiers,
     keywords='satori',
     license='Proprietary',
@@ -23,6 +23,41 @@ json_message = json_message.encode('utf8')
 tcpkali_available = find_executable('tcpkali')
 
 
+class RecordingClient(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, message, callback=None):
+        self.published.append((channel, message))
+
+
+class TestShardedClient(unittest.TestCase):
+    def test_channels_stick_to_a_connection(self):
+        from satori_rtm_cli import ShardedClient
+        channels = [u'channel{0}'.format(i) for i in range(100)]
+        processes = [
+            ShardedClient([RecordingClient() for _ in range(3)], i, 2)
+            for i in range(2)]
+        for sharded in processes:
+            for i in range(1000):
+                channel = channels[i % len(channels)]
+                if sharded.owns(channel):
+                    sharded.publish(channel, i)
+
+        owners = {}
+        total = 0
+        for sharded in processes:
+            for client in sharded.clients:
+                self.assertTrue(client.published)
+                total += len(client.published)
+                for channel, i in client.published:
+                    self.assertEqual(owners.setdefault(channel, client), client)
+                messages = [i for _, i in client.published]
+                self.assertEqual(messages, sorted(messages))
+        self.assertEqual(total, 1000)
+        self.assertEqual(len(owners), len(channels))
+
+
 class TestCLI(unittest.TestCase):
     def test_without_auth(self):
         generic_test(self, should_authenticate=False)
@@ -201,6 +236,21 @@ class TestCLI(unittest.TestCase):
             mailbox,
             [b'', b'', b'"v1"', b'', b'null', b'', b'', b'"v3"'])
 
+    def test_connections_only_for_replay(self):
+        cli = subprocess.Popen(
+            ['python', 'satori_rtm_cli/__init__.py',
+                '--config', '/dev/null',
+                '--appkey', appkey,
+                '--endpoint', endpoint,
+                '--connections', '4',
+                'publish', make_channel_name('connections')],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        _, err = cli.communicate(b'')
+        self.assertEqual(cli.returncode, 1)
+        self.assertIn(b'only work with replay', err)
+
     def test_replay_twice(self):
         channel = make_channel_name('replay_twice')
 
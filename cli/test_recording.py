@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+import unittest
+
+from satori_rtm_cli.recording import (
+    RecordingReader, RecordingWriter, get_compressor, is_recording)
+
+
+def write_recording(path, records, truncate=0, **kwargs):
+    stream = io.BytesIO()
+    writer = RecordingWriter(stream, **kwargs)
+    for timestamp, channel, payloads in records:
+        writer.write(timestamp, channel, payloads)
+    writer.close()
+    data = stream.getvalue()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) - truncate])
+    return len(data)
+
+
+# a record every 0.1 seconds for 10 seconds, a few per block
+records = [
+    (1000.0 + i * 0.1, u'channel-{0}'.format(i % 3),
+        [u'{{"i":{0}}}'.format(i)])
+    for i in range(100)]
+
+
+class TestRecording(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def read_all(self, **kwargs):
+        reader = RecordingReader(self.path)
+        try:
+            return list(reader.records(**kwargs))
+        finally:
+            reader.close()
+
+    def check_roundtrip(self, compression):
+        try:
+            get_compressor(compression)
+        except ImportError:
+            self.skipTest('{0} is not installed'.format(compression))
+        write_recording(
+            self.path, records, compression=compression, block_size=100)
+        self.assertTrue(is_recording(self.path))
+        got = self.read_all()
+        self.assertEqual(
+            got,
+            [(t, c, p[0].encode('utf8')) for (t, c, p) in records])
+
+    def test_roundtrip(self):
+        self.check_roundtrip('none')
+
+    def test_roundtrip_zlib(self):
+        self.check_roundtrip('zlib')
+
+    def test_roundtrip_zstd(self):
+        self.check_roundtrip('zstd')
+
+    def test_roundtrip_lz4(self):
+        self.check_roundtrip('lz4')
+
+    def test_seek(self):
+        write_recording(self.path, records, block_size=100)
+        reader = RecordingReader(self.path)
+        self.assertGreater(len(reader.index), 10)
+        self.assertEqual(reader.first_timestamp, 1000.0)
+        reader.close()
+
+        got = self.read_all(start=1004.05, end=1006.05)
+        self.assertEqual(
+            [t for (t, _, _) in got],
+            [t for (t, _, _) in records if 1004.05 <= t <= 1006.05])
+
+    def test_payloads_are_not_copied(self):
+        write_recording(self.path, records)
+        reader = RecordingReader(self.path)
+        payloads = [p for (_, _, p) in reader.records()]
+        self.assertTrue(all(isinstance(p, memoryview) for p in payloads))
+        self.assertEqual(bytes(payloads[0]), b'{"i":0}')
+        del payloads
+        reader.close()
+
+    def test_batches(self):
+        write_recording(
+            self.path,
+            [(1.0, u'a', [u'1', u'2']), (2.0, u'a', [u'3']),
+                (3.0, u'b', [u'4']), (4.0, u'a', [u'5', u'6', u'7'])])
+        reader = RecordingReader(self.path)
+        try:
+            self.assertEqual(
+                [(t, c, [bytes(p) for p in ps])
+                    for (t, c, ps) in reader.batches(max_batch=2)],
+                [(1.0, u'a', [b'1', b'2']),
+                    (2.0, u'a', [b'3']),
+                    (3.0, u'b', [b'4']),
+                    (4.0, u'a', [b'5', b'6']),
+                    (4.0, u'a', [b'7'])])
+        finally:
+            reader.close()
+
+    def test_missing_index(self):
+        size = write_recording(self.path, records, block_size=100)
+        # cut off the index and trailer and half of the last block
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        index_offset = data.rindex(b'INDX')
+        with open(self.path, 'wb') as f:
+            f.write(data[:index_offset - 10])
+        self.assertLess(index_offset, size)
+
+        got = self.read_all()
+        self.assertGreater(len(got), 0)
+        self.assertLess(len(got), len(records))
+        self.assertEqual(
+            got, [(t, c, p[0].encode('utf8'))
+                  for (t, c, p) in records[:len(got)]])
+
+    def test_not_a_recording(self):
+        with open(self.path, 'w') as f:
+            f.write('{"timestamp": 1, "messages": []}\n')
+        self.assertFalse(is_recording(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
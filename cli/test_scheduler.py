@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from satori_rtm_cli.scheduler import ReplayScheduler, TokenBucket
+
+
+class FakeClock(object):
+    '''Time passes only when sleeping, plus a fixed cost per publish'''
+
+    def __init__(self, publish_cost=0.0):
+        self.now = 100.0
+        self.sleeps = []
+        self.publishes = []
+        self.publish_cost = publish_cost
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def publish(self, channel, messages):
+        self.publishes.append((self.now, channel, list(messages)))
+        self.now += self.publish_cost
+
+
+def records(count, interval, channel=u'c'):
+    return [(i * interval, channel, [i]) for i in range(count)]
+
+
+class TestReplayScheduler(unittest.TestCase):
+
+    def run_scheduler(self, items, publish_cost=0.0, **kwargs):
+        fake = FakeClock(publish_cost)
+        scheduler = ReplayScheduler(
+            clock=fake.clock, sleep=fake.sleep, **kwargs)
+        stats = scheduler.run(items, fake.publish)
+        return fake, stats
+
+    def test_releases_in_time_slices(self):
+        # a message every millisecond at 10x, 100 per 10 ms slice, the
+        # last slice is released up to a slice early
+        fake, stats = self.run_scheduler(
+            records(1000, 0.001), rate=10, time_slice=0.01)
+        self.assertEqual(stats.messages, 1000)
+        self.assertEqual(
+            [m for (_, _, ms) in fake.publishes for m in ms],
+            list(range(1000)))
+        self.assertLessEqual(len(fake.sleeps), 11)
+        self.assertLessEqual(len(fake.publishes), 11)
+        self.assertGreaterEqual(stats.elapsed, 0.0999 - 0.01)
+        self.assertLessEqual(stats.elapsed, 0.0999)
+        self.assertAlmostEqual(stats.target_rate, 10000, delta=20)
+
+    def test_no_drift(self):
+        # every publish takes a millisecond, messages come every 10 ms
+        fake, stats = self.run_scheduler(
+            records(1000, 0.01), publish_cost=0.001, time_slice=0.001)
+        first = fake.publishes[0][0]
+        for (at, _, ms) in fake.publishes:
+            self.assertLess(abs(at - first - ms[0] * 0.01), 0.002)
+        self.assertLess(stats.max_lag, 0.002)
+
+    def test_batches_by_channel(self):
+        items = [
+            (0.0, u'a', [1]), (0.0, u'a', [2]), (0.0, u'b', [3]),
+            (0.0, u'a', [4, 5]), (0.0, u'a', [6])]
+        fake, _ = self.run_scheduler(items, rate=float('inf'), max_batch=2)
+        self.assertEqual(
+            [(c, ms) for (_, c, ms) in fake.publishes],
+            [(u'a', [1, 2]), (u'b', [3]), (u'a', [4, 5]), (u'a', [6])])
+
+    def test_max_rate(self):
+        fake, stats = self.run_scheduler(
+            records(1000, 0), rate=float('inf'), max_rate=100)
+        self.assertEqual(stats.messages, 1000)
+        self.assertAlmostEqual(stats.elapsed, 10, delta=0.1)
+        self.assertAlmostEqual(stats.achieved_rate, 100, delta=1)
+        self.assertEqual(stats.target_rate, 100)
+
+    def test_keep(self):
+        items = [(i * 0.01, u'ab'[i % 2], [i]) for i in range(10)]
+        fake, stats = self.run_scheduler(
+            items, time_slice=0.001, keep=lambda c: c == u'b')
+        self.assertEqual(
+            [(round(at - 100.0, 6), ms) for (at, _, ms) in fake.publishes],
+            [(i * 0.01, [i]) for i in range(1, 10, 2)])
+        self.assertEqual(stats.messages, 5)
+
+    def test_empty(self):
+        fake, stats = self.run_scheduler([])
+        self.assertEqual(fake.publishes, [])
+        self.assertEqual(stats.messages, 0)
+        self.assertIsNone(stats.achieved_rate)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_debt(self):
+        fake = FakeClock()
+        bucket = TokenBucket(10, 1, fake.clock, fake.sleep)
+        bucket.take(1)
+        self.assertEqual(fake.sleeps, [])
+        bucket.take(5)
+        self.assertAlmostEqual(sum(fake.sleeps), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
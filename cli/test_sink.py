@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import cbor2
+
+from satori_rtm_cli import make_recording_publisher, sink
+from satori_rtm_cli.recording import RecordingReader
+
+
+def data(i):
+    return (
+        1000.0 + i,
+        {'subscription_id': u'channel-{0}'.format(i % 2), 'position': i},
+        [u'{{"i":{0}}}'.format(i)])
+
+
+class SlowFile(object):
+    '''Holds up the writer until released'''
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.items = []
+
+    def write_many(self, items):
+        self.release.wait()
+        self.items.extend(items)
+        return len(items)
+
+    def close(self):
+        pass
+
+
+class BrokenFile(SlowFile):
+    def write_many(self, items):
+        self.release.wait()
+        raise IOError('No space left on device')
+
+
+class ReplayClient(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.published = []
+
+    def publish_many_preserialized_messages(self, channel, payloads, callback):
+        self.published.extend(payloads)
+
+    def publish_many(self, channel, messages, callback):
+        self.published.extend(messages)
+
+
+class TestRecordingSink(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_json(self, sequence):
+        path = self.path if sequence is None else\
+            '{0}.{1:06d}'.format(self.path, sequence)
+        return sink.JsonLinesFile(io.open(path, 'w'))
+
+    def open_binary(self, sequence):
+        path = '{0}.{1:06d}'.format(self.path, sequence)
+        return sink.BinaryFile(io.open(path, 'wb'))
+
+    def read_json(self, path):
+        with io.open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_json_lines(self):
+        written = []
+        recording_sink = sink.RecordingSink(
+            self.open_json, on_written=written.append)
+        for i in range(10):
+            self.assertTrue(recording_sink.put(*data(i)))
+        recording_sink.close()
+
+        lines = self.read_json(self.path)
+        self.assertEqual(
+            [(line['timestamp'], line['subscription_id'], line['messages'])
+                for line in lines],
+            [(t, d['subscription_id'], [json.loads(m) for m in ms])
+                for (t, d, ms) in map(data, range(10))])
+        stats = recording_sink.stats
+        self.assertEqual(stats.messages, 10)
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.bytes, os.path.getsize(self.path))
+        self.assertEqual(sum(written), stats.bytes)
+
+    def test_rotate_size(self):
+        recording_sink = sink.RecordingSink(
+            self.open_json, rotate_size=100)
+        for i in range(10):
+            recording_sink.put(*data(i))
+            # one write per line, so that every file gets over the size
+            while not recording_sink._queue.empty():
+                time.sleep(0.001)
+        recording_sink.close()
+
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), recording_sink.stats.files)
+        self.assertGreater(len(files), 1)
+        self.assertEqual(files[0], 'recording.000001')
+        lines = []
+        for name in files:
+            lines.extend(self.read_json(os.path.join(self.directory, name)))
+        self.assertEqual([line['position'] for line in lines], list(range(10)))
+
+    def test_rotate_binary(self):
+        recording_sink = sink.RecordingSink(
+            self.open_binary, rotate_interval=0.001)
+        for i in range(5):
+            recording_sink.put(*data(i))
+            while not recording_sink._queue.empty():
+                time.sleep(0.001)
+            time.sleep(0.002)
+        recording_sink.close()
+
+        records = []
+        for name in sorted(os.listdir(self.directory)):
+            reader = RecordingReader(os.path.join(self.directory, name))
+            records.extend(
+                (t, c, bytes(p)) for (t, c, p) in reader.records())
+            reader.close()
+        self.assertEqual(
+            records,
+            [(t, d['subscription_id'], ms[0].encode('utf8'))
+                for (t, d, ms) in map(data, range(5))])
+
+    def test_cbor_record_and_replay(self):
+        payloads = [cbor2.dumps({u'i': i}) for i in range(3)]
+        recording_sink = sink.RecordingSink(
+            lambda sequence: sink.BinaryFile(
+                io.open(self.path, 'wb'), protocol='cbor'))
+        for i, payload in enumerate(payloads):
+            recording_sink.put(
+                1000.0 + i, {'subscription_id': u'channel'}, [payload])
+        recording_sink.close()
+
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.protocol, 'cbor')
+        records = list(reader.records())
+        reader.close()
+        self.assertEqual([bytes(p) for (_, _, p) in records], payloads)
+
+        for protocol, expected in [
+                ('cbor', payloads),
+                ('json', [{u'i': i} for i in range(3)])]:
+            client = ReplayClient(protocol)
+            publish = make_recording_publisher(client, reader.protocol)
+            publish(u'channel', [p for (_, _, p) in records], None)
+            self.assertEqual(
+                [bytes(p) if isinstance(p, memoryview) else p
+                    for p in client.published],
+                expected)
+
+    def test_drop(self):
+        slow = SlowFile()
+        recording_sink = sink.RecordingSink(
+            lambda sequence: slow, buffer_size=2)
+        results = [recording_sink.put(*data(i)) for i in range(10)]
+        slow.release.set()
+        recording_sink.close()
+
+        # the writer took the first one off the queue and waits with it
+        self.assertFalse(all(results))
+        self.assertEqual(recording_sink.stats.dropped, results.count(False))
+        self.assertEqual(
+            len(slow.items) + recording_sink.stats.dropped, 10)
+        self.assertEqual(recording_sink.stats.waits, 0)
+
+    def test_block(self):
+        slow = SlowFile()
+        recording_sink = sink.RecordingSink(
+            lambda sequence: slow, buffer_size=2, backpressure='block')
+        threading.Timer(0.05, slow.release.set).start()
+        results = [recording_sink.put(*data(i)) for i in range(10)]
+        recording_sink.close()
+
+        self.assertTrue(all(results))
+        self.assertEqual(
+            [d['position'] for (_, d, _) in slow.items], list(range(10)))
+        self.assertEqual(recording_sink.stats.dropped, 0)
+        self.assertGreater(recording_sink.stats.waits, 0)
+
+    def test_write_error(self):
+        broken = BrokenFile()
+        errors = []
+        recording_sink = sink.RecordingSink(
+            lambda sequence: broken, buffer_size=2, backpressure='block',
+            on_error=errors.append)
+        threading.Timer(0.05, broken.release.set).start()
+        # does not block forever once the writer has given up
+        for i in range(10):
+            recording_sink.put(*data(i))
+        recording_sink.close()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(recording_sink.stats.messages, 0)
+        self.assertEqual(recording_sink.stats.dropped, 10)
+        self.assertGreater(recording_sink.stats.dropped_by_writer, 0)
+
+    def test_unknown_backpressure(self):
+        with self.assertRaises(ValueError):
+            sink.RecordingSink(self.open_json, backpressure='spill')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,11 @@ def public_modules():
         ['Client', 'make_client'])
     yield ('satori.rtm.auth',
         ['RoleSecretAuthDelegate'])
+    yield ('satori.rtm.aio.__init__', [])
+    yield ('satori.rtm.aio.connection',
+        ['Connection'])
+    yield ('satori.rtm.aio.client',
+        ['Client', 'Subscription', 'make_client'])
 
 
 def signature(module_name, class_name, fun_expr):
@@ -47,7 +52,7 @@ def rst_sections_in_module(tree, module_name, exports):
             yield class_doc
             if type(toplevel) == ast.ClassDef:
                 for fun in toplevel.body:
-                    if type(fun) != ast.FunctionDef:
+                    if type(fun) not in (ast.FunctionDef, ast.AsyncFunctionDef):
                         continue
                     fun_doc = ast.get_docstring(fun)
                     if fun_doc:
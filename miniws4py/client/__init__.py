@@ -101,6 +101,9 @@ class WebSocketBaseClient(WebSocket):
         WebSocket.__init__(self, sock, protocols=protocols,
                            extensions=extensions)
 
+        # RFC 6455 requires a client to mask every frame it sends
+        self.masked = True
+
         self.key = b64encode(os.urandom(16))
 
     def _parse_url(self):
@@ -186,7 +189,7 @@ class WebSocketBaseClient(WebSocket):
                 raise
 
             if body:
-                self.process(body)
+                self.unparsed_input_bytes += body
         except Exception as e:
             logger.exception(e)
             try:
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from struct import pack, unpack
+import os
+from struct import pack, pack_into, unpack, unpack_from
 
-from miniws4py.exc import FrameTooLargeException, ProtocolException
+from miniws4py.exc import FrameTooLargeException, MessageTooBigException, \
+     ProtocolException
 from miniws4py.compat import py3k, ord, range
 
 # Frame opcodes defined in the spec.
@@ -12,13 +14,73 @@ OPCODE_CLOSE = 0x8
 OPCODE_PING = 0x9
 OPCODE_PONG = 0xa
 
-__all__ = ['Frame']
+__all__ = ['Frame', 'FrameReader']
 
-def mask(self, data):
-    masked = bytearray(data)
-    for i in range(len(data)):
-        masked[i] = masked[i] ^ 255
-    return masked
+DEFAULT_READER_BUFFER_SIZE = 65536
+
+# Largest frame, and fragmented message, accepted from the peer
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+DEFAULT_MASKING_KEY = b'\xFF\xFF\xFF\xFF'
+
+# Short payloads are masked at once by XORing them as a big integer with
+# the key repeated to the payload length, longer ones byte position by
+# byte position modulo 4 through translation tables, which stays in C.
+MASK_INT_THRESHOLD = 512
+
+_mask_tables = {}
+
+def _mask_table(key_byte):
+    table = _mask_tables.get(key_byte)
+    if table is None:
+        table = bytes(bytearray(b ^ key_byte for b in range(256)))
+        _mask_tables[key_byte] = table
+    return table
+
+# Every mask_into implementation writes ``data`` masked with the 4 byte
+# ``key`` into ``buf`` starting at ``offset``. The masked payload must
+# end exactly at the end of ``buf``.
+
+def _mask_into_loop(buf, offset, data, key):
+    key = bytearray(key)
+    for i, b in enumerate(bytearray(data)):
+        buf[offset + i] = b ^ key[i & 3]
+
+def _mask_into_translate(buf, offset, data, key):
+    key = bytearray(key)
+    for i in range(4):
+        buf[offset + i::4] = bytes(data[i::4]).translate(_mask_table(key[i]))
+
+mask_implementations = {
+    'loop': _mask_into_loop,
+    'translate': _mask_into_translate}
+
+if py3k:
+    def _mask_into_int(buf, offset, data, key):
+        length = len(data)
+        keys = (bytes(key) * (length // 4 + 1))[:length]
+        value = int.from_bytes(data, 'little') ^ int.from_bytes(keys, 'little')
+        buf[offset:offset + length] = value.to_bytes(length, 'little')
+
+    def _mask_into_mixed(buf, offset, data, key):
+        if len(data) < MASK_INT_THRESHOLD:
+            _mask_into_int(buf, offset, data, key)
+        else:
+            _mask_into_translate(buf, offset, data, key)
+
+    mask_implementations['int'] = _mask_into_int
+    mask_implementations['mixed'] = _mask_into_mixed
+    mask_into = _mask_into_mixed
+else:
+    mask_into = _mask_into_translate
+
+def mask(data, key=DEFAULT_MASKING_KEY):
+    """
+    Returns ``data`` masked with the 4 bytes ``key``.
+    """
+    masked = bytearray(len(data))
+    mask_into(masked, 0, data, key)
+    return bytes(masked)
 
 class Frame(object):
     def __init__(self, opcode=None, body=b'', fin=0, rsv1=0, rsv2=0, rsv3=0, masked=False):
@@ -70,9 +132,10 @@ class Frame(object):
     def build(self):
         """
         Builds a frame from the instance's attributes and returns
-        its bytes representation.
+        its bytes representation. Masked frames get a random masking
+        key and are built in a single preallocated buffer, on Python 3
+        that buffer is returned as is, so it is a ``bytearray``.
         """
-        header = b''
 
         if self.fin > 0x1:
             raise ValueError('FIN bit parameter must be 0 or 1')
@@ -86,11 +149,11 @@ class Frame(object):
         ## |N|V|V|V|       |
         ## | |1|2|3|       |
         ## +-+-+-+-+-------+
-        header = pack('!B', ((self.fin << 7)
-                             | (self.rsv1 << 6)
-                             | (self.rsv2 << 5)
-                             | (self.rsv3 << 4)
-                             | self.opcode))
+        first_byte = ((self.fin << 7)
+                      | (self.rsv1 << 6)
+                      | (self.rsv2 << 5)
+                      | (self.rsv3 << 4)
+                      | self.opcode)
 
         ##                 +-+-------------+-------------------------------+
         ##                 |M| Payload len |    Extended payload length    |
@@ -104,14 +167,14 @@ class Frame(object):
 
         length = self.payload_length
         if length < 126:
-            header += pack('!B', (mask_bit | length))
+            header_size = 2
         elif length < (1 << 16):
-            header += pack('!B', (mask_bit | 126)) + pack('!H', length)
+            header_size = 4
         elif length < (1 << 63):
-            header += pack('!B', (mask_bit | 127)) + pack('!Q', length)
+            header_size = 10
         else:
             raise FrameTooLargeException()
-        
+
         ## + - - - - - - - - - - - - - - - +-------------------------------+
         ## |                               |          Masking-key          |
         ## +-------------------------------+-------------------------------+
@@ -121,10 +184,28 @@ class Frame(object):
         ## + - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - +
         ## |                     Payload Data continued ...                |
         ## +---------------------------------------------------------------+
-        if self.masked:
-            return bytes(header + b'\xFF\xFF\xFF\xFF' + mask(self.body))
+        if not self.masked:
+            # A zero key leaves the payload as it is
+            if header_size == 2:
+                header = pack('!BB', first_byte, mask_bit | length)
+            elif header_size == 4:
+                header = pack('!BBH', first_byte, mask_bit | 126, length)
+            else:
+                header = pack('!BBQ', first_byte, mask_bit | 127, length)
+            return header + b'\x00\x00\x00\x00' + self.body
+
+        frame = bytearray(header_size + 4 + length)
+        if header_size == 2:
+            pack_into('!BB', frame, 0, first_byte, mask_bit | length)
+        elif header_size == 4:
+            pack_into('!BBH', frame, 0, first_byte, mask_bit | 126, length)
         else:
-            return bytes(header + b'\x00\x00\x00\x00' + self.body)
+            pack_into('!BBQ', frame, 0, first_byte, mask_bit | 127, length)
+
+        key = os.urandom(4)
+        frame[header_size:header_size + 4] = key
+        mask_into(frame, header_size + 4, self.body, key)
+        return frame if py3k else bytes(frame)
 
     def _parsing(self):
         """
@@ -241,3 +322,155 @@ class Frame(object):
 
         self.body = some_bytes
         yield
+
+
+class FrameReader(object):
+    def __init__(self, size=DEFAULT_READER_BUFFER_SIZE,
+                 max_frame_size=DEFAULT_MAX_MESSAGE_SIZE):
+        """
+        Parses incoming frames straight from a preallocated buffer.
+
+        Bytes are received into the buffer with ``recv_into``, headers
+        are decoded in place with :func:`struct.unpack_from` and
+        payloads are handed out as :class:`memoryview` slices of the
+        buffer, so nothing is copied until the caller decides to keep
+        the payload.
+
+        A payload slice is only valid until the next call to
+        :meth:`recv_from` or :meth:`feed` which may reuse the memory.
+
+        Frames larger than ``max_frame_size`` raise
+        :exc:`MessageTooBigException` as soon as their header is read.
+        The buffer grows to hold a larger frame and gets back to
+        ``size`` once that frame has been consumed.
+
+        .. code-block:: python
+           :linenos:
+
+           >>> reader = FrameReader()
+           >>> reader.feed(b'\\x81\\x02hi')
+           >>> [(fin, opcode, bytes(payload))
+           ...  for fin, opcode, payload in reader.frames()]
+           [(1, 1, b'hi')]
+        """
+        self.size = size
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.needed = 2
+        """
+        Number of bytes, counted from ``start``, required to
+        complete the frame that is currently being received.
+        """
+
+    def recv_from(self, sock):
+        """
+        Receives as many bytes as the socket has for us and
+        the buffer can hold. Returns the number of bytes received,
+        zero meaning the peer has closed the connection.
+        """
+        self._reserve(0)
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """
+        Appends ``data`` to the buffer as if it was received from
+        the socket.
+        """
+        self._reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def _reserve(self, extra):
+        pending = self.end - self.start
+        wanted = max(self.needed, pending + extra, pending + 1)
+
+        if wanted > len(self.buffer) or (
+                wanted <= self.size < len(self.buffer)):
+            # the frame is larger than the buffer, or a large frame is
+            # over and the buffer shrinks back. Payload slices that are
+            # still referenced keep the old buffer alive
+            if wanted > len(self.buffer):
+                size = min(
+                    max(wanted, 2 * len(self.buffer)),
+                    max(wanted, self.max_frame_size + 14))
+            else:
+                size = self.size
+            buf = bytearray(size)
+            buf[:pending] = self.view[self.start:self.end]
+            self.buffer = buf
+            self.view = memoryview(buf)
+            self.start, self.end = 0, pending
+        elif self.start + wanted > len(self.buffer):
+            # move the incomplete frame to the beginning of the buffer
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+
+    def frames(self):
+        """
+        Generator over the complete frames in the buffer. Yields
+        ``(fin, opcode, payload)`` tuples, ``payload`` being a
+        :class:`memoryview`. Raises :exc:`ProtocolException` or
+        :exc:`FrameTooLargeException` on invalid frames.
+        """
+        buf = self.buffer
+        while True:
+            start = self.start
+            available = self.end - start
+            if available < 2:
+                self.needed = 2
+                return
+
+            first_byte = buf[start]
+            second_byte = buf[start + 1]
+            fin = (first_byte >> 7) & 1
+            opcode = first_byte & 0xf
+
+            if first_byte & 0x70:
+                # rsv bits MUST be 0 unless negotiated otherwise
+                raise ProtocolException()
+            if 2 < opcode < 8 or opcode > 0xA:
+                raise ProtocolException()
+            if opcode > 0x7 and fin == 0:
+                raise ProtocolException()
+            if second_byte & 0x80:
+                # servers must not mask frames
+                raise ProtocolException()
+
+            length = second_byte & 0x7f
+            header_length = 2
+            if length == 126:
+                header_length = 4
+                if available < header_length:
+                    self.needed = header_length
+                    return
+                length = unpack_from('!H', buf, start + 2)[0]
+            elif length == 127:
+                header_length = 10
+                if available < header_length:
+                    self.needed = header_length
+                    return
+                length = unpack_from('!Q', buf, start + 2)[0]
+                if length > 0x7FFFFFFFFFFFFFFF:
+                    raise FrameTooLargeException()
+
+            if opcode > 0x7 and length > 125:
+                raise FrameTooLargeException()
+            if length > self.max_frame_size:
+                raise MessageTooBigException()
+
+            frame_length = header_length + length
+            if available < frame_length:
+                self.needed = frame_length
+                return
+
+            payload = self.view[start + header_length:start + frame_length]
+            self.start = start + frame_length
+            if self.start == self.end:
+                self.start = self.end = 0
+            self.needed = 2
+            yield fin, opcode, payload
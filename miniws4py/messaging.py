@@ -108,6 +108,9 @@ class Message(object):
 class TextMessage(Message):
     def __init__(self, text=None):
         Message.__init__(self, OPCODE_TEXT, text)
+        # decoded data, set by the websocket when the stream leaves
+        # checking UTF-8 to decoding
+        self.text = None
 
     @property
     def is_binary(self):
@@ -2,16 +2,27 @@
 import struct
 from struct import unpack
 
-from miniws4py.utf8validator import Utf8Validator
+from miniws4py.compat import py3k
+from miniws4py.utf8validator import IncrementalUtf8Validator
 from miniws4py.messaging import TextMessage, BinaryMessage, CloseControlMessage,\
      PingControlMessage, PongControlMessage
 from miniws4py.framing import Frame, OPCODE_CONTINUATION, OPCODE_TEXT, \
-     OPCODE_BINARY, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+     OPCODE_BINARY, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG, \
+     DEFAULT_MAX_MESSAGE_SIZE
 from miniws4py.exc import FrameTooLargeException, ProtocolException
-from miniws4py.compat import py3k
 
 VALID_CLOSING_CODES = [1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011]
 
+if py3k:
+    Utf8Validator = IncrementalUtf8Validator
+else:
+    from miniws4py.utf8validator import Utf8Validator
+
+def _to_bytes(payload):
+    if isinstance(payload, memoryview):
+        return payload.tobytes()
+    return bytes(payload)
+
 class Stream(object):
     def __init__(self):
         """ Represents a websocket stream of bytes flowing in and out.
@@ -72,6 +83,24 @@ class Stream(object):
         Parser in charge to process bytes it is fed with.
         """
 
+        self.utf8validator = Utf8Validator()
+        """
+        Validator of the text messages being received.
+        """
+
+        self.max_message_size = DEFAULT_MAX_MESSAGE_SIZE
+        """
+        Largest fragmented message accepted, a larger one closes
+        the stream with code 1009.
+        """
+
+        self.validate_utf8 = True
+        """
+        Tells if text messages are checked to be valid UTF-8. Owners that
+        decode every text message anyway can turn it off and close the
+        stream with code 1007 when decoding fails.
+        """
+
     @property
     def parser(self):
         if self._parser is None:
@@ -138,12 +167,127 @@ class Stream(object):
         """
         return PingControlMessage(data).single()
 
-    def pong(self, data=''):
+    def pong(self, data='', masked=False):
         """
         Returns a ping control message built from
         a :class:`miniws4py.messaging.PongControlMessage` instance.
         """
-        return PongControlMessage(data).single()
+        return PongControlMessage(data).single(masked=masked)
+
+    def _validate_utf8(self, data, validator=None):
+        """
+        Feeds ``data`` to the validator of the current message unless
+        another ``validator`` is given. The pure Python DFA and
+        the optional `wsaccel` one expect a bytearray.
+        """
+        if validator is None:
+            validator = self.utf8validator
+        if not isinstance(validator, IncrementalUtf8Validator):
+            data = bytearray(data)
+        is_valid, end_on_code_point, _, _ = validator.validate(data)
+        return is_valid, end_on_code_point
+
+    def process_frame(self, fin, opcode, payload):
+        """
+        Makes sense of a complete frame: dispatches its
+        ``payload`` to the most appropriate message type based
+        on the frame's ``opcode``. The payload may be any bytes-like
+        object, it is copied when kept.
+        """
+        utf8validator = self.utf8validator
+
+        if opcode == OPCODE_TEXT:
+            if self.message and not self.message.completed:
+                # We got a text frame before we completed the previous one
+                msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
+                self.errors.append(msg)
+                return
+
+            data = _to_bytes(payload)
+            m = TextMessage(data)
+            m.completed = (fin == 1)
+            self.message = m
+
+            if data and self.validate_utf8:
+                is_valid, end_on_code_point = self._validate_utf8(data)
+
+                if not is_valid or (m.completed and not end_on_code_point):
+                    self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                    return
+
+        elif opcode == OPCODE_BINARY:
+            if self.message and not self.message.completed:
+                # We got a text frame before we completed the previous one
+                msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
+                self.errors.append(msg)
+                return
+
+            m = BinaryMessage(_to_bytes(payload))
+            m.completed = (fin == 1)
+            self.message = m
+
+        elif opcode == OPCODE_CONTINUATION:
+            m = self.message
+            if m is None:
+                self.errors.append(CloseControlMessage(code=1002, reason='Message not started yet'))
+                return
+
+            if len(m.data) + len(payload) > self.max_message_size:
+                self.errors.append(CloseControlMessage(code=1009, reason='Message too big'))
+                return
+
+            data = _to_bytes(payload)
+            m.extend(data)
+            m.completed = (fin == 1)
+            if m.opcode == OPCODE_TEXT and self.validate_utf8:
+                if data:
+                    is_valid, end_on_code_point = self._validate_utf8(data)
+
+                    if not is_valid or (m.completed and not end_on_code_point):
+                        self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                        return
+
+        elif opcode == OPCODE_CLOSE:
+            code = 1000
+            reason = ""
+            payload_length = len(payload)
+            if payload_length == 0:
+                self.closing = CloseControlMessage(code=1000)
+            elif payload_length == 1:
+                self.closing = CloseControlMessage(code=1002, reason='Payload has invalid length')
+            else:
+                try:
+                    code = int(unpack("!H", _to_bytes(payload[0:2]))[0])
+                except struct.error:
+                    code = 1002
+                    reason = 'Failed at decoding closing code'
+                else:
+                    # Those codes are reserved or plainly forbidden
+                    if code not in VALID_CLOSING_CODES and not (2999 < code < 5000):
+                        reason = 'Invalid Closing Frame Code: %d' % code
+                        code = 1002
+                    elif payload_length > 2:
+                        reason = _to_bytes(payload[2:])
+                        # A close frame may come between fragments of
+                        # a text message, do not mix their bytes
+                        is_valid, end_on_code_point = self._validate_utf8(
+                            reason, Utf8Validator())
+                        if not is_valid or not end_on_code_point:
+                            self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                            return
+                self.closing = CloseControlMessage(code=code, reason=reason)
+
+        elif opcode == OPCODE_PING:
+            self.pings.append(PingControlMessage(_to_bytes(payload)))
+
+        elif opcode == OPCODE_PONG:
+            self.pongs.append(PongControlMessage(_to_bytes(payload)))
+
+        else:
+            self.errors.append(CloseControlMessage(code=1003))
+
+        if self.message is not None and self.message.completed:
+            utf8validator.reset()
 
     def receiver(self):
         """
@@ -165,7 +309,6 @@ class Stream(object):
         Overall this makes the stream parser totally agonstic to
         the data provider.
         """
-        utf8validator = Utf8Validator()
         running = True
         frame = None
         while running:
@@ -179,98 +322,8 @@ class Stream(object):
                     break
                 except StopIteration:
                     frame._cleanup()
-                    some_bytes = frame.body
-
-                    if some_bytes:
-                        some_bytes = bytearray(some_bytes)
-
-                    if frame.opcode == OPCODE_TEXT:
-                        if self.message and not self.message.completed:
-                            # We got a text frame before we completed the previous one
-                            msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
-                            self.errors.append(msg)
-                            break
-
-                        m = TextMessage(some_bytes)
-                        m.completed = (frame.fin == 1)
-                        self.message = m
-
-                        if some_bytes:
-                            is_valid, end_on_code_point, _, _ = utf8validator.validate(some_bytes)
-
-                            if not is_valid or (m.completed and not end_on_code_point):
-                                self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
-                                break
-
-                    elif frame.opcode == OPCODE_BINARY:
-                        if self.message and not self.message.completed:
-                            # We got a text frame before we completed the previous one
-                            msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
-                            self.errors.append(msg)
-                            break
-
-                        m = BinaryMessage(some_bytes)
-                        m.completed = (frame.fin == 1)
-                        self.message = m
-
-                    elif frame.opcode == OPCODE_CONTINUATION:
-                        m = self.message
-                        if m is None:
-                            self.errors.append(CloseControlMessage(code=1002, reason='Message not started yet'))
-                            break
-
-                        m.extend(some_bytes)
-                        m.completed = (frame.fin == 1)
-                        if m.opcode == OPCODE_TEXT:
-                            if some_bytes:
-                                is_valid, end_on_code_point, _, _ = utf8validator.validate(some_bytes)
-
-                                if not is_valid or (m.completed and not end_on_code_point):
-                                    self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
-                                    break
-
-                    elif frame.opcode == OPCODE_CLOSE:
-                        code = 1000
-                        reason = ""
-                        if frame.payload_length == 0:
-                            self.closing = CloseControlMessage(code=1000)
-                        elif frame.payload_length == 1:
-                            self.closing = CloseControlMessage(code=1002, reason='Payload has invalid length')
-                        else:
-                            try:
-                                # at this stage, some_bytes have been unmasked
-                                # so actually are held in a bytearray
-                                code = int(unpack("!H", bytes(some_bytes[0:2]))[0])
-                            except struct.error:
-                                code = 1002
-                                reason = 'Failed at decoding closing code'
-                            else:
-                                # Those codes are reserved or plainly forbidden
-                                if code not in VALID_CLOSING_CODES and not (2999 < code < 5000):
-                                    reason = 'Invalid Closing Frame Code: %d' % code
-                                    code = 1002
-                                elif frame.payload_length > 1:
-                                    reason = frame.body[2:]
-
-                                    if not py3k: reason = bytearray(reason)
-                                    is_valid, end_on_code_point, _, _ = utf8validator.validate(reason)
-                                    if not is_valid or not end_on_code_point:
-                                        self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
-                                        break
-                                    reason = bytes(reason)
-                            self.closing = CloseControlMessage(code=code, reason=reason)
-
-                    elif frame.opcode == OPCODE_PING:
-                        self.pings.append(PingControlMessage(some_bytes))
-
-                    elif frame.opcode == OPCODE_PONG:
-                        self.pongs.append(PongControlMessage(some_bytes))
-
-                    else:
-                        self.errors.append(CloseControlMessage(code=1003))
-
+                    self.process_frame(frame.fin, frame.opcode, frame.body)
                     break
-
                 except ProtocolException:
                     self.errors.append(CloseControlMessage(code=1002))
                     break
@@ -282,10 +335,4 @@ class Stream(object):
             frame.body = None
             frame = None
 
-            if self.message is not None and self.message.completed:
-                utf8validator.reset()
-
-        utf8validator.reset()
-        utf8validator = None
-
         self._cleanup()
@@ -29,6 +29,8 @@
 ##
 ###############################################################################
 
+import codecs
+
 
 class Utf8Validator(object):
     """
@@ -115,3 +117,39 @@ class Utf8Validator(object):
         self.i += i
         self.state = state
         return True, state == Utf8Validator.UTF8_ACCEPT, i, self.i
+
+
+class IncrementalUtf8Validator(object):
+    """
+    Incremental UTF-8 validator built on the incremental decoder of the
+    ``utf-8`` codec, so every chunk is validated by a single C-level decode
+    instead of a Python loop over its octets. Only a code point split across
+    chunks is kept between calls.
+
+    Python 2 decoder lets encoded surrogates through, use
+    :class:`Utf8Validator` there.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset validator to start new incremental UTF-8 decode/validation.
+        """
+        self._decoder.reset()
+        self.i = 0
+
+    def validate(self, ba):
+        """
+        Incrementally validate a chunk of bytes provided as any bytes-like
+        object. Returns the same quad as :meth:`Utf8Validator.validate`.
+        """
+        try:
+            self._decoder.decode(ba)
+        except UnicodeDecodeError as e:
+            self.i += e.start
+            return False, False, e.start, self.i
+        self.i += len(ba)
+        return True, not self._decoder.getstate()[0], len(ba), self.i
@@ -9,11 +9,15 @@ except ImportError:
     class pyOpenSSLError(Exception):
         pass
 
+from miniws4py.exc import FrameTooLargeException, MessageTooBigException, \
+     ProtocolException
+from miniws4py.framing import FrameReader
 from miniws4py.streaming import Stream
-from miniws4py.messaging import Message, PingControlMessage
+from miniws4py.messaging import Message, PingControlMessage, CloseControlMessage
 from miniws4py.compat import basestring
 
 DEFAULT_READING_SIZE = 2
+IOV_MAX = 1024
 
 logger = logging.getLogger('miniws4py')
 
@@ -69,11 +73,22 @@ class WebSocket(object):
         Indicates if the server has been marked as terminated.
         """
 
+        self.masked = False
+        """
+        Tells if outgoing frames are masked with a random key.
+        Clients must do so.
+        """
+
         self.reading_buffer_size = DEFAULT_READING_SIZE
         """
         Current connection reading buffer size.
         """
 
+        self.reader = FrameReader()
+        """
+        Zero-copy frame parser used by :meth:`receive`.
+        """
+
     def opened(self):
         """
         Called by the server when the upgrade handshake
@@ -87,7 +102,7 @@ class WebSocket(object):
         if not self.client_terminated:
             self.client_terminated = True
             try:
-                self._write(self.stream.close(code=code, reason=reason).single())
+                self._write(self.stream.close(code=code, reason=reason).single(masked=self.masked))
             except Exception as e:
                 logger.error("Error when sending close frame: %s", str(e))
 
@@ -183,7 +198,7 @@ class WebSocket(object):
 
         self.sock.sendall(b, 0)
 
-    def send(self, payload, binary=False, masked=False):
+    def send(self, payload, binary=False, masked=None):
         """
         Sends the given ``payload`` out.
 
@@ -194,7 +209,12 @@ class WebSocket(object):
         fragmented message.
 
         If ``binary`` is set, handles the payload as a binary message.
+
+        Unless ``masked`` is given, frames are masked according
+        to :attr:`masked`.
         """
+        if masked is None:
+            masked = self.masked
         message_sender = self.stream.binary_message if binary else self.stream.text_message
 
         if isinstance(payload, basestring) or isinstance(payload, bytearray):
@@ -209,15 +229,62 @@ class WebSocket(object):
             bytes = next(payload)
             first = True
             for chunk in payload:
-                self._write(message_sender(bytes).fragment(first=first))
+                self._write(message_sender(bytes).fragment(first=first, masked=masked))
                 bytes = chunk
                 first = False
 
-            self._write(message_sender(bytes).fragment(last=True))
+            self._write(message_sender(bytes).fragment(last=True, masked=masked))
 
         else:
             raise ValueError("Unsupported type '%s' passed to send()" % type(payload))
 
+    def frame(self, payload, binary=False, masked=None):
+        """
+        Returns the bytes of a single frame carrying the
+        given ``payload``, ready to be written out later.
+        """
+        if masked is None:
+            masked = self.masked
+        message_sender = self.stream.binary_message if binary else self.stream.text_message
+        return message_sender(payload).single(masked=masked)
+
+    def write_frames(self, frames):
+        """
+        Writes already built ``frames`` to the underlying connection.
+        Plain sockets get them with vectored writes, while SSL sockets,
+        which do not support ``sendmsg``, get a single joined buffer.
+        """
+        if self.sock is None:
+            raise RuntimeError("Cannot send on a terminated websocket")
+
+        if self._is_secure or not hasattr(self.sock, 'sendmsg'):
+            self.sock.sendall(b''.join(frames))
+            return
+
+        chunks = [memoryview(f) for f in frames]
+        while chunks:
+            batch = chunks[:IOV_MAX]
+            sent = self.sock.sendmsg(batch)
+            written = 0
+            while written < len(batch) and sent >= len(batch[written]):
+                sent -= len(batch[written])
+                written += 1
+            chunks = chunks[written:]
+            if sent:
+                chunks[0] = chunks[0][sent:]
+
+    def send_many(self, payloads, binary=False, masked=None):
+        """
+        Sends each of the given ``payloads`` out as a single message
+        not fragmented. All the frames are built into one buffer
+        that is written to the underlying connection at once.
+        """
+        if masked is None:
+            masked = self.masked
+        message_sender = self.stream.binary_message if binary else self.stream.text_message
+        self._write(b''.join(
+            [message_sender(payload).single(masked=masked) for payload in payloads]))
+
     def _get_from_pending(self):
         """
         The SSL socket object provides the same interface
@@ -349,6 +416,67 @@ class WebSocket(object):
             return False
 
         self.reading_buffer_size = s.parser.send(bytes) or DEFAULT_READING_SIZE
+        return self._handle_stream_events()
+
+    def receive(self):
+        """
+        Reads as many bytes as available from the underlying connection
+        straight into the frame reader buffer and processes every
+        complete frame found there.
+
+        Unlike :meth:`once` this never copies partial frames around and
+        handles any number of frames per system call.
+
+        It returns `False` if an error occurred at the
+        socket level or during the bytes processing. Otherwise,
+        it returns `True`.
+        """
+        if self.terminated:
+            logger.debug("WebSocket is already terminated")
+            return False
+
+        try:
+            if self.unparsed_input_bytes:
+                self.reader.feed(self.unparsed_input_bytes)
+                self.unparsed_input_bytes = b''
+            elif not self.reader.recv_from(self.sock):
+                return False
+        except (socket.error, OSError, pyOpenSSLError) as e:
+            import errno
+            if hasattr(e, "errno") and e.errno == errno.EINTR:
+                return True
+            self.unhandled_error(e)
+            return False
+
+        return self.process_frames()
+
+    def process_frames(self):
+        """
+        Processes the complete frames available in the frame reader
+        one by one, exactly like :meth:`process` does.
+
+        The process should be terminated when this method
+        returns ``False``.
+        """
+        s = self.stream
+        try:
+            for fin, opcode, payload in self.reader.frames():
+                s.process_frame(fin, opcode, payload)
+                if not self._handle_stream_events():
+                    return False
+        except ProtocolException:
+            s.errors.append(CloseControlMessage(code=1002))
+            return self._handle_stream_events()
+        except MessageTooBigException:
+            s.errors.append(CloseControlMessage(code=1009, reason="Message too big"))
+            return self._handle_stream_events()
+        except FrameTooLargeException:
+            s.errors.append(CloseControlMessage(code=1002, reason="Frame was too large"))
+            return self._handle_stream_events()
+        return True
+
+    def _handle_stream_events(self):
+        s = self.stream
 
         if s.closing is not None:
             logger.debug("Closing message received (%d) '%s'" % (s.closing.code, s.closing.reason))
@@ -366,15 +494,24 @@ class WebSocket(object):
             return False
 
         if s.has_message:
-            self.received_message(s.message)
+            m = s.message
+            if m.is_text and not s.validate_utf8:
+                # Text messages that the stream did not validate
+                # are checked by decoding them once, right here
+                try:
+                    m.text = m.data.decode('utf-8')
+                except UnicodeDecodeError:
+                    logger.debug("Invalid UTF-8 bytes in text message")
+                    self.close(1007, 'Invalid UTF-8 bytes')
+                    return False
+            self.received_message(m)
             if s.message is not None:
                 s.message.data = None
                 s.message = None
-            return True
 
         if s.pings:
             for ping in s.pings:
-                self._write(s.pong(ping.data))
+                self._write(s.pong(ping.data, masked=self.masked))
             s.pings = []
 
         if s.pongs:
@@ -411,7 +548,7 @@ class WebSocket(object):
         try:
             self.opened()
             while not self.terminated:
-                if not self.once():
+                if not self.receive():
                     break
         finally:
             self.terminate()
@@ -11,6 +11,8 @@ The following table lists the Python SDK modules and classes:
     to RTM in the event of a disconnection.
 `satori.rtm.connection`_
     Provides a low-level API for managing a connection to RTM.
+`satori.rtm.aio`_
+    Provides asyncio versions of the client and connection (Python 3.5+).
 `satori.rtm.auth`_
     Provides the delegate object to be used when authenticating
     clients with RTM.
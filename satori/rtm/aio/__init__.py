@@ -0,0 +1,28 @@
+'''
+
+satori.rtm.aio
+==============
+
+Asyncio versions of `satori.rtm.connection` and `satori.rtm.client`
+(Python 3.5 and newer). A single event loop can host thousands of
+connections without spawning reader, pinger and client loop threads for
+each one of them::
+
+    import asyncio
+    from satori.rtm.aio import make_client
+
+    async def main():
+        async with make_client(endpoint, appkey) as client:
+            await client.publish('animals', {'who': 'zebra'})
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+'''
+
+from satori.rtm.aio.client import (
+    Client, Full, Subscription, SubscriptionMode, make_client)
+from satori.rtm.aio.connection import Connection
+
+__all__ = [
+    'Client', 'Connection', 'Full', 'Subscription', 'SubscriptionMode',
+    'make_client']
@@ -0,0 +1,618 @@
+'''
+
+satori.rtm.aio.client
+=====================
+
+Asyncio counterpart of `satori.rtm.client`. The Client runs entirely on one
+event loop: there are no reader, pinger or event loop threads. It follows the
+same state machines as the threaded Client, so reconnects, restoring
+authentication and resubscribing work exactly the same way.
+
+'''
+
+import asyncio
+import time
+
+import satori.rtm.auth as auth
+from satori.rtm.exceptions import AuthError
+import satori.rtm.internal_client_action as a
+from satori.rtm.codec import get_codec
+from satori.rtm.internal_client import InternalClient
+import satori.rtm.internal_queue as queue
+import satori.rtm.internal_subscription as s
+from satori.rtm.internal_logger import logger
+
+from satori.rtm.aio.connection import Connection, _Reply, _expect
+
+SubscriptionMode = s.SubscriptionMode
+Full = queue.Full
+
+
+class Client(object):
+    """
+    Asyncio version of `satori.rtm.client.Client`
+    """
+
+    def __init__(
+            self, endpoint, appkey,
+            fail_count_threshold=float('inf'),
+            reconnect_interval=1, max_reconnect_interval=300,
+            observer=None, restore_auth_on_reconnect=True,
+            max_queue_size=20000, https_proxy=None, protocol='json',
+            loop=None, codec=None, ping_interval=None, ping_timeout=None):
+        r"""
+
+Description
+    Constructor for the Client. Takes the same parameters as
+    `satori.rtm.client.Client` plus an optional event loop.
+
+Parameters
+    * endpoint {string} [required] - RTM endpoint as a string.
+    * appkey {string} [required] - Appkey used to access RTM.
+    * reconnect_interval {int} [optional] - Time period, in seconds, between
+      reconnection attempts. Default is 1.
+    * max_reconnect_interval {int} [optional] - Maximum period of time, in
+      seconds, to wait between reconnection attempts. Default is 300.
+    * fail_count_threshold {int} [optional] - Number of times the SDK should
+      attempt to reconnect if the connection disconnects. Default is inf.
+    * observer {client_observer} [optional] - Instance of a client observer
+      class, see `satori.rtm.client`.
+    * restore_auth_on_reconnect {boolean} optional - Whether to restore
+      authentication after reconnects. Default is True.
+    * max_queue_size {int} optional - limits the amount of requests that
+      are scheduled but not yet handled, raising `Full` when exceeded.
+    * https_proxy (string, int) [optional] - (host, port) tuple for https proxy
+    * protocol {string} [optional] - one of 'cbor' or 'json' (default).
+    * loop {asyncio.AbstractEventLoop} [optional] - event loop to run on,
+      default is the current event loop.
+    * codec {string or Codec} [optional] - encoder and decoder to use for
+      the protocol, see `satori.rtm.codec`.
+    * ping_interval, ping_timeout {float} [optional] - see
+      `satori.rtm.client.Client`.
+        """
+
+        assert endpoint
+        assert endpoint.startswith('ws://') or endpoint.startswith('wss://'), (
+            'Endpoint must start with "ws(s)://" but "%s" does not' % endpoint)
+
+        self._dumps = get_codec(codec, protocol).dumps
+        self._loop = loop or asyncio.get_event_loop()
+        self._queue = _LoopQueue(self._loop, max_queue_size)
+        self._internal = _InternalClient(
+            self._loop,
+            self._queue,
+            endpoint, appkey,
+            fail_count_threshold,
+            reconnect_interval, max_reconnect_interval,
+            observer, restore_auth_on_reconnect, https_proxy,
+            protocol, codec=codec, ping_interval=ping_interval,
+            ping_timeout=ping_timeout)
+        self._queue.handler = self._internal.process_message
+        self._disposed = False
+        self._subscriptions = {}
+
+    def last_connecting_error(self):
+        """
+Description
+    If there were unsuccessful connection attempts, this function returns
+    the exception for the last such attempt. Otherwise returns None.
+        """
+        return self._internal.last_connecting_error
+
+    def _enqueue(self, msg):
+        if not self._disposed:
+            self._queue.put(msg)
+        else:
+            raise RuntimeError(
+                'Trying to use a disposed satori.rtm.aio.client.Client')
+
+    async def _request(self, make_action):
+        reply = _Reply(self._loop)
+        self._enqueue(make_action(reply))
+        return await reply.future
+
+    async def _wait_for_acks_below_watermark(self):
+        connection = self._internal._aio_connection
+        if connection is not None:
+            await connection._wait_for_acks_below_watermark()
+
+    def _ensure_connected(self):
+        if not self.is_connected():
+            raise RuntimeError('Client is not connected')
+
+    def start(self):
+        """
+Description
+    Starts connecting to RTM. Returns immediately, use the client observer
+    or `make_client` to find out when the connection is established.
+
+    Publishes made before the connection is established are sent after
+    the client connects.
+        """
+        self._enqueue(a.Start())
+
+    def stop(self):
+        """
+Description
+    Closes the WebSocket connection to RTM. Publishes made while the client
+    is stopped are sent after it is started again.
+        """
+        self._enqueue(a.Stop())
+
+    async def authenticate(self, auth_delegate):
+        """
+Description
+    Validates the identity of an application user. Raises
+    `satori.rtm.exceptions.AuthError` if authentication failed.
+    Authentication is restored after reconnects unless the client was
+    created with `restore_auth_on_reconnect=False`.
+        """
+        outcome = await self._request(
+            lambda reply: a.Authenticate(auth_delegate, reply))
+        if isinstance(outcome, auth.Error):
+            raise AuthError(outcome.message)
+
+    async def publish(self, channel, message, ack=True):
+        """
+Description
+    Publishes a message to the specified channel.
+
+    If `ack` is True (the default), waits for RTM to acknowledge
+    the publish and returns the position of the published message.
+    Raises `RuntimeError` if RTM replied with an error and
+    `ConnectionError` if the connection dropped before the reply arrived.
+
+Parameters
+    * channel {string} [required] - Name of the channel.
+    * message {object} [required] - Value to publish, serializable
+      with the protocol chosen for the client.
+    * ack {bool} [optional] - Whether to wait for RTM acknowledgement.
+        """
+        body = self._dumps(message)
+        await self._wait_for_acks_below_watermark()
+        if not ack:
+            self._enqueue(a.Publish(channel, body, None))
+            return
+        pdu = _expect(
+            await self._request(lambda reply: a.Publish(channel, body, reply)),
+            u'rtm/publish/ok')
+        return pdu[u'body'][u'position']
+
+    async def read(self, channel, args=None):
+        """
+Description
+    Reads a value from the specified channel and returns it.
+    Raises `RuntimeError` if RTM replied with an error or the client
+    is not connected.
+        """
+        self._ensure_connected()
+        pdu = _expect(
+            await self._request(lambda reply: a.Read(channel, args, reply)),
+            u'rtm/read/ok')
+        return pdu[u'body'][u'message']
+
+    async def write(self, channel, value):
+        """
+Description
+    Writes the given value to the specified channel and returns its
+    position. Raises `RuntimeError` if RTM replied with an error or the client
+    is not connected.
+        """
+        self._ensure_connected()
+        body = self._dumps(value)
+        await self._wait_for_acks_below_watermark()
+        pdu = _expect(
+            await self._request(lambda reply: a.Write(channel, body, reply)),
+            u'rtm/write/ok')
+        return (pdu.get(u'body') or {}).get(u'position')
+
+    async def delete(self, channel):
+        """
+Description
+    Deletes any value from the specified channel.
+    Raises `RuntimeError` if RTM replied with an error or the client
+    is not connected.
+        """
+        self._ensure_connected()
+        _expect(
+            await self._request(lambda reply: a.Delete(channel, reply)),
+            u'rtm/delete/ok')
+
+    async def subscribe(
+            self, channel_or_subscription_id, mode,
+            subscription_observer=None, args=None):
+        """
+Description
+    Subscribes to the specified channel and waits until the subscription
+    becomes active. Returns a `Subscription` object that can be used
+    as an async iterator over incoming subscription data::
+
+        subscription = await client.subscribe(
+            channel, SubscriptionMode.SIMPLE)
+        async for data in subscription:
+            for message in data['messages']:
+                print(message)
+
+    The optional `subscription_observer` receives the same callbacks as
+    with the threaded client. Raises `RuntimeError` if the subscription
+    failed.
+
+Parameters
+    * channel_or_subscription_id {string} [required] - channel name or
+      subscription id when using a filter.
+    * mode {SubscriptionMode} [required] - resubscription behaviour after
+      a reconnect.
+    * subscription_observer {object} [optional] - subscription observer.
+    * args {object} [optional] - Any JSON key-value pairs to send in the
+      subscribe request.
+        """
+        subscription = Subscription(self._loop, subscription_observer)
+        self._enqueue(
+            a.Subscribe(
+                channel_or_subscription_id, mode,
+                subscription, args, None))
+        self._subscriptions[channel_or_subscription_id] = subscription
+        await subscription.wait_subscribed()
+        return subscription
+
+    async def unsubscribe(self, channel_or_subscription_id):
+        """
+Description
+    Unsubscribes from a channel and waits until the subscription is deleted.
+        """
+        subscription = self._subscriptions.pop(channel_or_subscription_id, None)
+        self._enqueue(a.Unsubscribe(channel_or_subscription_id))
+        if subscription:
+            await subscription.wait_deleted()
+
+    async def dispose(self):
+        """
+Description
+    Client finishes all work, releases all resources and becomes unusable.
+    Upon completion, `client.observer.on_enter_disposed()` is called.
+        """
+        if not self._disposed:
+            self._enqueue(a.Dispose())
+            self._disposed = True
+            await self._queue.disposed
+            await self._internal.wait_closed()
+
+    @property
+    def observer(self):
+        return self._internal.observer
+
+    @observer.setter
+    def observer(self, o):
+        self._internal.observer = o
+
+    @property
+    def metrics(self):
+        """
+Description
+    `satori.rtm.metrics.Metrics` of the client. Kept across reconnects.
+        """
+        return self._internal.metrics
+
+    def is_connected(self):
+        """
+Description
+    Returns `True` if the Client object is connected via a
+    WebSocket connection to RTM and `False` otherwise.
+        """
+        return self._internal.is_connected()
+
+
+class Subscription(object):
+    """
+    Handle returned by `Client.subscribe`. Iterating over it with
+    `async for` yields subscription data as it arrives. Iteration stops
+    when the subscription is deleted and raises `RuntimeError` when
+    the subscription fails.
+    """
+
+    def __init__(self, loop, observer=None):
+        self._observer = observer
+        self._data = asyncio.Queue()
+        self._subscribed = loop.create_future()
+        self._deleted = loop.create_future()
+        self._failure = None
+
+    async def wait_subscribed(self):
+        """
+Description
+    Waits until the subscription becomes active. Raises `RuntimeError`
+    if it failed instead.
+        """
+        await asyncio.shield(self._subscribed)
+
+    async def wait_deleted(self):
+        """
+Description
+    Waits until the subscription is deleted by `Client.unsubscribe`.
+        """
+        await asyncio.shield(self._deleted)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._data.empty():
+            if self._failure is not None:
+                raise RuntimeError(self._failure)
+            if self._deleted.done():
+                raise StopAsyncIteration
+        item = await self._data.get()
+        if item is _end_of_data:
+            if self._failure is not None:
+                raise RuntimeError(self._failure)
+            raise StopAsyncIteration
+        return item
+
+    def on_subscription_data(self, data):
+        self._data.put_nowait(data)
+        self._forward('on_subscription_data', data)
+
+    def on_enter_subscribed(self):
+        self._failure = None
+        if not self._subscribed.done():
+            self._subscribed.set_result(None)
+        self._forward('on_enter_subscribed')
+
+    def on_enter_failed(self, reason):
+        self._failure = reason
+        if not self._subscribed.done():
+            self._subscribed.set_exception(RuntimeError(reason))
+        self._data.put_nowait(_end_of_data)
+        self._forward('on_enter_failed', reason)
+
+    def on_deleted(self):
+        if not self._subscribed.done():
+            self._subscribed.set_exception(
+                RuntimeError('Subscription was deleted'))
+        if not self._deleted.done():
+            self._deleted.set_result(None)
+        self._data.put_nowait(_end_of_data)
+        self._forward('on_deleted')
+
+    def _forward(self, name, *args):
+        callback = getattr(self._observer, name, None)
+        if callback:
+            callback(*args)
+
+    def __getattr__(self, name):
+        if name.startswith('on_') and self._observer is not None:
+            return getattr(self._observer, name)
+        raise AttributeError(
+            'Subscription has no attribute {0}'.format(name))
+
+
+class make_client(object):
+    r"""
+make_client(\*args, \*\*kwargs)
+-------------------------------
+
+Description
+    Asynchronous context manager that creates a Client, starts it and
+    waits until it is connected (and authenticated if `auth_delegate`
+    is given). The client is disposed on exit::
+
+        async with make_client(endpoint, appkey) as client:
+            await client.publish(channel, message)
+
+    Takes the same parameters as the Client constructor plus
+    optional `auth_delegate`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._auth_delegate = kwargs.pop('auth_delegate', None)
+        self._args = args
+        self._kwargs = kwargs
+        self._client = None
+
+    async def __aenter__(self):
+        observer = self._kwargs.get('observer')
+        client = Client(*self._args, **self._kwargs)
+        loop = client._loop
+        ready = loop.create_future()
+
+        class Observer(object):
+            def on_enter_connected(self):
+                if not ready.done():
+                    ready.set_result(None)
+
+            def on_enter_stopped(self):
+                if not ready.done():
+                    ready.set_result(None)
+
+        client.observer = Observer()
+        client.start()
+        try:
+            await asyncio.wait_for(ready, 70)
+        except asyncio.TimeoutError:
+            await client.dispose()
+            if client.last_connecting_error():
+                raise RuntimeError(
+                    "Client connection timeout, last connection error: "
+                    "{0}".format(client.last_connecting_error()))
+            raise RuntimeError("Client connection timeout")
+
+        if not client.is_connected():
+            await client.dispose()
+            raise RuntimeError(
+                "Client connection error: {0}".format(
+                    client.last_connecting_error()))
+
+        if self._auth_delegate:
+            try:
+                await asyncio.wait_for(
+                    client.authenticate(self._auth_delegate), 20)
+            except asyncio.TimeoutError:
+                await client.dispose()
+                raise AuthError('Authentication process has timed out')
+            logger.debug('Auth success in make_client')
+
+        client.observer = observer
+        self._client = client
+        return client
+
+    async def __aexit__(self, exc_type, exc, tb):
+        logger.info('make_client.__aexit__')
+        await self._client.dispose()
+
+
+class _LoopQueue(object):
+    '''Stands in for internal_queue.Queue: events are handled as event loop
+       callbacks in the order they were put instead of by a dedicated
+       thread'''
+
+    def __init__(self, loop, maxsize):
+        self._loop = loop
+        self.softmaxsize = maxsize
+        self.handler = None
+        self.disposed = loop.create_future()
+        self._pending = 0
+
+    def put(self, item, block=True, timeout=None):
+        if self._pending >= self.softmaxsize\
+                and type(item) in queue.user_actions:
+            raise Full
+        self._pending += 1
+        self._loop.call_soon(self._process, item)
+
+    def qsize(self):
+        return self._pending
+
+    def _process(self, item):
+        self._pending -= 1
+        if self.disposed.done():
+            return
+        try:
+            if self.handler(item):
+                self.disposed.set_result(None)
+        except Exception as e:
+            logger.exception(e)
+
+
+class _InternalClient(InternalClient):
+    '''InternalClient where connecting, restoring authentication and
+       reconnect timers are coroutines and timer handles on the event loop'''
+
+    def __init__(self, loop, *args, **kwargs):
+        InternalClient.__init__(self, *args, **kwargs)
+        self._loop = loop
+        self._aio_connection = None
+        self._auth_restore_failed = False
+        self._closing = set()
+
+    def _connect(self):
+        logger.info('_connect')
+        self._time_of_last_reconnect = time.time()
+        self._auth_restore_failed = False
+        self._aio_connection = Connection(
+            self._endpoint, self._appkey,
+            self,
+            self.https_proxy, self._protocol, loop=self._loop,
+            keep_raw_messages=self._keep_raw_messages, codec=self._codec,
+            metrics=self.metrics, ping_interval=self._ping_interval,
+            ping_timeout=self._ping_timeout)
+        self.connection = self._aio_connection._pdu
+        self._loop.create_task(self._start_connection(self._aio_connection))
+
+    async def _start_connection(self, connection):
+        try:
+            await connection.start()
+        except Exception as e:
+            logger.exception(e)
+            if connection is self._aio_connection:
+                self.last_connecting_error = e
+                self._queue.put(a.ConnectingFailed())
+            return
+
+        if connection is not self._aio_connection:
+            # the client was stopped while we were connecting
+            await connection.stop()
+            return
+
+        self._record_connect(time.time() - self._time_of_last_reconnect)
+        self._auth_restore_failed =\
+            await self._restore_auth_and_return_true_if_failed_async(
+                connection)
+        if connection is self._aio_connection:
+            self._queue.put(a.ConnectingComplete())
+
+    def _restore_auth_and_return_true_if_failed(self):
+        # Authentication has already been restored by _start_connection
+        # because the state machine can't wait for it
+        return self._auth_restore_failed
+
+    async def _restore_auth_and_return_true_if_failed_async(self, connection):
+        logger.info('_restore_auth_and_return_true_if_failed')
+
+        if not self.restore_auth_on_reconnect:
+            return False
+
+        logger.debug(
+            'Restoring %d authentications',
+            len(self._successful_auth_delegates))
+
+        for ad in list(self._successful_auth_delegates):
+            try:
+                await asyncio.wait_for(connection.authenticate(ad), 10)
+            except Exception as e:
+                logger.error('Failed to restore authentication')
+                logger.exception(e)
+                return True
+
+        logger.debug('Restoring authentications: done')
+        return False
+
+    def _forget_connection(self):
+        logger.info('_forget_connection')
+        if self.connection:
+            pending = list(self.connection.ack_callbacks_by_id.values())
+            self.connection.ack_callbacks_by_id.clear()
+            self.connection.delegate = None
+            for callback in pending:
+                if isinstance(callback, _Reply):
+                    callback.fail(ConnectionError('Connection closed'))
+            self._stop_connection(self._aio_connection)
+            self.connection = None
+            self._aio_connection = None
+        self._disconnect_subscriptions()
+
+    def _start_disconnecting(self):
+        logger.info('_start_disconnecting')
+        if self._aio_connection:
+            self._stop_connection(self._aio_connection)
+
+    def _stop_connection(self, connection):
+        task = self._loop.create_task(connection.stop())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def wait_closed(self):
+        if self._closing:
+            await asyncio.wait(list(self._closing))
+
+    def _schedule_reconnect(self):
+        now = time.time()
+        target = self._time_of_last_reconnect +\
+            min(
+                self.reconnect_interval * (2 ** self._fail_count),
+                self.max_reconnect_interval)
+        delay = max(target - now, 0)
+        logger.error('Reconnecting in %f seconds', delay)
+
+        def reconnect():
+            logger.warning('Time to reconnect')
+            self._reconnect_timer = None
+            self._queue.put(a.Tick())
+
+        self._reconnect_timer = self._loop.call_later(delay, reconnect)
+
+
+class _EndOfData(object):
+    pass
+
+
+_end_of_data = _EndOfData()
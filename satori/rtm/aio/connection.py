@@ -0,0 +1,586 @@
+'''
+
+satori.rtm.aio.connection
+=========================
+
+Provides a low-level asyncio API for managing a connection to RTM.
+
+'''
+
+import asyncio
+from base64 import b64encode
+from hashlib import sha1
+import os
+import socket
+import ssl
+
+import certifi
+
+from miniws4py import WS_KEY, WS_VERSION
+from miniws4py.compat import urlsplit
+from miniws4py.exc import HandshakeError
+from miniws4py.messaging import (
+    BinaryMessage, TextMessage,
+    CloseControlMessage, PingControlMessage, PongControlMessage)
+from miniws4py.streaming import Stream
+
+import satori.rtm.auth as auth
+import satori.rtm.connection
+from satori.rtm.exceptions import AuthError
+from satori.rtm.internal_logger import logger, levels
+
+DEFAULT_READING_SIZE = 2
+close_timeout_in_seconds = 5
+
+
+class Connection(object):
+    """
+Connection object that runs on an asyncio event loop instead of
+reader and pinger threads.
+
+The Connection object is valid as long as it stays connected to RTM.
+If a disconnect occurs, you must create a new Connection object,
+resubscribe to all channels, and perform authentication again, if necessary.
+
+.. note:: The `satori.rtm.aio.client` module includes a default implementation
+          to handle disconnects automatically and reconnect and resubscribes
+          as necessary.
+    """
+
+    def __init__(
+            self, endpoint, appkey,
+            delegate=None, https_proxy=None, protocol='json', loop=None,
+            keep_raw_messages=False, codec=None, metrics=None,
+            ping_interval=None, ping_timeout=None):
+        """
+Description
+    Constructor for the Connection class. Takes the same parameters as
+    `satori.rtm.connection.Connection` plus an optional event loop.
+
+Parameters
+    * endpoint {string} [required] - RTM endpoint as a string.
+    * appkey {string} [required] - Appkey used to access RTM.
+    * delegate {object} [optional] - Delegate object to handle received
+      messages, channel errors, internal errors, and closed connections.
+    * https_proxy (string, int) [optional] - (host, port) tuple for https proxy
+    * protocol {string} [optional] - one of 'cbor' or 'json' (default)
+    * loop {asyncio.AbstractEventLoop} [optional] - event loop to run on,
+      default is the current event loop.
+    * keep_raw_messages {boolean} [optional] - see
+      `satori.rtm.connection.Connection`.
+    * codec {string or Codec} [optional] - see `satori.rtm.codec`.
+    * metrics {Metrics} [optional] - see `satori.rtm.metrics`.
+    * ping_interval, ping_timeout {float} [optional] - see
+      `satori.rtm.connection.Connection`.
+        """
+        self._pdu = _PduLayer(
+            self, endpoint, appkey, delegate, https_proxy, protocol,
+            keep_raw_messages=keep_raw_messages, codec=codec,
+            metrics=metrics, ping_interval=ping_interval,
+            ping_timeout=ping_timeout)
+        self._loop = loop or asyncio.get_event_loop()
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._ping_task = None
+        self._closed = False
+        self._close_sent = False
+        self._acks_below_watermark = None
+
+    @property
+    def delegate(self):
+        return self._pdu.delegate
+
+    @property
+    def metrics(self):
+        return self._pdu.metrics
+
+    @delegate.setter
+    def delegate(self, d):
+        self._pdu.delegate = d
+
+    @property
+    def protocol(self):
+        return self._pdu.protocol
+
+    async def start(self):
+        """
+Description
+    Opens a WebSocket connection to RTM. Must be awaited before any
+    other request is made.
+        """
+        if self._writer:
+            raise RuntimeError('Connection is already open')
+
+        logger.debug('connection.start %s', self._pdu.url)
+        self._reader, self._writer = await _open_websocket(
+            self._loop, self._pdu.url, self._pdu.https_proxy,
+            ['cbor'] if self.protocol == 'cbor' else [])
+        self._reader_task = self._loop.create_task(self._read_until_the_end())
+        self._ping_task = self._loop.create_task(self._ping_until_the_end())
+
+    async def stop(self):
+        """
+Description
+    Closes the WebSocket connection to RTM and waits until the closing
+    handshake is complete.
+        """
+        if not self._writer or self._closed:
+            logger.info('Trying to close a connection that is not open')
+            return
+
+        try:
+            self._send_close()
+            await asyncio.wait_for(
+                asyncio.shield(self._reader_task),
+                close_timeout_in_seconds)
+        except Exception as e:
+            # the socket may already be gone or the server
+            # may never answer our goodbye
+            logger.exception(e)
+            self._on_closed()
+
+    def send(self, payload):
+        """
+Description
+    Sends the specified PDU to RTM without waiting for the socket to
+    accept it. This is a lower-level method suitable for manually performing
+    PDU serialization.
+        """
+        if not self._writer or self._closed:
+            raise RuntimeError(
+                'Attempting to send data, but connection is not open yet')
+        if levels.debug:
+            logger.debug('Sending payload %s', payload)
+        self._pdu.metrics.bytes_out += len(payload)
+        if self.protocol == 'cbor':
+            self._writer.write(BinaryMessage(payload).single(masked=True))
+        else:
+            self._writer.write(TextMessage(payload).single(masked=True))
+
+    def send_many(self, payloads):
+        """
+Description
+    Sends the specified PDUs to RTM with a single write to the transport.
+        """
+        if not self._writer or self._closed:
+            raise RuntimeError(
+                'Attempting to send data, but connection is not open yet')
+        if levels.debug:
+            logger.debug('Sending %d payloads', len(payloads))
+        self._pdu.metrics.bytes_out += sum(len(p) for p in payloads)
+        message_type =\
+            BinaryMessage if self.protocol == 'cbor' else TextMessage
+        self._writer.write(
+            b''.join([message_type(p).single(masked=True) for p in payloads]))
+
+    async def drain(self):
+        """
+Description
+    Waits until the outgoing buffer is flushed down to its low watermark.
+        """
+        if self._writer and not self._closed:
+            await self._writer.drain()
+
+    async def publish(self, channel, message, ack=True):
+        """
+Description
+    Publishes a message to the specified channel.
+
+    If `ack` is True (the default), waits for RTM to acknowledge
+    the publish and returns the position of the published message, otherwise
+    returns as soon as the message is handed to the socket.
+
+    Raises `RuntimeError` if RTM replied with an error.
+
+Parameters
+    * channel {string} [required] - Name of the channel.
+    * message {object} [required] - Value to publish.
+    * ack {bool} [optional] - Whether to wait for RTM acknowledgement.
+        """
+        await self._wait_for_acks_below_watermark()
+        if not ack:
+            self._pdu.publish(channel, message)
+            await self.drain()
+            return
+        reply = self._reply()
+        self._pdu.publish(channel, message, reply)
+        pdu = _expect(await reply.future, u'rtm/publish/ok')
+        return pdu[u'body'][u'position']
+
+    async def read(self, channel, args=None):
+        """
+Description
+    Reads a value from the specified channel and returns it.
+    Raises `RuntimeError` if RTM replied with an error.
+        """
+        reply = self._reply()
+        self._pdu.read(channel, args, reply)
+        pdu = _expect(await reply.future, u'rtm/read/ok')
+        return pdu[u'body'][u'message']
+
+    async def write(self, channel, value):
+        """
+Description
+    Writes the given value into the specified channel and returns the
+    position of the written value.
+    Raises `RuntimeError` if RTM replied with an error.
+        """
+        await self._wait_for_acks_below_watermark()
+        reply = self._reply()
+        self._pdu.write(channel, value, reply)
+        pdu = _expect(await reply.future, u'rtm/write/ok')
+        return (pdu.get(u'body') or {}).get(u'position')
+
+    async def delete(self, channel):
+        """
+Description
+    Deletes any value from the specified channel.
+    Raises `RuntimeError` if RTM replied with an error.
+        """
+        reply = self._reply()
+        self._pdu.delete(channel, reply)
+        _expect(await reply.future, u'rtm/delete/ok')
+
+    async def subscribe(self, channel_or_subscription_id, args=None):
+        """
+Description
+    Subscribes to the specified channel and returns the body of the reply.
+    Incoming data is delivered to `delegate.on_subscription_data(data)`.
+    Raises `RuntimeError` if RTM replied with an error.
+        """
+        reply = self._reply()
+        self._pdu.subscribe(channel_or_subscription_id, args, reply)
+        pdu = _expect(await reply.future, u'rtm/subscribe/ok')
+        return pdu[u'body']
+
+    async def unsubscribe(self, subscription_id):
+        """
+Description
+    Unsubscribes from the specified channel.
+    Raises `RuntimeError` if RTM replied with an error.
+        """
+        reply = self._reply()
+        self._pdu.unsubscribe(subscription_id, reply)
+        _expect(await reply.future, u'rtm/unsubscribe/ok')
+
+    async def authenticate(self, auth_delegate):
+        """
+Description
+    Validates the identity of a client. Raises
+    `satori.rtm.exceptions.AuthError` if authentication failed.
+        """
+        reply = self._reply()
+        self._pdu.authenticate(auth_delegate, reply)
+        outcome = await reply.future
+        if isinstance(outcome, auth.Error):
+            raise AuthError(outcome.message)
+
+    def _reply(self):
+        return _Reply(self._loop)
+
+    async def _wait_for_acks_below_watermark(self):
+        pdu = self._pdu
+        watermark = satori.rtm.connection.high_ack_count_watermark
+        if len(pdu.ack_callbacks_by_id) < watermark:
+            return
+        if self._acks_below_watermark is None:
+            self._acks_below_watermark = asyncio.Event()
+        pdu._ack_waiters += 1
+        try:
+            while not self._closed and\
+                    len(pdu.ack_callbacks_by_id) >= watermark:
+                self._acks_below_watermark.clear()
+                await self._acks_below_watermark.wait()
+        finally:
+            pdu._ack_waiters -= 1
+
+    def _notify_ack_waiters(self):
+        if self._acks_below_watermark is not None:
+            self._acks_below_watermark.set()
+
+    async def _read_until_the_end(self):
+        stream = Stream()
+        # Text frames are decoded below anyway
+        stream.validate_utf8 = False
+        reading_size = DEFAULT_READING_SIZE
+        try:
+            while True:
+                some_bytes = await self._reader.readexactly(reading_size)
+                reading_size =\
+                    stream.parser.send(some_bytes) or DEFAULT_READING_SIZE
+
+                if stream.closing is not None:
+                    logger.debug(
+                        'Closing message received (%d) %s',
+                        stream.closing.code, stream.closing.reason)
+                    self._send_close(stream.closing.code)
+                    break
+
+                if stream.errors:
+                    error = stream.errors[0]
+                    logger.error(
+                        'Websocket closed because %s', error.reason)
+                    self._send_close(error.code, error.reason)
+                    break
+
+                if stream.has_message:
+                    m = stream.message
+                    stream.message = None
+                    if m.is_binary:
+                        self._pdu.on_incoming_binary_frame(m.data)
+                    else:
+                        try:
+                            text = m.data.decode('utf8')
+                        except UnicodeDecodeError:
+                            logger.error(
+                                'Websocket closed because of invalid UTF-8')
+                            self._send_close(1007, 'Invalid UTF-8 bytes')
+                            break
+                        self._pdu.on_incoming_text_frame(text)
+
+                if stream.pings:
+                    for ping in stream.pings:
+                        self._writer.write(
+                            PongControlMessage(ping.data).single(masked=True))
+                    stream.pings = []
+
+                if stream.pongs:
+                    self._pdu.on_ws_ponged()
+                    for pong in stream.pongs:
+                        self._pdu.on_pong_received(bytes(pong.data))
+                    stream.pongs = []
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.debug('Connection lost: %s', e)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self._on_closed()
+
+    async def _ping_until_the_end(self):
+        logger.debug('Starting ping task')
+        pdu = self._pdu
+        try:
+            while not self._closed:
+                await asyncio.sleep(pdu.ping_interval)
+                if self._closed:
+                    break
+                logger.debug('send ping')
+                pdu._ping_payload = str(next(pdu._ping_sequence))
+                self._writer.write(
+                    PingControlMessage(pdu._ping_payload).single(masked=True))
+                pdu._last_ping_time = self._loop.time()
+                self._loop.call_later(
+                    pdu.ping_timeout, self._check_pong, pdu._last_ping_time)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+        logger.debug('Finishing ping task')
+
+    def _check_pong(self, ping_time):
+        if self._closed:
+            return
+        ponged = self._pdu._last_ponged_time
+        if ponged is None or ponged < ping_time:
+            logger.error(
+                'Server has not responded to WS ping in %s seconds',
+                self._pdu.ping_timeout)
+            self._on_closed()
+
+    def _send_close(self, code=1000, reason=''):
+        if not self._close_sent:
+            self._close_sent = True
+            self._writer.write(
+                CloseControlMessage(code=code, reason=reason).single(
+                    masked=True))
+
+    def _on_closed(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._ping_task:
+            self._ping_task.cancel()
+        try:
+            self._writer.close()
+        except Exception as e:
+            logger.exception(e)
+
+        pending = list(self._pdu.ack_callbacks_by_id.values())
+        self._pdu.ack_callbacks_by_id.clear()
+        for callback in pending:
+            if isinstance(callback, _Reply):
+                callback.fail(ConnectionError('Connection closed'))
+        if self._pdu._auth_callback:
+            auth_callback = self._pdu._auth_callback
+            self._pdu._auth_callback = None
+            self._pdu._next_auth_action = None
+            auth_callback(auth.Error('Connection closed'))
+
+        self._notify_ack_waiters()
+
+        if self.delegate:
+            self.delegate.on_connection_closed()
+
+
+class _PduLayer(satori.rtm.connection.Connection):
+    '''PDU (de)serialization and ack bookkeeping of the threaded Connection
+       with frames going to and coming from the asyncio transport'''
+
+    def __init__(self, owner, *args, **kwargs):
+        satori.rtm.connection.Connection.__init__(self, *args, **kwargs)
+        self._owner = owner
+
+    def start(self):
+        raise RuntimeError('Use satori.rtm.aio.connection.Connection.start')
+
+    def stop(self):
+        self._owner._loop.create_task(self._owner.stop())
+
+    def send(self, payload):
+        self._owner.send(payload)
+
+    def send_many(self, payloads):
+        self._owner.send_many(payloads)
+
+    def on_ws_ponged(self):
+        self._last_ponged_time = self._owner._loop.time()
+
+    def on_pong_received(self, payload):
+        ping_payload = self._ping_payload
+        if ping_payload is not None and\
+                payload == ping_payload.encode('ascii'):
+            self._ping_payload = None
+            self.metrics.record_ping_rtt(
+                self._owner._loop.time() - self._last_ping_time)
+
+    def _wait_for_acks_below_watermark(self, name):
+        # acks are read on the same event loop, so waiting here would
+        # block them forever, the owner awaits the watermark instead
+        pass
+
+    def _notify_ack_waiters(self):
+        self._owner._notify_ack_waiters()
+
+
+class _Reply(object):
+    '''Callback for an acked request that resolves a future'''
+
+    def __init__(self, loop):
+        self.future = loop.create_future()
+
+    def __call__(self, pdu):
+        if not self.future.done():
+            self.future.set_result(pdu)
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+def _expect(pdu, ok_action):
+    if pdu[u'action'] != ok_action:
+        raise RuntimeError(pdu)
+    return pdu
+
+
+async def _open_websocket(loop, url, proxy, protocols):
+    scheme, rest = url.split(':', 1)
+    parsed = urlsplit(rest, scheme='http')
+    if not parsed.hostname:
+        raise ValueError('Invalid hostname from: %s' % url)
+    host = parsed.hostname
+    if scheme == 'ws':
+        port = parsed.port or 80
+        ssl_context = None
+    elif scheme == 'wss':
+        port = parsed.port or 443
+        ssl_context = ssl.create_default_context(
+            purpose=ssl.Purpose.SERVER_AUTH,
+            cafile=certifi.where())
+    else:
+        raise ValueError('Invalid scheme: %s' % scheme)
+    resource = parsed.path or '/'
+    if parsed.query:
+        resource += '?' + parsed.query
+
+    if proxy:
+        sock = await loop.run_in_executor(
+            None, _connect_through_proxy, proxy, host, port)
+        reader, writer = await asyncio.open_connection(
+            sock=sock, ssl=ssl_context,
+            server_hostname=host if ssl_context else None)
+    else:
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context)
+
+    try:
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        key = b64encode(os.urandom(16))
+        origin = scheme + '://' + host
+        if parsed.port:
+            origin += ':' + str(parsed.port)
+        headers = [
+            'GET %s HTTP/1.1' % resource,
+            'Host: %s:%s' % (host, port),
+            'Connection: Upgrade',
+            'Upgrade: websocket',
+            'Sec-WebSocket-Key: %s' % key.decode('utf-8'),
+            'Sec-WebSocket-Version: %s' % max(WS_VERSION),
+            'Origin: %s' % origin]
+        if protocols:
+            headers.append('Sec-WebSocket-Protocol: %s' % ','.join(protocols))
+        writer.write('\r\n'.join(headers + ['', '']).encode('utf-8'))
+
+        response = await reader.readuntil(b'\r\n\r\n')
+        _check_handshake_response(response, key)
+    except Exception:
+        writer.close()
+        raise
+
+    return reader, writer
+
+
+def _connect_through_proxy(proxy, host, port):
+    sock = socket.create_connection(proxy)
+    try:
+        request = 'CONNECT {0}:{1} HTTP/1.0\r\n\r\n'.format(host, port)
+        sock.sendall(request.encode('ascii'))
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(128)
+            if not chunk:
+                raise HandshakeError('No response from proxy')
+            response += chunk
+        code = response.split(b' ', 2)[1]
+        if code != b'200':
+            raise HandshakeError(
+                'HTTP CONNECT to proxy failed: {0}'.format(code))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _check_handshake_response(response, key):
+    lines = response.strip().split(b'\r\n')
+    code = lines[0].split(b' ', 2)[1]
+    if code != b'101':
+        raise HandshakeError(
+            'Invalid response status: {0}'.format(lines[0]))
+    for line in lines[1:]:
+        header, value = line.split(b':', 1)
+        header = header.strip().lower()
+        value = value.strip().lower()
+        if header == b'upgrade' and value != b'websocket':
+            raise HandshakeError('Invalid Upgrade header: %s' % value)
+        elif header == b'sec-websocket-accept':
+            match = b64encode(sha1(key + WS_KEY).digest())
+            if value != match.lower():
+                raise HandshakeError('Invalid challenge response: %s' % value)
@@ -20,7 +20,7 @@ from contextlib import contextmanager
 import satori.rtm.auth as auth
 from satori.rtm.exceptions import AuthError
 import satori.rtm.internal_queue as queue
-import satori.rtm.internal_json as json
+from satori.rtm.codec import get_codec
 import threading
 
 import satori.rtm.internal_client_action as a
@@ -44,7 +44,10 @@ class Client(object):
             fail_count_threshold=float('inf'),
             reconnect_interval=1, max_reconnect_interval=300,
             observer=None, restore_auth_on_reconnect=True,
-            max_queue_size=20000, https_proxy=None, protocol='json'):
+            max_queue_size=20000, https_proxy=None, protocol='json',
+            coalesce_writes=None, keep_raw_messages=False, codec=None,
+            merge_subscription_data=False, ping_interval=None,
+            ping_timeout=None, ack_timeout=None):
         r"""
 
 Description
@@ -98,12 +101,40 @@ Parameters
       * Only use binary data in ``message`` if you know all subscribers are
         using CBOR protocol
 
+    * coalesce_writes (int, float) [optional] - (flush size in bytes, flush
+      interval in seconds) tuple. When given, outgoing PDUs are buffered and
+      written to the socket together as soon as the buffer reaches the flush
+      size or the flush interval elapses, whichever comes first.
+    * keep_raw_messages {boolean} [optional] - when True, `messages` in
+      subscription data is a list with a `raw` attribute that holds the
+      same messages as RTM encoded them (text for JSON, bytes for CBOR),
+      ready to be republished without encoding them again. Default is
+      False.
+    * codec {string or Codec} [optional] - encoder and decoder to use for
+      the protocol, for example 'orjson'. See `satori.rtm.codec`. Default is
+      the codec named like the protocol.
+    * merge_subscription_data {boolean} [optional] - when True, subscription
+      data PDUs of one subscription that are already waiting in the queue are
+      passed to `on_subscription_data` in a single call, with all their
+      messages in order and the position of the last one. Default is False.
+    * ping_interval {float} [optional] - seconds between WebSocket pings.
+      Default is 60.
+    * ping_timeout {float} [optional] - seconds to wait after a ping for
+      anything to come from RTM before the connection is considered dead
+      and the client reconnects. Lower both for faster failover. Default
+      is ping_interval.
+    * ack_timeout {float} [optional] - seconds to wait for the reply to a
+      request with a callback. When it doesn't come in time, the callback
+      gets a `<action>/error` reply with "ack_timeout" error instead.
+      Default is None, wait forever.
+
         """
 
         assert endpoint
         assert endpoint.startswith('ws://') or endpoint.startswith('wss://'),\
             'Endpoint must start with "ws(s)://" but "%s" does not' % endpoint
 
+        self._dumps = get_codec(codec, protocol).dumps
         self._queue = queue.Queue(maxsize=max_queue_size)
 
         self._internal = InternalClient(
@@ -112,7 +143,9 @@ Parameters
             fail_count_threshold,
             reconnect_interval, max_reconnect_interval,
             observer, restore_auth_on_reconnect, https_proxy,
-            protocol)
+            protocol, coalesce_writes, keep_raw_messages, codec,
+            merge_subscription_data, ping_interval=ping_interval,
+            ping_timeout=ping_timeout, ack_timeout=ack_timeout)
 
         self._disposed = False
         self._protocol = protocol
@@ -122,12 +155,6 @@ Parameters
         self._thread.daemon = True
         self._thread.start()
 
-        if protocol == 'cbor':
-            import cbor2
-            self._dumps = cbor2.dumps
-        else:
-            self._dumps = json.dumps
-
     def last_connecting_error(self):
         """
 Description
@@ -244,6 +271,75 @@ Parameters
         """
         self._enqueue(a.Publish(channel, self._dumps(message), callback))
 
+    def publish_many(self, channel, messages, callback=None):
+        """
+Description
+    Publishes several messages to the specified channel. All the publish
+    PDUs are framed into a single buffer and written to the socket at once,
+    which is much cheaper than calling `publish` for each message.
+
+    Like with `publish`, the messages are queued and sent after the client
+    connects if it is not connected yet.
+
+Parameters
+    * channel {string} [required] - Name of the channel to which you want to
+      publish.
+    * messages {list} [required] - Python entities to publish as messages,
+      see `publish` for the requirements.
+    * callback {function} [optional] - Callback function to execute on each
+      PDU response returned by RTM to the publish requests.
+        """
+        self._enqueue(
+            a.PublishMany(
+                channel, [self._dumps(m) for m in messages], callback))
+
+    def publish_preserialized_message(self, channel, message, callback=None):
+        """
+Description
+    Publishes a message that is already encoded in the protocol of the
+    client: JSON text for 'json', bytes for 'cbor'. Raw messages delivered
+    to `on_subscription_raw_data` can be republished this way without
+    decoding and encoding them again.
+
+Parameters
+    * channel {string} [required] - Name of the channel to which you want to
+      publish.
+    * message {string or bytes} [required] - Encoded message.
+    * callback {function} [optional] - Callback function to execute on the PDU
+      response returned by RTM to the publish request.
+        """
+        self._enqueue(a.Publish(channel, message, callback))
+
+    def publish_many_preserialized_messages(
+            self, channel, messages, callback=None):
+        """
+Description
+    Same as `publish_many` for messages that are already encoded in the
+    protocol of the client, see `publish_preserialized_message`.
+
+Parameters
+    * channel {string} [required] - Name of the channel to which you want to
+      publish.
+    * messages {list} [required] - Encoded messages.
+    * callback {function} [optional] - Callback function to execute on each
+      PDU response returned by RTM to the publish requests.
+        """
+        self._enqueue(a.PublishMany(channel, list(messages), callback))
+
+    def publisher(self, channel):
+        """
+Description
+    Returns a `Publisher` bound to the specified channel. It is a shortcut
+    for the publish methods of the Client and holds no encoded data itself:
+    publishes go through the client queue like any other, and the
+    connection of the client keeps the encoded PDU envelopes of the
+    channels published to.
+
+Parameters
+    * channel {string} [required] - Name of the channel to publish to.
+        """
+        return Publisher(self, channel)
+
     def read(self, channel, args=None, callback=None):
         """
 Description
@@ -306,7 +402,7 @@ Parameters
 
     def subscribe(
             self, channel_or_subscription_id, mode,
-            subscription_observer, args=None):
+            subscription_observer, args=None, batch=None):
         """
 Description
     Subscribes to the specified channel.
@@ -339,11 +435,19 @@ Parameters
       subscribe request. To include a filter, put the desired fSQL query
       as a string value for the `filter` key. See *Subscribe PDU* in the
       online docs.
+    * batch (int, float) [optional] - (max messages, max delay in seconds)
+      tuple. When given and the observer implements
+      `on_subscription_data_batch(messages, last_position)`, messages of
+      the subscription are accumulated and passed to it in a single call
+      as soon as there are max messages of them or the first of them has
+      waited for max delay, whichever comes first. Pending messages are
+      also delivered before the subscription is left or its observer is
+      replaced.
         """
         self._enqueue(
             a.Subscribe(
                 channel_or_subscription_id, mode,
-                subscription_observer, args))
+                subscription_observer, args, batch))
 
     def unsubscribe(self, channel_or_subscription_id):
         """
@@ -380,6 +484,22 @@ Description
     def observer(self, o):
         self._internal.observer = o
 
+    @property
+    def protocol(self):
+        """
+Description
+    Protocol of the client, 'json' or 'cbor'.
+        """
+        return self._protocol
+
+    @property
+    def metrics(self):
+        """
+Description
+    `satori.rtm.metrics.Metrics` of the client. Kept across reconnects.
+        """
+        return self._internal.metrics
+
     def is_connected(self):
         """
 Description
@@ -393,10 +513,37 @@ Returns
 
     def _internal_event_loop(self):
         while True:
-            if self._internal.process_one_message(timeout=None):
+            if self._internal.process_many(timeout=None):
                 break
 
 
+class Publisher(object):
+    """
+Publisher handle for a single channel, created with `Client.publisher`.
+Its methods are the publish methods of the Client without the `channel`
+parameter. Unlike `satori.rtm.connection.Publisher` it holds no encoded
+envelope, the Client connection may change on every reconnect.
+    """
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+
+    def publish(self, message, callback=None):
+        self.client.publish(self.channel, message, callback)
+
+    def publish_many(self, messages, callback=None):
+        self.client.publish_many(self.channel, messages, callback)
+
+    def publish_preserialized_message(self, message, callback=None):
+        self.client.publish_preserialized_message(
+            self.channel, message, callback)
+
+    def publish_many_preserialized_messages(self, messages, callback=None):
+        self.client.publish_many_preserialized_messages(
+            self.channel, messages, callback)
+
+
 class ClientStateObserver(object):
     def on_enter_stopped(self):
         logger.info('on_enter_stopped')
@@ -551,16 +698,31 @@ Deleted       on_deleted()             n/a
 
 Other Callbacks
 
-=================== ======================
+=================== ==========================
 Event               Callback
-=================== ======================
+=================== ==========================
 Created             on_created()
 Message(s) Received on_subscription_data()
-=================== ======================
+Message(s) Received on_subscription_raw_data()
+Message(s) Received on_subscription_data_batch()
+=================== ==========================
 
 .. note:: Regardless of the protocol you choose when you create your client, the
           ``data`` parameter contains Python objects.
 
+An observer that implements `on_subscription_raw_data(self, data)` gets it
+called instead of `on_subscription_data`. There ``data['messages']`` holds the
+messages exactly as RTM encoded them: JSON text or CBOR bytes depending on the
+protocol. Other fields such as ``data['position']`` are Python objects as
+usual. Raw messages can be forwarded with
+`client.publish_preserialized_message` or stored as is.
+
+When the subscription is made with the `batch` parameter of
+`client.subscribe`, an observer that implements
+`on_subscription_data_batch(self, messages, last_position)` gets the
+messages of several data PDUs at once instead: ``messages`` is the list of
+them in order and ``last_position`` the position of the last one.
+
 The following figure shows an example subscription observer with an implemented
 callback function::
 
@@ -0,0 +1,97 @@
+'''
+
+satori.rtm.codec
+================
+
+Registry of the encoders and decoders that Connection and Client use for
+messages and PDUs. Pass the name of a registered codec, or a `Codec`, as the
+`codec` parameter of `satori.rtm.client.Client`, `make_client` or
+`satori.rtm.connection.Connection`.
+
+Registered by default:
+
+* 'json' - `rapidjson` when it is installed, the standard `json` module
+  otherwise. Default for the 'json' protocol.
+* 'stdlib-json' - the standard `json` module.
+* 'cbor' - `cbor2`. Default for the 'cbor' protocol.
+* 'orjson', 'ujson', 'rapidjson' - registered on first use when the package
+  is installed.
+
+Encoders may return text or bytes. Bytes returned by a JSON encoder such
+as `orjson.dumps` are copied into the PDU without being decoded and
+encoded again.
+
+'''
+
+import importlib
+import json as stdlib_json
+from collections import namedtuple
+
+import cbor2
+
+import satori.rtm.internal_json as json
+
+Codec = namedtuple('Codec', ['protocol', 'dumps', 'loads'])
+
+_codecs = {}
+_optional_json_codecs = ['orjson', 'ujson', 'rapidjson']
+
+
+def register_codec(name, protocol, dumps, loads):
+    """
+Description
+    Registers a codec under the given name, replacing any codec
+    registered with the same name before.
+
+Parameters
+    * name {string} [required] - Name to pass as `codec` to Client or
+      Connection.
+    * protocol {string} [required] - 'json' or 'cbor', the RTM protocol the
+      codec speaks.
+    * dumps {function} [required] - Encodes a Python object, returns text or
+      bytes.
+    * loads {function} [required] - Decodes a PDU (text for 'json', bytes
+      for 'cbor') into Python objects. Raises ValueError on malformed input.
+    """
+    if protocol not in ('json', 'cbor'):
+        raise ValueError(
+            'Protocol must be one of "cbor", "json", not %s' % protocol)
+    _codecs[name] = Codec(protocol, dumps, loads)
+
+
+def get_codec(codec=None, protocol='json'):
+    """
+Description
+    Returns the `Codec` to use for the given protocol. Raises ValueError
+    if the codec is unknown or speaks another protocol and ImportError if
+    it depends on a package that is not installed.
+
+Parameters
+    * codec {string or Codec} [optional] - name of a registered codec or a
+      `Codec`. Defaults to the codec named like the protocol.
+    * protocol {string} [optional] - 'json' (default) or 'cbor'.
+    """
+    if codec is None:
+        codec = protocol
+
+    if isinstance(codec, Codec):
+        result = codec
+    else:
+        result = _codecs.get(codec)
+        if result is None and codec in _optional_json_codecs:
+            module = importlib.import_module(codec)
+            register_codec(codec, 'json', module.dumps, module.loads)
+            result = _codecs[codec]
+        if result is None:
+            raise ValueError('Unknown codec %s' % codec)
+
+    if result.protocol != protocol:
+        raise ValueError(
+            'Codec for "%s" protocol can not be used with "%s" protocol' % (
+                result.protocol, protocol))
+    return result
+
+
+register_codec('json', 'json', json.dumps, json.loads)
+register_codec('stdlib-json', 'json', stdlib_json.dumps, stdlib_json.loads)
+register_codec('cbor', 'cbor', cbor2.dumps, cbor2.loads)
@@ -11,21 +11,36 @@ Provides a low-level API for managing a connection to RTM.
 from __future__ import print_function
 
 import itertools
+import json
 import posixpath
-import satori.rtm.internal_json as json
 import cbor2
 import re
+import struct
 import sys
 import threading
 import time
 
+from satori.rtm.codec import get_codec
 import satori.rtm.internal_logger
+from satori.rtm.internal_logger import levels
 from satori.rtm.internal_connection_miniws4py import RtmWsClient
+import satori.rtm.internal_queue as queue
+from satori.rtm.metrics import Metrics
+from satori.rtm.internal_timers import timers
+from satori.rtm.internal_pdu_splitter import split_cbor_pdu, split_json_pdu
+from satori.rtm.internal_writer import Writer
 import satori.rtm.auth as auth
 import satori.rtm.exceptions as exs
 
 ping_interval_in_seconds = 60
+max_cached_channel_envelopes = 10000
 high_ack_count_watermark = 20000
+# subscriptions stay on RTM whether or not their reply is waited for,
+# so only requests that are done once replied to can time out
+ack_timeout_actions = frozenset([
+    u'rtm/publish', u'rtm/read', u'rtm/write', u'rtm/delete'])
+
+Full = queue.Full
 
 # FIXME: *_sync functions are very similar
 
@@ -43,7 +58,11 @@ resubscribe to all channels, and perform authentication again, if necessary.
 
     def __init__(
             self, endpoint, appkey,
-            delegate=None, https_proxy=None, protocol='json'):
+            delegate=None, https_proxy=None, protocol='json',
+            coalesce_writes=None, outbound_queue_size=None,
+            backpressure='block', keep_raw_messages=False, codec=None,
+            metrics=None, ping_interval=None, ping_timeout=None,
+            ack_timeout=None):
         """
 Description
     Constructor for the Connection class. Creates and returns an instance of the
@@ -68,11 +87,51 @@ Parameters
       messages, channel errors, internal errors, and closed connections.
     * https_proxy (string, int) [optional] - (host, port) tuple for https proxy
     * protocol {string} [optional] - one of 'cbor' or 'json' (default)
+    * coalesce_writes (int, float) [optional] - (flush size in bytes, flush
+      interval in seconds) tuple. When given, outgoing PDUs are buffered and
+      written to the socket together as soon as the buffer reaches the flush
+      size or the flush interval elapses, whichever comes first.
+    * outbound_queue_size {int} [optional] - enables the asynchronous send
+      path: PDUs are framed on the calling thread and put into an outbound
+      buffer of at most this many frames, which a dedicated writer thread
+      drains with vectored writes. By default PDUs are written synchronously
+      on the calling thread.
+    * backpressure {string} [optional] - what to do when the outbound buffer
+      is full: 'block' (default) waits for the writer thread to make room,
+      'drop-oldest' discards the oldest queued frames and 'raise' raises
+      `satori.rtm.connection.Full`. Dropped requests with a callback get an
+      '<action>/error' reply with error 'dropped'. Pongs and the closing
+      frame are never dropped.
+    * keep_raw_messages {boolean} [optional] - when True, `messages` in
+      subscription data is a list with a `raw` attribute that holds the
+      same messages as RTM encoded them (text for JSON, bytes for CBOR).
+      They can be republished with `publish_preserialized_message` without
+      encoding them again. The messages are still decoded, by the json
+      module or cbor2 rather than the codec, since their decoders are what
+      finds where each message ends. Default is False.
+    * codec {string or Codec} [optional] - encoder and decoder to use for
+      the protocol, see `satori.rtm.codec`. Default is the codec named like
+      the protocol.
+    * metrics {Metrics} [optional] - `satori.rtm.metrics.Metrics` object to
+      count messages, bytes, PDUs and acknowledgement latencies in.
+      Default is a new one, available as `connection.metrics`.
+    * ping_interval {float} [optional] - seconds between WebSocket pings.
+      Default is `ping_interval_in_seconds` of this module (60).
+    * ping_timeout {float} [optional] - seconds to wait after a ping for
+      anything to come from RTM before the connection is considered dead
+      and closed. Default is ping_interval. Pings and these checks run on
+      a timer thread shared by all connections.
+    * ack_timeout {float} [optional] - seconds to wait for the reply to a
+      publish, read, write or delete request with a callback. When it
+      doesn't come in time, the callback gets a `<action>/error` reply
+      with "ack_timeout" error instead, from the shared timer thread, so
+      such callbacks must not block. Default is None, wait forever.
         """
 
         validate_endpoint(endpoint, appkey, protocol)
 
         self.logger = satori.rtm.internal_logger.logger
+        satori.rtm.internal_logger.refresh_levels()
 
         re_version = re.compile(r'/v(\d+)$')
         version_match = re_version.search(endpoint)
@@ -88,6 +147,7 @@ Parameters
         self.url += '?appkey={0}'.format(appkey)
         self.delegate = delegate
         self.ack_callbacks_by_id = {}
+        self._sent_at_by_id = {}
         self.action_id_iterator = itertools.count()
         self.https_proxy = https_proxy
         self._auth_lock = threading.RLock()
@@ -97,13 +157,44 @@ Parameters
         self._last_ponged_time = None
         self._time_to_stop_pinging = False
         self._auth_callback = None
-        self._ping_thread = None
+        self.ping_interval = ping_interval or ping_interval_in_seconds
+        self.ping_timeout = ping_timeout or self.ping_interval
+        self._ping_timer = None
+        self.ack_timeout = ack_timeout
+        self._ack_timer = None
+        self._ping_payload = None
+        self._ping_sequence = itertools.count()
         self._ws_thread = None
         self.protocol = protocol
-        if self.protocol == 'cbor':
-            self._dumps = cbor2.dumps
+        # CBOR PDUs are not text
+        self._binary = protocol == 'cbor'
+        self.codec = get_codec(codec, protocol)
+        self._dumps = self.codec.dumps
+        self._loads = self.codec.loads
+        self.coalesce_writes = coalesce_writes
+        self._coalescing_lock = threading.RLock()
+        self._coalesced_payloads = []
+        self._coalesced_size = 0
+        self._flush_timer = None
+        self.outbound_queue_size = outbound_queue_size
+        self.backpressure = backpressure
+        self._writer = None
+        self._acks_below_watermark = threading.Condition()
+        self._ack_waiters = 0
+        self.keep_raw_messages = keep_raw_messages
+        self._envelopes = {}
+        self._channel_envelopes = {u'rtm/publish': {}, u'rtm/write': {}}
+        if protocol == 'cbor':
+            self._encode_id = _cbor_uint
+            self._envelope_tail = b''
+            self._channel_tail = b''
         else:
-            self._dumps = json.dumps
+            self._encode_id = _ascii_int
+            self._envelope_tail = b'}'
+            self._channel_tail = b'}}'
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.gauges['in_flight_acks'] =\
+            lambda: len(self.ack_callbacks_by_id)
 
     def start(self):
         """
@@ -128,6 +219,15 @@ Description
             self.ws = None
             raise
 
+        if self.outbound_queue_size:
+            self._writer = Writer(
+                self.ws.write_frames,
+                self.outbound_queue_size,
+                self.backpressure,
+                self._on_writer_error,
+                self._on_payloads_dropped)
+            self.ws.writer = self._writer
+
         self._ws_thread = threading.Thread(target=self.ws.run)
         self._ws_thread.name = 'WebSocketReader'
         self._ws_thread.daemon = True
@@ -145,13 +245,22 @@ Description
         """
 
         self._time_to_stop_pinging = True
+        if self._ping_timer:
+            self._ping_timer.cancel()
+            self._ping_timer = None
+        if self._ack_timer:
+            self._ack_timer.cancel()
+            self._ack_timer = None
 
         if self.ws:
             try:
+                self.flush()
                 self.ws.close()
                 self.logger.debug('Waiting for WS thread')
                 self._ws_thread.join()
                 self.logger.debug('WS thread finished normally')
+                if self._writer:
+                    self._writer.join()
             except Exception as e:
                 # we could be trying to write a goodbye
                 # into already closed socket
@@ -172,15 +281,147 @@ Description
         if not self.ws:
             raise RuntimeError(
                 'Attempting to send data, but connection is not open yet')
-        self.logger.debug('Sending payload %s', payload)
+        if levels.debug:
+            self.logger.debug('Sending payload %s', payload)
+        self.metrics.bytes_out += len(payload)
+        self._write([payload])
+
+    def send_many(self, payloads):
+        """
+Description
+    Synchronously sends the specified messages to RTM, framing them into
+    a single buffer and writing it to the socket at once.
+    This is a lower-level method suitable for manually performing
+    PDU serialization.
+
+        """
+        if not self.ws:
+            raise RuntimeError(
+                'Attempting to send data, but connection is not open yet')
+        if levels.debug:
+            self.logger.debug('Sending %d payloads', len(payloads))
+        self.metrics.bytes_out += sum(len(p) for p in payloads)
+        self._write(payloads)
+
+    def flush(self):
+        """
+Description
+    Writes PDUs buffered because of `coalesce_writes` to the socket
+    right away.
+        """
+        with self._coalescing_lock:
+            payloads = self._take_coalesced_payloads()
+            if payloads and self.ws:
+                self._write_to_ws(payloads)
+
+    def _write(self, payloads):
+        if not self.coalesce_writes:
+            return self._write_to_ws(payloads)
+
+        flush_size, flush_interval = self.coalesce_writes
+        with self._coalescing_lock:
+            self._coalesced_payloads.extend(payloads)
+            self._coalesced_size += sum(len(p) for p in payloads)
+            if self._coalesced_size < flush_size:
+                if self._flush_timer is None:
+                    self._flush_timer = timers.call_later(
+                        flush_interval, self._flush_on_timer)
+                return
+            self._write_to_ws(self._take_coalesced_payloads())
+
+    def _take_coalesced_payloads(self):
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        payloads = self._coalesced_payloads
+        self._coalesced_payloads = []
+        self._coalesced_size = 0
+        return payloads
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # the connection is already closed by _write_to_ws
+            self.logger.debug('Failed to flush coalesced writes: %s', e)
+
+    def _write_to_ws(self, payloads):
+        if self._writer:
+            ws = self.ws
+            frames = [ws.frame(p, self._binary) for p in payloads]
+            # the reader thread must never wait for room in the buffer
+            # because it is the one reading acks and pongs
+            block = threading.current_thread() is not self._ws_thread
+            return self._writer.put_many(frames, block, payloads)
 
         try:
-            self.ws.send(payload)
+            if len(payloads) == 1:
+                self.ws.send(payloads[0], self._binary)
+            else:
+                self.ws.send_many(payloads, self._binary)
         except Exception as e:
             self.logger.exception(e)
             self.on_ws_closed()
             raise
 
+    def _on_writer_error(self, error):
+        self.logger.exception(error)
+        self.on_ws_closed()
+
+    def _on_payloads_dropped(self, payloads):
+        # requests that never reach RTM get an error reply, otherwise their
+        # callbacks would count against the ack watermark forever
+        if not self.ack_callbacks_by_id:
+            return
+        failed = False
+        for payload in payloads:
+            try:
+                pdu = self._loads(payload)
+                id_ = pdu.get(u'id')
+            except Exception:
+                continue
+            if id_ is None:
+                continue
+            callback = self.ack_callbacks_by_id.pop(id_, None)
+            self._sent_at_by_id.pop(id_, None)
+            if callback is None:
+                continue
+            failed = True
+            try:
+                self._deliver_reply(callback, {
+                    u'action': pdu[u'action'] + u'/error',
+                    u'id': id_,
+                    u'body': {
+                        u'error': u'dropped',
+                        u'reason': u'Outbound buffer is full'}})
+            except Exception as e:
+                self.logger.exception(e)
+        if failed and self._ack_waiters:
+            self._notify_ack_waiters()
+
+    def _wait_for_acks_below_watermark(self, name):
+        if len(self.ack_callbacks_by_id) < high_ack_count_watermark:
+            return
+        if threading.current_thread() is self._ws_thread:
+            # acks are read by this very thread
+            return
+
+        if levels.debug:
+            self.logger.debug('Throttling %s request', name)
+        with self._acks_below_watermark:
+            self._ack_waiters += 1
+            try:
+                while self.ws and\
+                        len(self.ack_callbacks_by_id) >=\
+                        high_ack_count_watermark:
+                    self._acks_below_watermark.wait(1)
+            finally:
+                self._ack_waiters -= 1
+
+    def _notify_ack_waiters(self):
+        with self._acks_below_watermark:
+            self._acks_below_watermark.notify_all()
+
     def action(self, name, body, callback=None):
         """
 Description
@@ -193,50 +434,96 @@ Description
 
     def action_with_preserialized_body(self, name, body, callback=None):
         if callback:
-            if len(self.ack_callbacks_by_id) >= high_ack_count_watermark:
-                self.logger.debug('Throttling %s request', name)
-                time.sleep(0.001)
-
-            action_id = next(self.action_id_iterator)
-            if self.protocol == 'cbor':
-                payload =\
-                    b''.join([
-                        b'\xa3',
-                        cbor2.dumps(u'action'),
-                        cbor2.dumps(name),
-                        cbor2.dumps(u'id'),
-                        cbor2.dumps(action_id),
-                        cbor2.dumps(u'body'),
-                        body])
-            else:
-                payload =\
-                    u''.join([
-                        u'{"action":"',
-                        name,
-                        u'","id":',
-                        str(action_id),
-                        u',"body":',
-                        body,
-                        u'}']).encode('utf8')
-            self.ack_callbacks_by_id[action_id] = callback
+            self._wait_for_acks_below_watermark(name)
+        self.send(self._make_payload(name, body, callback))
+
+    def _make_payload(self, name, body, callback):
+        # the envelope around the body only depends on the action name,
+        # so the only thing encoded for every PDU is the id
+        envelope = self._envelopes.get(name)
+        if envelope is None:
+            envelope = self._envelopes[name] = self._make_envelope(name, b'')
+        self.metrics.record_pdu_out(name)
+        if callback:
+            return b''.join([
+                envelope[1],
+                self._next_action_id(name, callback),
+                envelope[2],
+                _utf8(body),
+                self._envelope_tail])
+        return b''.join([envelope[0], _utf8(body), self._envelope_tail])
+
+    def _make_channel_payload(self, name, channel, message, callback):
+        # same as _make_payload for the {"channel":..,"message":..} bodies
+        # of publishes and writes, with the envelope cached per channel
+        envelopes = self._channel_envelopes[name]
+        envelope = envelopes.get(channel)
+        if envelope is None:
+            if len(envelopes) >= max_cached_channel_envelopes:
+                envelopes.clear()
+            envelope = envelopes[channel] =\
+                self._make_channel_envelope(name, channel)
+        return self._make_message_payload(name, envelope, message, callback)
+
+    def _make_message_payload(self, name, envelope, message, callback):
+        metrics = self.metrics
+        metrics.record_pdu_out(name)
+        metrics.messages_out += 1
+        if callback:
+            return b''.join([
+                envelope[1],
+                self._next_action_id(name, callback),
+                envelope[2],
+                _utf8(message),
+                self._channel_tail])
+        return b''.join([envelope[0], _utf8(message), self._channel_tail])
+
+    def _next_action_id(self, name, callback):
+        action_id = next(self.action_id_iterator)
+        self.ack_callbacks_by_id[action_id] = callback
+        self._sent_at_by_id[action_id] = (time.time(), name)
+        return self._encode_id(action_id)
+
+    def _make_envelope(self, name, body_head):
+        # (head without id, head up to the id, from the id to the body)
+        if self.protocol == 'cbor':
+            action = cbor2.dumps(u'action') + cbor2.dumps(name)
+            body = cbor2.dumps(u'body') + body_head
+            return (
+                b'\xa2' + action + body,
+                b'\xa3' + action + cbor2.dumps(u'id'),
+                body)
+        action = b'{"action":' + _utf8(json.dumps(name))
+        return (
+            action + b',"body":' + body_head,
+            action + b',"id":',
+            b',"body":' + body_head)
+
+    def _make_channel_envelope(self, name, channel):
+        if self.protocol == 'cbor':
+            head = b''.join([
+                b'\xa2',
+                cbor2.dumps(u'channel'),
+                cbor2.dumps(channel),
+                cbor2.dumps(u'message')])
         else:
-            if self.protocol == 'cbor':
-                payload =\
-                    b''.join([
-                        b'\xa2',
-                        cbor2.dumps(u'action'),
-                        cbor2.dumps(name),
-                        cbor2.dumps(u'body'),
-                        body])
-            else:
-                payload =\
-                    u''.join([
-                        u'{"action":"',
-                        name,
-                        u'","body":',
-                        body,
-                        u'}']).encode('utf8')
-        self.send(payload)
+            head = b''.join([
+                b'{"channel":',
+                _utf8(json.dumps(channel)),
+                b',"message":'])
+        return self._make_envelope(name, head)
+
+    def publisher(self, channel):
+        """
+Description
+    Returns a `Publisher` for the specified channel. The publisher keeps the
+    PDU envelope for the channel encoded, so each publish only encodes the
+    message and the request id. Use it for channels you publish to often.
+
+Parameters
+    * channel {string} [required] - Name of the channel to publish to.
+        """
+        return Publisher(self, channel)
 
     def publish(self, channel, message, callback=None):
         """
@@ -266,24 +553,44 @@ Parameters
       returned by RTM as a response to the publish request.
         """
 
-        self.action(
-            u'rtm/publish',
-            {u'channel': channel, u'message': message},
-            callback)
+        self.publish_preserialized_message(
+            channel, self._dumps(message), callback)
+
+    def publish_many(self, channel, messages, callback=None):
+        """
+Description
+    Publishes several messages to the specified channel. All the publish
+    PDUs are framed into a single buffer and written to the socket at once,
+    which is much cheaper than calling `publish` for each message.
+
+Parameters
+    * channel {string} [required] - Name of the channel to which you want to
+      publish.
+    * messages {list} [required] - JSON values to publish. Each of them must
+      be serializable using `json.dumps` from the Python standard `JSON`
+      module.
+    * callback {function} [optional] - Callback function to execute on each
+      PDU returned by RTM as a response to the publish requests.
+        """
+
+        self.publish_many_preserialized_messages(
+            channel, [self._dumps(m) for m in messages], callback)
 
     def publish_preserialized_message(self, channel, message, callback=None):
-        if self.protocol == 'json':
-            body = u'{{"channel":"{0}","message": {1}}}'.format(
-                channel, message)
-        elif self.protocol == 'cbor':
-            body =\
-                b''.join([
-                    b'\xa2',
-                    cbor2.dumps(u'channel'),
-                    cbor2.dumps(channel),
-                    cbor2.dumps(u'message'),
-                    message])
-        self.action_with_preserialized_body(u'rtm/publish', body, callback)
+        if callback:
+            self._wait_for_acks_below_watermark(u'rtm/publish')
+        self.send(self._make_channel_payload(
+            u'rtm/publish', channel, message, callback))
+
+    def publish_many_preserialized_messages(
+            self, channel, messages, callback=None):
+        if callback:
+            self._wait_for_acks_below_watermark(u'rtm/publish')
+        payloads = [
+            self._make_channel_payload(u'rtm/publish', channel, m, callback)
+            for m in messages]
+        if payloads:
+            self.send_many(payloads)
 
     def read(self, channel, args=None, callback=None):
         """
@@ -379,17 +686,10 @@ Parameters
             callback)
 
     def write_preserialized_value(self, channel, value, callback=None):
-        if self.protocol == 'json':
-            body = u'{{"channel":"{0}","message": {1}}}'.format(channel, value)
-        elif self.protocol == 'cbor':
-            body =\
-                b''.join([
-                    b'\xa2',
-                    cbor2.dumps(u'channel'),
-                    cbor2.dumps(channel),
-                    cbor2.dumps(u'message'),
-                    value])
-        self.action_with_preserialized_body(u'rtm/write', body, callback)
+        if callback:
+            self._wait_for_acks_below_watermark(u'rtm/write')
+        self.send(self._make_channel_payload(
+            u'rtm/write', channel, value, callback))
 
     def delete(self, key, callback=None):
         """
@@ -641,59 +941,122 @@ Parameters
 
     def on_ws_opened(self):
         self.logger.debug('on_ws_opened')
-        self._ping_thread = threading.Thread(
-            target=self._ping_until_the_end,
-            name='Pinger')
-        self._ping_thread.daemon = True
-        self._ping_thread.start()
-
-    def _ping_until_the_end(self):
-        self.logger.debug('Starting ping thread')
+        self._ping_timer = timers.call_later(self.ping_interval, self._ping)
+        if self.ack_timeout:
+            self._ack_timer = timers.call_later(
+                self.ack_timeout / 2.0, self._expire_acks)
+
+    def _expire_acks(self):
+        if self._time_to_stop_pinging or self.ws is None:
+            return
+        deadline = time.time() - self.ack_timeout
+        expired = [
+            (id_, name) for id_, (sent_at, name)
+            in list(self._sent_at_by_id.items())
+            if sent_at < deadline and name in ack_timeout_actions]
+        for id_, name in expired:
+            callback = self.ack_callbacks_by_id.pop(id_, None)
+            if callback is None:
+                # the reply has just come
+                continue
+            self._sent_at_by_id.pop(id_, None)
+            self.metrics.ack_timeouts += 1
+            self._deliver_expired(callback, {
+                u'action': name + u'/error',
+                u'id': id_,
+                u'body': {
+                    u'error': u'ack_timeout',
+                    u'reason': u'No reply in {0} seconds'.format(
+                        self.ack_timeout)}})
+        if expired and self._ack_waiters:
+            self._notify_ack_waiters()
+        self._ack_timer = timers.call_later(
+            self.ack_timeout / 2.0, self._expire_acks)
+
+    def _deliver_expired(self, callback, reply):
+        # Client only queues the reply for its own loop thread, callbacks
+        # of a bare Connection run on the shared timer thread
         try:
-            while not self._time_to_stop_pinging:
-                time.sleep(min(ping_interval_in_seconds, 1))
-                now = time.time()
-                if self._last_ping_time and\
-                        now - self._last_ping_time < ping_interval_in_seconds:
-                    continue
-                if self.ws is None:
-                    break
-                self.logger.debug('send ping')
-                self.ws.send_ping()
-                if self._last_ping_time:
-                    if not self._last_ponged_time or\
-                            self._last_ping_time > self._last_ponged_time:
-                        self.logger.error(
-                            'Server has not responded to WS ping')
-                        try:
-                            ws = self.ws
-                            self.on_ws_closed()
-                            ws.delegate = None
-                            ws.close()
-                        except Exception as e:
-                            self.logger.exception(e)
-                self._last_ping_time = time.time()
-                self.logger.debug('pinging')
+            self._deliver_reply(callback, reply)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def _ping(self):
+        ws = self.ws
+        if self._time_to_stop_pinging or ws is None:
+            return
+        self._ping_payload = str(next(self._ping_sequence))
+        self._last_ping_time = time.time()
+        if levels.debug:
+            self.logger.debug('send ping')
+        # a blocking write would hold up the timers of every connection,
+        # a writer thread queues the ping, otherwise a socket with no room
+        # for it skips it and fails the pong check like a lost ping
+        try:
+            if not ws.send_ping(self._ping_payload, block=False):
+                self.logger.debug('No room in the socket for a ping')
+        except Exception as e:
+            self.logger.exception(e)
+            return
+        timers.call_later(
+            self.ping_timeout, self._check_pong, self._last_ping_time)
+        self._ping_timer = timers.call_later(self.ping_interval, self._ping)
+
+    def _check_pong(self, ping_time):
+        if self._time_to_stop_pinging or self.ws is None:
+            return
+        ponged = self._last_ponged_time
+        if ponged is not None and ponged >= ping_time:
+            return
+        self.logger.error(
+            'Server has not responded to WS ping in %s seconds',
+            self.ping_timeout)
+        # a closing frame could block, the reader thread closes the
+        # websocket once the socket is shut down
+        try:
+            self.ws.abort()
         except Exception as e:
             self.logger.exception(e)
-        self.logger.debug('Finishing ping thread')
 
     def on_ws_closed(self):
         self._time_to_stop_pinging = True
+        if self._ping_timer:
+            self._ping_timer.cancel()
+            self._ping_timer = None
+        if self._ack_timer:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        with self._coalescing_lock:
+            self._take_coalesced_payloads()
         if self.delegate:
             self.delegate.on_connection_closed()
         if self.ws:
             self.ack_callbacks_by_id.clear()
+            self._sent_at_by_id.clear()
             self.ws.delegate = None
             try:
                 self.ws.close()
             except Exception as e:
                 self.logger.exception(e)
+            if self._writer:
+                # let the writer send what is queued, the closing frame
+                # included, before the socket goes away
+                self._writer.stop()
+                self._writer.join(1)
             self.ws = None
+            if self._ack_waiters:
+                self._notify_ack_waiters()
 
     def on_ws_ponged(self):
         self._last_ponged_time = time.time()
 
+    def on_pong_received(self, payload):
+        ping_payload = self._ping_payload
+        if ping_payload is not None and\
+                payload == ping_payload.encode('ascii'):
+            self._ping_payload = None
+            self.metrics.record_ping_rtt(time.time() - self._last_ping_time)
+
     def on_auth_reply(self, reply):
         self.logger.debug('on_auth_reply: %s', reply)
         with self._auth_lock:
@@ -736,6 +1099,7 @@ Parameters
             return self.on_internal_error(message)
 
         body = incoming_json.get('body')
+        self.metrics.record_pdu_in(action)
 
         maybe_bodyless_actions = [u'rtm/delete/ok', u'rtm/publish/ok']
         if body is None and action not in maybe_bodyless_actions:
@@ -744,6 +1108,7 @@ Parameters
             return self.on_internal_error(message)
 
         if action == u'rtm/subscription/data':
+            self.metrics.messages_in += len(body[u'messages'])
             return self.on_subscription_data(body)
         elif action == u'rtm/subscription/error':
             return self.on_subscription_error(body)
@@ -771,27 +1136,46 @@ Parameters
 
             return self.on_auth_reply(convert(incoming_json))
 
-        callback = self.ack_callbacks_by_id.get(id_)
+        is_final_reply = not action.endswith('/data')
+        if is_final_reply:
+            # taken out before the callback is called so that it can't
+            # also be called by _expire_acks
+            callback = self.ack_callbacks_by_id.pop(id_, None)
+        else:
+            callback = self.ack_callbacks_by_id.get(id_)
         if callback:
+            if is_final_reply:
+                sent = self._sent_at_by_id.pop(id_, None)
+                if sent is not None:
+                    self.metrics.record_ack(action, time.time() - sent[0])
 
-            try:
-                delegate_on_solicited =\
-                    getattr(self.delegate, 'on_solicited_pdu')
-            except AttributeError:
-                delegate_on_solicited = None
+            self._deliver_reply(callback, incoming_json)
 
-            if delegate_on_solicited:
-                delegate_on_solicited(callback, incoming_json)
-            else:
-                callback(incoming_json)
+            if is_final_reply and self._ack_waiters:
+                self._notify_ack_waiters()
+
+    def _deliver_reply(self, callback, reply):
+        try:
+            delegate_on_solicited =\
+                getattr(self.delegate, 'on_solicited_pdu')
+        except AttributeError:
+            delegate_on_solicited = None
 
-            if not incoming_json.get('action').endswith('/data'):
-                del self.ack_callbacks_by_id[id_]
+        if delegate_on_solicited:
+            delegate_on_solicited(callback, reply)
+        else:
+            callback(reply)
 
     def on_incoming_binary_frame(self, incoming_binary):
+        self.metrics.bytes_in += len(incoming_binary)
+        if self.keep_raw_messages:
+            pdu = split_cbor_pdu(incoming_binary)
+            if pdu is not None:
+                return self.on_incoming_json(pdu)
         try:
-            self.logger.debug(incoming_binary)
-            incoming_json = cbor2.loads(incoming_binary)
+            if levels.debug:
+                self.logger.debug('incoming binary: %r', incoming_binary)
+            incoming_json = self._loads(incoming_binary)
         except ValueError as e:
             self.logger.exception(e)
             message = '"{0}" is not valid CBOR'.format(incoming_binary)
@@ -799,12 +1183,19 @@ Parameters
         self.on_incoming_json(incoming_json)
 
     def on_incoming_text_frame(self, incoming_text):
-        self.logger.debug('incoming text: %s', incoming_text)
+        if levels.debug:
+            self.logger.debug('incoming text: %s', incoming_text)
 
         self.on_ws_ponged()
+        self.metrics.bytes_in += len(incoming_text)
+
+        if self.keep_raw_messages:
+            pdu = split_json_pdu(incoming_text)
+            if pdu is not None:
+                return self.on_incoming_json(pdu)
 
         try:
-            incoming_json = json.loads(incoming_text)
+            incoming_json = self._loads(incoming_text)
         except ValueError as e:
             self.logger.exception(e)
             message = '"{0}" is not valid JSON'.format(incoming_text)
@@ -813,6 +1204,64 @@ Parameters
         self.on_incoming_json(incoming_json)
 
 
+class Publisher(object):
+    """
+Publisher handle for a single channel, created with `Connection.publisher`.
+It holds the encoded PDU envelope of the channel, so a publish only appends
+the message and, when there is a callback, the request id.
+    """
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+        self._envelope = connection._make_channel_envelope(
+            u'rtm/publish', channel)
+
+    def publish(self, message, callback=None):
+        """
+Description
+    Publishes a message to the channel of the publisher, see
+    `Connection.publish`.
+        """
+        self.publish_preserialized_message(
+            self.connection._dumps(message), callback)
+
+    def publish_preserialized_message(self, message, callback=None):
+        """
+Description
+    Publishes a message that is already encoded in the protocol of the
+    connection.
+        """
+        connection = self.connection
+        if callback:
+            connection._wait_for_acks_below_watermark(u'rtm/publish')
+        connection.send(connection._make_message_payload(
+            u'rtm/publish',
+            self._envelope, message, callback))
+
+    def publish_many(self, messages, callback=None):
+        """
+Description
+    Publishes several messages to the channel of the publisher with
+    a single socket write, see `Connection.publish_many`.
+        """
+        dumps = self.connection._dumps
+        self.publish_many_preserialized_messages(
+            [dumps(m) for m in messages], callback)
+
+    def publish_many_preserialized_messages(self, messages, callback=None):
+        connection = self.connection
+        if callback:
+            connection._wait_for_acks_below_watermark(u'rtm/publish')
+        envelope = self._envelope
+        payloads = [
+            connection._make_message_payload(
+                u'rtm/publish', envelope, m, callback)
+            for m in messages]
+        if payloads:
+            connection.send_many(payloads)
+
+
 def enable_wsaccel():
     """
     Use optimized Cython versions of CPU-intensive routines
@@ -824,11 +1273,36 @@ def enable_wsaccel():
     import miniws4py.framing
     miniws4py.streaming.Utf8Validator = wsaccel.utf8validator.Utf8Validator
 
-    def fast_mask(data):
-        masker = wsaccel.xormask.XorMaskerSimple(b'\xFF\xFF\xFF\xFF')
-        return masker.process(data)
+    def fast_mask_into(buf, offset, data, key):
+        masker = wsaccel.xormask.XorMaskerSimple(bytes(key))
+        buf[offset:offset + len(data)] = masker.process(bytes(data))
+
+    miniws4py.framing.mask_into = fast_mask_into
+
+
+def _utf8(text):
+    # preserialized bodies may come from encoders that return bytes
+    # (orjson or json.dumps on Python 2) or be slices of a memory mapped
+    # recording and need no encoding
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        return text
+    return text.encode('utf8')
+
+
+def _ascii_int(n):
+    return str(n).encode('ascii')
+
 
-    miniws4py.framing.mask = fast_mask
+def _cbor_uint(n):
+    if n < 24:
+        return struct.pack('B', n)
+    elif n < 0x100:
+        return struct.pack('BB', 0x18, n)
+    elif n < 0x10000:
+        return struct.pack('>BH', 0x19, n)
+    elif n < 0x100000000:
+        return struct.pack('>BI', 0x1a, n)
+    return struct.pack('>BQ', 0x1b, n)
 
 
 def validate_endpoint(endpoint, appkey, protocol):
@@ -11,8 +11,11 @@ import satori.rtm.internal_client_action as a
 import satori.rtm.auth as auth
 from satori.rtm.generated.statemap import StateUndefinedException
 from satori.rtm.generated.client_sm import Client_sm
-from satori.rtm.internal_logger import logger
-from satori.rtm.internal_subscription import Subscription
+from satori.rtm.internal_timers import timers
+from satori.rtm.internal_logger import logger, levels, refresh_levels
+from satori.rtm.internal_pdu_splitter import Messages
+from satori.rtm.metrics import Metrics
+from satori.rtm.internal_subscription import Subscription, wants_raw_data
 
 max_offline_queue_length = 1000
 
@@ -24,7 +27,10 @@ class InternalClient(object):
             fail_count_threshold=float('inf'),
             reconnect_interval=1, max_reconnect_interval=300,
             observer=None, restore_auth_on_reconnect=True,
-            https_proxy=None, protocol='cbor'):
+            https_proxy=None, protocol='cbor', coalesce_writes=None,
+            keep_raw_messages=False, codec=None,
+            merge_subscription_data=False, metrics=None,
+            ping_interval=None, ping_timeout=None, ack_timeout=None):
 
         self._endpoint = endpoint
         self._appkey = appkey
@@ -47,6 +53,19 @@ class InternalClient(object):
         self._successful_auth_delegates = []
         self._offline_queue = deque([], max_offline_queue_length)
         self._protocol = protocol
+        self._coalesce_writes = coalesce_writes
+        self._keep_raw_messages = keep_raw_messages
+        self._codec = codec
+        self.merge_subscription_data = merge_subscription_data
+        self._ping_interval = ping_interval
+        self._ping_timeout = ping_timeout
+        self._ack_timeout = ack_timeout
+        self._handlers = self._make_handlers()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.gauges['queue_depth'] = self._queue.qsize
+        self.metrics.gauges['offline_queue_depth'] =\
+            lambda: len(self._offline_queue)
+        refresh_levels()
 
     def process_one_message(self, timeout=1):
         '''Must be called from a single thread
@@ -58,88 +77,165 @@ class InternalClient(object):
             logger.debug('queue is empty')
             return False
 
+        return self.process_message(m)
+
+    def process_many(self, timeout=1, limit=1024):
+        '''Must be called from a single thread
+           handles every queued event, up to limit, at once
+           returns True if one of them was Dispose()'''
+
+        try:
+            events = self._queue.get_many(limit, block=True, timeout=timeout)
+        except queue.Empty:
+            logger.debug('queue is empty')
+            return False
+
+        if levels.debug:
+            logger.debug('Handling %d events', len(events))
+        handlers = self._handlers
+        channel_data = a.ChannelData
+        merge = self.merge_subscription_data
+        i, count = 0, len(events)
+        while i < count:
+            m = events[i]
+            i += 1
+            t = type(m)
+            # an exception must not cost the rest of the batch
+            try:
+                if t is channel_data:
+                    if merge:
+                        # the subscription can't change in the middle of
+                        # a run of data events, only actions change it
+                        channel = m.data[u'subscription_id']
+                        run = [m.data]
+                        while i < count and\
+                                type(events[i]) is channel_data and\
+                                events[i].data[u'subscription_id'] ==\
+                                channel:
+                            run.append(events[i].data)
+                            i += 1
+                        if len(run) > 1:
+                            m = channel_data(_merge_subscription_data(run))
+                    self._handle_channel_data(m)
+                    continue
+                handler = handlers.get(t)
+                if handler is None:
+                    logger.error('Unexpected event %s: %s', m, t)
+                elif handler(m):
+                    return True
+            except Exception as e:
+                logger.error('Exception while handling %s', t.__name__)
+                logger.exception(e)
+        return False
+
+    def process_message(self, m):
+        '''Handles a single event, returns True if it was Dispose()'''
+
         t = type(m)
-        logger.info('Begin handling %s', t.__name__)
-
-        if t == a.ChannelData:
-            data = m.data
-            channel = data['subscription_id']
-            subscription = self.subscriptions.get(channel)
-            if subscription:
-                try:
-                    subscription.on_subscription_data(data)
-                except Exception as e:
-                    logger.error("Exception in on_subscription_data")
-                    logger.exception(e)
-                    self._queue.put(a.Stop())
-            else:
-                logger.error('Subscription for %s not found', data)
-        elif t == a.Start:
-            self._sm.Start()
-        elif t == a.Stop:
-            self._sm.Stop()
-        elif t == a.Dispose:
-            self._sm.Dispose()
-            self._queue.task_done()
+        if levels.info:
+            logger.info('Begin handling %s', t.__name__)
+
+        handler = self._handlers.get(t)
+        if handler is None:
+            logger.error('Unexpected event %s: %s', m, t)
+        elif handler(m):
             return True
 
-        elif t == a.Publish:
-            if self.is_connected():
-                try:
-                    self.connection.publish_preserialized_message(
-                        m.channel, m.message, m.callback)
-                except Exception as e:
-                    logger.exception(e)
-            else:
-                self._offline_queue.append(m)
-        elif t == a.Subscribe:
-            self._subscribe(
+        if levels.info:
+            logger.info('Finish handling %s', t.__name__)
+        return False
+
+    def _make_handlers(self):
+        sm = self._sm
+        return {
+            a.ChannelData: self._handle_channel_data,
+            a.Start: lambda m: sm.Start(),
+            a.Stop: lambda m: sm.Stop(),
+            a.Dispose: self._handle_dispose,
+            a.Publish: self._handle_publish,
+            a.PublishMany: self._handle_publish_many,
+            a.Subscribe: lambda m: self._subscribe(
                 m.channel_or_subscription_id,
                 m.mode,
                 m.observer,
-                args=m.args)
-        elif t == a.Unsubscribe:
-            self._unsubscribe(m.channel_or_subscription_id)
-        elif t == a.Read:
-            self.connection.read(m.key, m.args, m.callback)
-        elif t == a.Write:
-            self.connection.write_preserialized_value(
-                m.key, m.value, m.callback)
-        elif t == a.Delete:
-            self.connection.delete(m.key, m.callback)
-        elif t == a.Authenticate:
-            if self.is_connected():
-                self._authenticate(m.auth_delegate, m.callback)
-            else:
-                self._offline_queue.append(m)
-        elif t == a.SolicitedPDU:
+                args=m.args,
+                batch=m.batch),
+            a.Unsubscribe: lambda m: self._unsubscribe(
+                m.channel_or_subscription_id),
+            a.FlushBatch: self._handle_flush_batch,
+            a.Read: lambda m: self.connection.read(
+                m.key, m.args, m.callback),
+            a.Write: lambda m: self.connection.write_preserialized_value(
+                m.key, m.value, m.callback),
+            a.Delete: lambda m: self.connection.delete(m.key, m.callback),
+            a.Authenticate: self._handle_authenticate,
+            a.SolicitedPDU: self._handle_solicited_pdu,
+            a.Tick: lambda m: sm.Tick(),
+            a.ConnectingComplete: lambda m: sm.ConnectingComplete(),
+            a.ConnectingFailed: lambda m: sm.ConnectingFailed(),
+            a.ConnectionClosed: lambda m: sm.ConnectionClosed(),
+            a.ChannelError: lambda m: sm.ChannelError(m.channel, m.payload),
+            a.InternalError: lambda m: sm.InternalError(m.payload),
+            a.FastForward: lambda m: self._perform_state_callback(
+                'on_fast_forward', m.channel),
+        }
+
+    def _handle_channel_data(self, m):
+        data = m.data
+        channel = data['subscription_id']
+        subscription = self.subscriptions.get(channel)
+        if subscription:
             try:
-                m.callback(m.payload)
+                subscription.on_subscription_data(data)
             except Exception as e:
-                logger.error("Exception in a solicited PDU callback")
+                logger.error("Exception in on_subscription_data")
                 logger.exception(e)
                 self._queue.put(a.Stop())
-        elif t == a.Tick:
-            self._sm.Tick()
-
-        elif t == a.ConnectingComplete:
-            self._sm.ConnectingComplete()
-        elif t == a.ConnectingFailed:
-            self._sm.ConnectingFailed()
-        elif t == a.ConnectionClosed:
-            self._sm.ConnectionClosed()
-        elif t == a.ChannelError:
-            self._sm.ChannelError(m.channel, m.payload)
-        elif t == a.InternalError:
-            self._sm.InternalError(m.payload)
-        elif t == a.FastForward:
-            self._perform_state_callback('on_fast_forward', m.channel)
         else:
-            logger.error('Unexpected event %s: %s', m, t)
+            logger.error('Subscription for %s not found', data)
 
-        self._queue.task_done()
-        logger.info('Finish handling %s', t.__name__)
-        return False
+    def _handle_flush_batch(self, m):
+        subscription = self.subscriptions.get(m.channel_or_subscription_id)
+        if subscription:
+            subscription.flush_batch()
+
+    def _handle_dispose(self, m):
+        self._sm.Dispose()
+        return True
+
+    def _handle_publish(self, m):
+        if self.is_connected():
+            try:
+                self.connection.publish_preserialized_message(
+                    m.channel, m.message, m.callback)
+            except Exception as e:
+                logger.exception(e)
+        else:
+            self._offline_queue.append(m)
+
+    def _handle_publish_many(self, m):
+        if self.is_connected():
+            try:
+                self.connection.publish_many_preserialized_messages(
+                    m.channel, m.messages, m.callback)
+            except Exception as e:
+                logger.exception(e)
+        else:
+            self._offline_queue.append(m)
+
+    def _handle_authenticate(self, m):
+        if self.is_connected():
+            self._authenticate(m.auth_delegate, m.callback)
+        else:
+            self._offline_queue.append(m)
+
+    def _handle_solicited_pdu(self, m):
+        try:
+            m.callback(m.payload)
+        except Exception as e:
+            logger.error("Exception in a solicited PDU callback")
+            logger.exception(e)
+            self._queue.put(a.Stop())
 
     # called back by connection from some thread
     def on_fast_forward(self, channel, payload):
@@ -217,15 +313,23 @@ class InternalClient(object):
         self.connection = Connection(
             self._endpoint, self._appkey,
             self,
-            self.https_proxy, self._protocol)
+            self.https_proxy, self._protocol, self._coalesce_writes,
+            keep_raw_messages=self._keep_raw_messages, codec=self._codec,
+            metrics=self.metrics, ping_interval=self._ping_interval,
+            ping_timeout=self._ping_timeout, ack_timeout=self._ack_timeout)
         try:
             self.connection.start()
+            self._record_connect(time.time() - self._time_of_last_reconnect)
             self._queue.put(a.ConnectingComplete())
         except Exception as e:
             logger.exception(e)
             self.last_connecting_error = e
             self._queue.put(a.ConnectingFailed())
 
+    def _record_connect(self, duration):
+        self.metrics.record_connect(
+            duration, reconnect=self.metrics.connects > 0)
+
     def _restore_auth_and_return_true_if_failed(self):
         logger.info('_restore_auth_and_return_true_if_failed')
 
@@ -320,15 +424,23 @@ class InternalClient(object):
 
     def _subscribe(
             self, channel, mode, subscription_observer=None,
-            args=None):
+            args=None, batch=None):
         logger.info('_subscribe')
 
+        if wants_raw_data(subscription_observer)\
+                and not self._keep_raw_messages:
+            logger.info('Keeping raw messages from now on')
+            self._keep_raw_messages = True
+            if self.connection:
+                self.connection.keep_raw_messages = True
+
         old_subscription = self.subscriptions.get(channel)
         if old_subscription:
             logger.debug('Old subscription found')
             # TODO: distinguish errors and legitimate resubscriptions
             #       and call an error callback on former
-            old_subscription.subscribe(args, observer=subscription_observer)
+            old_subscription.subscribe(
+                args, observer=subscription_observer, batch=batch)
             return
 
         def subscribe_callback(ack):
@@ -379,11 +491,16 @@ class InternalClient(object):
             except Exception as e:
                 logger.exception(e)
 
+        def request_flush():
+            self._queue.put(a.FlushBatch(channel))
+
         subscription = Subscription(
             mode,
             send_subscribe_request,
             send_unsubscribe_request,
-            args)
+            args,
+            batch=batch,
+            request_flush=request_flush)
         subscription.observer = subscription_observer
         if self.is_connected():
             subscription.connect()
@@ -431,10 +548,23 @@ class InternalClient(object):
             self._reconnect_timer = None
             self._queue.put(a.Tick())
 
-        self._reconnect_timer = threading.Timer(delay, reconnect)
-        self._reconnect_timer.start()
+        self._reconnect_timer = timers.call_later(delay, reconnect)
 
     def _cancel_reconnect(self):
         if self._reconnect_timer:
             self._reconnect_timer.cancel()
-            self._reconnect_timer = None
\ No newline at end of file
+            self._reconnect_timer = None
+
+
+def _merge_subscription_data(run):
+    '''Joins the bodies of consecutive data PDUs of one subscription into
+       one body: all the messages in order and the position of the last'''
+    merged = dict(run[-1])
+    keep_raw = all(hasattr(d[u'messages'], 'raw') for d in run)
+    messages = Messages() if keep_raw else []
+    for d in run:
+        messages.extend(d[u'messages'])
+        if keep_raw:
+            messages.raw.extend(d[u'messages'].raw)
+    merged[u'messages'] = messages
+    return merged
@@ -6,10 +6,12 @@ from collections import namedtuple as t
 
 # PubSub family
 Publish = t('Publish', ['channel', 'message', 'callback'])
+PublishMany = t('PublishMany', ['channel', 'messages', 'callback'])
 Subscribe = t(
     'Subscribe',
-    ['channel_or_subscription_id', 'mode', 'observer', 'args'])
+    ['channel_or_subscription_id', 'mode', 'observer', 'args', 'batch'])
 Unsubscribe = t('Unsubscribe', ['channel_or_subscription_id'])
+FlushBatch = t('FlushBatch', ['channel_or_subscription_id'])
 
 # KV family
 Read = t('Read', ['key', 'args', 'callback'])
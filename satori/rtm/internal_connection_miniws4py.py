@@ -1,4 +1,8 @@
 
+import select
+import socket
+import sys
+
 from miniws4py.client import WebSocketBaseClient
 
 import satori.rtm.internal_logger
@@ -10,17 +14,58 @@ class RtmWsClient(WebSocketBaseClient):
         WebSocketBaseClient.__init__(self, *args, **kwargs)
         self.logger = satori.rtm.internal_logger.logger
         self.delegate = None
+        self.writer = None
+        # Text frames are decoded in received_message, which on Python 3
+        # is as strict as validating them in the stream. The Python 2
+        # decoder accepts encoded surrogates, so there the stream keeps
+        # validating them.
+        self.stream.validate_utf8 = sys.version_info[0] < 3
+
+    def _write(self, b):
+        # When there is a writer thread, every frame including pongs and
+        # the closing frame must go through it to keep frames in order.
+        # Control frames never wait for room in the outbound buffer.
+        writer = self.writer
+        if writer is None:
+            return WebSocketBaseClient._write(self, b)
+        if self.terminated or self.sock is None:
+            raise RuntimeError("Cannot send on a terminated websocket")
+        writer.put_many([b], block=False, control=True)
 
-    def send_ping(self):
-        self.ping('py')
+    def send_ping(self, payload='py', block=True):
+        '''With block=False and no writer thread the ping is sent only if
+           the socket can take it right away. Returns whether it was
+           sent.'''
+        if not block and self.writer is None:
+            sock = self.sock
+            if self.terminated or sock is None:
+                raise RuntimeError("Cannot send on a terminated websocket")
+            if not select.select([], [sock], [], 0)[1]:
+                return False
+        self.ping(payload)
+        return True
+
+    def abort(self):
+        '''Shuts the socket down without the closing handshake. The reader
+           thread then sees the end of the stream and closes the websocket.
+           Never blocks.'''
+        self.client_terminated = True
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception as e:
+                self.logger.info(e)
 
     def opened(self):
         if self.delegate:
             self.delegate.on_ws_opened()
 
-    def ponged(self, _pong):
-        if self.delegate:
-            self.delegate.on_ws_ponged()
+    def ponged(self, pong):
+        delegate = self.delegate
+        if delegate:
+            delegate.on_ws_ponged()
+            delegate.on_pong_received(bytes(pong.data))
 
     def close(self, code=1000, reason=''):
         if self.terminated:
@@ -41,4 +86,7 @@ class RtmWsClient(WebSocketBaseClient):
                 self.delegate.on_incoming_binary_frame(d)
             else:
                 assert message.is_text
-                self.delegate.on_incoming_text_frame(d.decode('utf8'))
+                text = message.text
+                if text is None:
+                    text = d.decode('utf8')
+                self.delegate.on_incoming_text_frame(text)
@@ -5,6 +5,29 @@ import logging
 logger = logging.getLogger('satori.rtm')
 
 
+class _Levels(object):
+    '''Whether debug and info records of the logger would go anywhere.
+       Hot paths check these flags instead of calling logger.debug for
+       every PDU, so nothing is formatted or even called when the level
+       is off. The flags are refreshed when a Connection or a Client is
+       created, call refresh_levels after changing the logging
+       configuration of a running client.'''
+
+    __slots__ = ('debug', 'info')
+
+    def __init__(self):
+        self.debug = True
+        self.info = True
+
+
+levels = _Levels()
+
+
+def refresh_levels():
+    levels.debug = logger.isEnabledFor(logging.DEBUG)
+    levels.info = logger.isEnabledFor(logging.INFO)
+
+
 def configure_for_debugging():
     ws4py_formatter = logging.Formatter(
         'miniws4py:%(asctime)s:%(levelname)s:'
@@ -24,7 +47,8 @@ def configure_for_debugging():
 
     logger.setLevel(logging.DEBUG)
     logger.addHandler(satori_handler)
+    refresh_levels()
 
 
 if 'DEBUG_SATORI_SDK' in os.environ:
-    configure_for_debugging()
\ No newline at end of file
+    configure_for_debugging()
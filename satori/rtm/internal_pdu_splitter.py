@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+'''Splits incoming subscription data PDUs so that every message they carry
+   is available both decoded and as it was encoded by RTM. Relays can then
+   forward messages without encoding them again. Every other PDU is left
+   to the regular decoder.
+
+   In pure Python the C decoders of json and cbor2 are by far the fastest
+   way to find where a value ends, so messages are decoded on the way by
+   those rather than by the codec of the connection.'''
+
+from __future__ import print_function
+import io
+import json
+import re
+import struct
+
+import cbor2
+import six
+
+subscription_data_action = u'rtm/subscription/data'
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_scanstring = json.decoder.scanstring
+# stdlib decoder, raw_decode tells where a value ends
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+class Messages(list):
+    '''Decoded messages of a subscription data PDU. `raw` holds the same
+       messages exactly as RTM encoded them: text for JSON, bytes for CBOR.
+       Those can be passed to `publish_preserialized_message` as is.'''
+
+    def __init__(self):
+        list.__init__(self)
+        self.raw = []
+
+
+def _skip_whitespace(text, i):
+    return _whitespace.match(text, i).end()
+
+
+def _read_json_key(text, i):
+    '''Returns the key of the object member at `i` and where its value
+       starts, or None and the index past the object if it ends at `i`'''
+    i = _skip_whitespace(text, i)
+    if text[i] == u'}':
+        return None, i + 1
+    if text[i] != u'"':
+        raise ValueError('Expected a key at {0}'.format(i))
+    key, i = _scanstring(text, i + 1)
+    i = _skip_whitespace(text, i)
+    if text[i] != u':':
+        raise ValueError('Expected ":" at {0}'.format(i))
+    return key, _skip_whitespace(text, i + 1)
+
+
+def _after_json_value(text, i):
+    i = _skip_whitespace(text, i)
+    if text[i] == u',':
+        return i + 1
+    if text[i] != u'}':
+        raise ValueError('Expected "," or "}}" at {0}'.format(i))
+    return i
+
+
+def _split_json_array(text, i):
+    '''Returns messages of the array at `i` and where it ends'''
+    if text[i] != u'[':
+        raise ValueError('Expected an array at {0}'.format(i))
+    messages = Messages()
+    i = _skip_whitespace(text, i + 1)
+    if text[i] == u']':
+        return messages, i + 1
+    while True:
+        value, end = _raw_decode(text, i)
+        messages.append(value)
+        messages.raw.append(text[i:end])
+        i = _skip_whitespace(text, end)
+        if text[i] == u']':
+            return messages, i + 1
+        if text[i] != u',':
+            raise ValueError('Expected "," or "]" at {0}'.format(i))
+        i = _skip_whitespace(text, i + 1)
+
+
+def _parse_json_body(text, i):
+    if text[i] != u'{':
+        raise ValueError('Expected an object at {0}'.format(i))
+    body = {}
+    i += 1
+    while True:
+        key, i = _read_json_key(text, i)
+        if key is None:
+            return body, i
+        if key == u'messages':
+            body[key], i = _split_json_array(text, i)
+        else:
+            body[key], i = _raw_decode(text, i)
+        i = _after_json_value(text, i)
+
+
+def split_json_pdu(text):
+    '''Returns a subscription data PDU decoded except for its messages,
+       or None if `text` is some other PDU or cannot be split'''
+    try:
+        i = _skip_whitespace(text, 0)
+        if text[i] != u'{':
+            return None
+        pdu = {}
+        i += 1
+        while True:
+            key, i = _read_json_key(text, i)
+            if key is None:
+                break
+            if key == u'body':
+                if pdu.get(u'action', subscription_data_action) !=\
+                        subscription_data_action:
+                    return None
+                pdu[key], i = _parse_json_body(text, i)
+            else:
+                pdu[key], i = _raw_decode(text, i)
+                if key == u'action' and\
+                        pdu[key] != subscription_data_action:
+                    return None
+            i = _after_json_value(text, i)
+        if text[_skip_whitespace(text, i):]:
+            return None
+    except (ValueError, IndexError):
+        return None
+    if not _is_split_data(pdu):
+        return None
+    return pdu
+
+
+_cbor_argument_sizes = {24: ('>B', 1), 25: ('>H', 2), 26: ('>L', 4),
+                        27: ('>Q', 8)}
+_cbor_break = 0xff
+
+
+class _NotSubscriptionData(Exception):
+    pass
+
+
+class _CborReader(object):
+    '''Reads heads of maps, arrays and keys by hand and lets the decoder
+       of cbor2 decode values, telling where each of them ends.'''
+
+    def __init__(self, data):
+        self.data = data
+        self._fp = io.BytesIO(data)
+        self._decoder = cbor2.CBORDecoder(self._fp)
+
+    def head(self, i):
+        '''Returns major type, argument (None if indefinite) and where
+           the item's content starts'''
+        initial = six.indexbytes(self.data, i)
+        major, info = initial >> 5, initial & 0x1f
+        i += 1
+        if info < 24:
+            return major, info, i
+        if info == 31:
+            return major, None, i
+        fmt, size = _cbor_argument_sizes[info]
+        return major, struct.unpack_from(fmt, self.data, i)[0], i + size
+
+    def value(self, i):
+        self._fp.seek(i)
+        value = self._decoder.decode()
+        return value, self._fp.tell()
+
+    def container(self, i, major_type):
+        '''Returns the number of items (None if indefinite) of the array
+           or map at `i` and where the first of them starts'''
+        major, count, i = self.head(i)
+        if major != major_type:
+            raise ValueError('Unexpected major type at {0}'.format(i))
+        return count, i
+
+    def at_end(self, i, count, read):
+        if count is None:
+            return six.indexbytes(self.data, i) == _cbor_break
+        return read == count
+
+    def map(self, i, read_member):
+        count, i = self.container(i, 5)
+        result = {}
+        read = 0
+        while not self.at_end(i, count, read):
+            major, length, key_start = self.head(i)
+            if major != 3 or length is None:
+                raise ValueError('Expected a text key at {0}'.format(i))
+            i = key_start + length
+            key = self.data[key_start:i].decode('utf8')
+            result[key], i = read_member(self, result, key, i)
+            read += 1
+        return result, i + 1 if count is None else i
+
+
+def _read_cbor_pdu_member(reader, pdu, key, i):
+    if key == u'body':
+        if pdu.get(u'action', subscription_data_action) !=\
+                subscription_data_action:
+            raise _NotSubscriptionData()
+        return reader.map(i, _read_cbor_body_member)
+    value, i = reader.value(i)
+    if key == u'action' and value != subscription_data_action:
+        raise _NotSubscriptionData()
+    return value, i
+
+
+def _read_cbor_body_member(reader, body, key, i):
+    if key != u'messages':
+        return reader.value(i)
+    count, i = reader.container(i, 4)
+    messages = Messages()
+    while not reader.at_end(i, count, len(messages)):
+        value, end = reader.value(i)
+        messages.append(value)
+        messages.raw.append(reader.data[i:end])
+        i = end
+    return messages, i + 1 if count is None else i
+
+
+def split_cbor_pdu(data):
+    '''Returns a subscription data PDU decoded except for its messages,
+       or None if `data` is some other PDU or cannot be split'''
+    try:
+        pdu, end = _CborReader(data).map(0, _read_cbor_pdu_member)
+    except _NotSubscriptionData:
+        return None
+    except (ValueError, IndexError, KeyError, struct.error, EOFError,
+            cbor2.CBORDecodeError):
+        return None
+    if end != len(data) or not _is_split_data(pdu):
+        return None
+    return pdu
+
+
+def _is_split_data(pdu):
+    # the body may come before the action, it is only known at the end
+    body = pdu.get(u'body')
+    return pdu.get(u'action') == subscription_data_action and\
+        isinstance(body, dict) and\
+        isinstance(body.get(u'messages'), Messages)
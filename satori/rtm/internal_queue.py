@@ -1,24 +1,93 @@
-from six.moves import queue
+from collections import deque
+import threading
+import time
+
+from six.moves import queue, range
 
 import satori.rtm.internal_client_action as a
 
-user_actions = [
-    a.Publish, a.Subscribe,
+user_actions = frozenset([
+    a.Publish, a.PublishMany, a.Subscribe,
     a.Authenticate,
-    a.Read, a.Write, a.Delete]
+    a.Read, a.Write, a.Delete])
+
 
+class Queue(object):
+    '''Queue of events for the client event loop: any number of threads
+       put, a single thread gets. Items go into a deque without taking any
+       lock, the consumer is woken up only when the queue stops being
+       empty. Only user actions count against maxsize, so that events from
+       the connection are never dropped.'''
 
-class Queue(queue.Queue):
     def __init__(self, maxsize):
         self.softmaxsize = maxsize
-        queue.Queue.__init__(self)
+        self.queue = deque()
+        self._not_empty = threading.Event()
+        self._idle = threading.Event()
 
-    def _put(self, item):
-        is_user_action = type(item) in user_actions
-        if len(self.queue) >= self.softmaxsize and is_user_action:
+    def put(self, item, block=True, timeout=None):
+        if len(self.queue) >= self.softmaxsize\
+                and type(item) in user_actions:
             raise Full
-        queue.Queue._put(self, item)
+        self.queue.append(item)
+        # the consumer clears the event before it checks the queue
+        # for the last time and goes to sleep, see get
+        if not self._not_empty.is_set():
+            self._not_empty.set()
+
+    def get(self, block=True, timeout=None):
+        deadline = None
+        while True:
+            try:
+                return self.queue.popleft()
+            except IndexError:
+                if not block:
+                    raise Empty
+
+            self._not_empty.clear()
+            if self.queue:
+                continue
+
+            remaining = None
+            if timeout is not None:
+                if deadline is None:
+                    deadline = time.time() + timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Empty
+
+            # nothing is being handled while the consumer sleeps here
+            self._idle.set()
+            self._not_empty.wait(remaining)
+            self._idle.clear()
+
+    def get_many(self, limit, block=True, timeout=None):
+        '''Returns up to `limit` items at once, waiting for the first one
+           like get does'''
+        items = [self.get(block, timeout)]
+        popleft = self.queue.popleft
+        try:
+            for _ in range(limit - 1):
+                items.append(popleft())
+        except IndexError:
+            pass
+        return items
+
+    def qsize(self):
+        return len(self.queue)
+
+    def empty(self):
+        return not self.queue
+
+    def join(self):
+        '''Blocks until every item put so far has been taken and handled,
+           that is until the consumer sleeps waiting for more'''
+        while True:
+            self._idle.wait()
+            if not self.queue:
+                return
+            time.sleep(0.001)
 
 
 Empty = queue.Empty
-Full = queue.Full
\ No newline at end of file
+Full = queue.Full
@@ -5,7 +5,8 @@ from __future__ import print_function
 import threading
 from enum import Enum
 
-from satori.rtm.internal_logger import logger
+from satori.rtm.internal_timers import timers
+from satori.rtm.internal_logger import logger, levels
 
 from satori.rtm.internal_state_machine_wrapper import StateMachineWrapper
 import satori.rtm.generated.subscription_sm as sm
@@ -31,11 +32,23 @@ def _lint_args(args):
             'Setting "channel" in "args" parameter is not supported')
 
 
+def wants_raw_data(observer):
+    # looked up on the class so that observers answering any on_*
+    # attribute through __getattr__ keep getting decoded messages
+    return getattr(
+        observer.__class__, 'on_subscription_raw_data', None) is not None
+
+
+def wants_batches(observer):
+    return getattr(
+        observer.__class__, 'on_subscription_data_batch', None) is not None
+
+
 class Subscription(object):
     def __init__(
             self, delivery_mode,
             send_subscribe_request, send_unsubscribe_request,
-            args=None, observer=None):
+            args=None, observer=None, batch=None, request_flush=None):
         self.mode = 'linked'
 
         _lint_args(args)
@@ -50,6 +63,12 @@ class Subscription(object):
         self._next_args = {}
         self._sm = StateMachineWrapper(sm.Subscription_sm, self)
         self._last_error = None
+        self._batch = batch
+        self._next_batch = None
+        self._request_flush = request_flush
+        self._batch_messages = []
+        self._batch_position = None
+        self._flush_timer = None
         self._sm.advance(lambda sm: sm.ModeChange())
 
     def _set_last_error(self, reason):
@@ -58,7 +77,7 @@ class Subscription(object):
     def is_failed(self):
         return self._sm.get_state_name() == 'Subscription.Failed'
 
-    def subscribe(self, args=None, observer=None):
+    def subscribe(self, args=None, observer=None, batch=None):
         logger.debug('subscribe')
 
         if self.mode in ['linked', 'cycle']:
@@ -73,11 +92,13 @@ class Subscription(object):
 
         self._next_observer = observer
         self._next_args = args
+        self._next_batch = batch
         self.mode = 'cycle'
 
         return self._sm.advance(lambda sm: sm.ModeChange())
 
     def unsubscribe(self):
+        self.flush_batch()
         self._args = None
         if self.is_failed():
             self.mode = 'unlinked'
@@ -122,6 +143,10 @@ class Subscription(object):
             if self._next_args:
                 self._args = self._next_args
 
+            self.flush_batch()
+            self._batch = self._next_batch
+            self._next_batch = None
+
             if self.observer:
                 self._perform_state_callback('on_deleted')
 
@@ -133,6 +158,7 @@ class Subscription(object):
                 self.observer = None
             self._sm.advance(lambda sm: sm.ModeChange())
         elif self.mode == 'unlinked':
+            self.flush_batch()
             self._perform_state_callback('on_deleted')
             self.observer = None
 
@@ -149,21 +175,63 @@ class Subscription(object):
 
     def disconnect(self):
         logger.debug('disconnect')
+        self.flush_batch()
         self._connected = False
         self._sm.advance(lambda sm: sm.Disconnect())
 
     def on_subscription_data(self, data):
-        logger.debug('Got channel data %s', data)
+        if levels.debug:
+            logger.debug('Got channel data %s', data)
         accepting_states =\
             ['Subscription.' + s for s in
                 ['Subscribed', 'Unsubscribing']]
         if self._sm.get_state_name() in accepting_states:
             self.update_position(data[u'position'])
             if self.observer:
-                self.observer.on_subscription_data(data)
+                if self._batch and wants_batches(self.observer):
+                    self._add_to_batch(data)
+                elif wants_raw_data(self.observer) and\
+                        hasattr(data[u'messages'], 'raw'):
+                    raw_data = dict(data)
+                    raw_data[u'messages'] = data[u'messages'].raw
+                    self.observer.on_subscription_raw_data(raw_data)
+                else:
+                    self.observer.on_subscription_data(data)
+
+    def _add_to_batch(self, data):
+        max_messages, max_delay = self._batch
+        self._batch_messages.extend(data[u'messages'])
+        self._batch_position = data[u'position']
+        if len(self._batch_messages) >= max_messages:
+            self.flush_batch()
+        elif self._flush_timer is None and self._request_flush:
+            # the timer only asks the client loop to flush, observers
+            # are always called from the client loop thread
+            self._flush_timer = timers.call_later(
+                max_delay, self._request_flush)
+
+    def flush_batch(self):
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._batch_messages:
+            return
+        messages, self._batch_messages = self._batch_messages, []
+        if levels.debug:
+            logger.debug('Flushing a batch of %d messages', len(messages))
+        if self.observer:
+            # flushes also happen on disconnect and unsubscribe, where
+            # an exception would leave the state machine half way
+            try:
+                self.observer.on_subscription_data_batch(
+                    messages, self._batch_position)
+            except Exception as e:
+                logger.error('Caught exception in on_subscription_data_batch')
+                logger.exception(e)
 
     def update_position(self, new_position):
-        logger.debug('update_position %s', new_position)
+        if levels.debug:
+            logger.debug('update_position %s', new_position)
         if not (self._delivery_mode.value &
                 SubscriptionMode.TRACK_POSITION.value):
             return
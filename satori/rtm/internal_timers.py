@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import threading
+import time
+
+from satori.rtm.internal_logger import logger
+
+# cancelled timers stay in the heap until they are due, unless there are
+# more of them than live ones
+min_cancelled_to_compact = 64
+
+# deadlines must not move with the wall clock, Python 2 has no monotonic
+# clock though
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Timer(object):
+    def __init__(self, timers, deadline, callback, args):
+        self._timers = timers
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.pending = True
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._timers._on_cancel(self)
+
+
+class Timers(object):
+    '''Runs callbacks after a delay on a single daemon thread shared by
+       every connection and client in the process: keepalive pings, pong
+       and ack timeouts, reconnect backoff and subscription batch flushes.
+       Callbacks must be quick and must not block: the next timer waits
+       for them.'''
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(self, _clock() + delay, callback, args)
+        with self._condition:
+            heapq.heappush(
+                self._heap, (timer.deadline, next(self._sequence), timer))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='SatoriTimers')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._heap[0][2] is timer:
+                self._condition.notify()
+        return timer
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _on_cancel(self, timer):
+        with self._condition:
+            if not timer.pending:
+                return
+            self._cancelled += 1
+            if self._cancelled >= min_cancelled_to_compact and\
+                    self._cancelled * 2 > len(self._heap):
+                self._heap = [e for e in self._heap if not e[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _next_due(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, timer = self._heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self._heap)
+                    timer.pending = False
+                    self._cancelled -= 1
+                    continue
+                delay = deadline - _clock()
+                if delay <= 0:
+                    heapq.heappop(self._heap)
+                    timer.pending = False
+                    return timer
+                self._condition.wait(delay)
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error('Exception in a timer callback')
+                logger.exception(e)
+
+
+timers = Timers()
@@ -0,0 +1,140 @@
+from __future__ import print_function
+from collections import deque
+import threading
+
+import satori.rtm.internal_queue as queue
+from satori.rtm.internal_logger import logger
+
+backpressure_policies = ['block', 'drop-oldest', 'raise']
+
+# marks control frames in the queue, they are never dropped
+_control = object()
+
+
+class Writer(object):
+    '''Owns a thread that writes frames queued by other threads
+       to the websocket. Everything queued since the last write goes out
+       with a single vectored write.'''
+
+    def __init__(
+            self, write_frames, maxsize, backpressure, on_error,
+            on_drop=None):
+        if backpressure not in backpressure_policies:
+            raise ValueError(
+                'Backpressure policy must be one of {0}, got {1}'.format(
+                    backpressure_policies, backpressure))
+
+        self.maxsize = maxsize
+        self.backpressure = backpressure
+        self.dropped = 0
+
+        self._write_frames = write_frames
+        self._on_error = on_error
+        self._on_drop = on_drop
+        self._frames = deque()
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self._thread = threading.Thread(
+            target=self._write_until_stopped,
+            name='WebSocketWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put_many(self, frames, block=True, payloads=None, control=False):
+        '''Queues frames for writing. With block=False the backpressure
+           policy is not applied, this is meant for control frames and for
+           callers that must never wait such as the reader thread.
+
+           Control frames are never dropped. The payloads of the frames,
+           when given, are passed to on_drop if 'drop-oldest' drops them.'''
+
+        if control:
+            items = [(frame, _control) for frame in frames]
+        elif payloads is not None:
+            items = list(zip(frames, payloads))
+        else:
+            items = [(frame, None) for frame in frames]
+
+        dropped = None
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('Cannot send on a terminated websocket')
+
+            if block:
+                dropped = self._make_room(len(items))
+
+            self._frames.extend(items)
+            self._not_empty.notify()
+
+        if dropped and self._on_drop:
+            self._on_drop(dropped)
+
+    def _make_room(self, count):
+        overflow = len(self._frames) + count - self.maxsize
+        if overflow <= 0:
+            return
+
+        if self.backpressure == 'raise':
+            raise queue.Full
+        elif self.backpressure == 'drop-oldest':
+            kept = []
+            dropped = []
+            count = 0
+            while count < overflow and self._frames:
+                item = self._frames.popleft()
+                if item[1] is _control:
+                    kept.append(item)
+                    continue
+                count += 1
+                if item[1] is not None:
+                    dropped.append(item[1])
+            self._frames.extendleft(reversed(kept))
+            self.dropped += count
+            logger.debug('Dropped %d outgoing frames', count)
+            return dropped
+        else:
+            while self._frames and not self._stopped\
+                    and len(self._frames) + count > self.maxsize:
+                self._not_full.wait()
+            if self._stopped:
+                raise RuntimeError('Cannot send on a terminated websocket')
+
+    def qsize(self):
+        return len(self._frames)
+
+    def stop(self):
+        '''Lets the thread write out what is already queued and exit'''
+        with self._lock:
+            self._stopped = True
+            self._not_empty.notify()
+            self._not_full.notify_all()
+
+    def join(self, timeout=None):
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _write_until_stopped(self):
+        logger.debug('Starting writer thread')
+        while True:
+            with self._lock:
+                while not self._frames and not self._stopped:
+                    self._not_empty.wait()
+                if not self._frames:
+                    break
+                frames = [frame for (frame, _) in self._frames]
+                self._frames.clear()
+                self._not_full.notify_all()
+
+            try:
+                self._write_frames(frames)
+            except Exception as e:
+                with self._lock:
+                    self._stopped = True
+                    self._frames.clear()
+                    self._not_full.notify_all()
+                self._on_error(e)
+                break
+        logger.debug('Finishing writer thread')
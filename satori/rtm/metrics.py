@@ -0,0 +1,301 @@
+'''
+
+satori.rtm.metrics
+==================
+
+Counters and latency histograms kept by every Connection and Client, cheap
+enough to stay on in production. `client.metrics` and `connection.metrics`
+return the `Metrics` object, `metrics.snapshot()` turns it into a dict:
+
+* messages_in, messages_out - subscription data messages received,
+  messages published or written
+* bytes_in, bytes_out - sizes of incoming frame payloads and outgoing PDUs
+  (characters for JSON text frames)
+* pdus_in, pdus_out - number of PDUs by action
+* in_flight_acks - requests sent and not acknowledged yet
+* queue_depth, offline_queue_depth - events waiting for the Client event
+  loop and requests waiting for the Client to get connected
+* ack_latency - histograms of the time from sending a request with a
+  callback to receiving its reply, by request action ('rtm/publish',
+  'rtm/read', 'rtm/write', 'rtm/delete', 'rtm/subscribe' and so on), with
+  p50, p90, p99 and p999. `metrics.ack_latency_of(action)` returns the
+  `Histogram` of an action, `metrics.publish_ack_latency` the one of
+  publishes.
+* ack_timeouts - requests that got no reply within ack_timeout
+* ping_rtt, last_ping_rtt - histogram and last sample of WebSocket ping
+  round trip times
+* connects, reconnects, connecting_time, last_connecting_time - successful
+  connections of a Client, how many of them followed a lost one, total and
+  last time it took to connect, in seconds
+
+Counters are updated without locking and may miss an update now and then
+when several threads publish at once.
+
+An exporter is any callable that takes a snapshot. `metrics.export` calls
+it once, `metrics.start_exporting` calls it periodically from a daemon
+thread until `metrics.stop_exporting` is called.
+
+'''
+
+from __future__ import print_function
+
+import threading
+
+from satori.rtm.internal_logger import logger
+
+
+class Histogram(object):
+    '''Latencies in seconds, counted in log-linear buckets like in
+       HdrHistogram: values are taken in units of `resolution`, the ones
+       below 2 ** sub_bucket_bits units get a bucket each and every next
+       power of two is split into 2 ** (sub_bucket_bits - 1) buckets of
+       equal width. That keeps the relative error of percentiles below
+       2 ** (1 - sub_bucket_bits) with a few hundred counters.
+       Values above `highest` are counted as `highest`.'''
+
+    def __init__(self, resolution=0.000001, highest=3600, sub_bucket_bits=5):
+        self.resolution = resolution
+        self._sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._half_count = self._sub_bucket_count >> 1
+        self._highest_units = int(highest / resolution)
+        self.counts = [0] * (self._index(self._highest_units) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, units):
+        if units < self._sub_bucket_count:
+            return units
+        shift = units.bit_length() - self._sub_bucket_bits
+        return self._sub_bucket_count + (shift - 1) * self._half_count +\
+            (units >> shift) - self._half_count
+
+    def _bounds(self, index):
+        '''Lowest and highest value counted in a bucket, in units'''
+        if index < self._sub_bucket_count:
+            return index, index
+        shift, sub = divmod(index - self._sub_bucket_count, self._half_count)
+        shift += 1
+        lowest = (sub + self._half_count) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, value):
+        units = int(value / self.resolution)
+        if units > self._highest_units:
+            units = self._highest_units
+        elif units < 0:
+            units = 0
+        self.counts[self._index(units)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+Description
+    Adds the values recorded by another histogram with the same
+    resolution, highest value and sub bucket bits, for example the ones of
+    several connections or processes.
+        """
+        if len(other.counts) != len(self.counts) or\
+                other.resolution != self.resolution:
+            raise ValueError('Histograms have different buckets')
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (
+                self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (
+                self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percentile):
+        """
+Description
+    Returns the value below which `percentile` percent of the recorded
+    values are, None if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                highest = self._bounds(index)[1] * self.resolution
+                return min(max(highest, self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'buckets': [
+                (self._bounds(i)[0] * self.resolution, n)
+                for i, n in enumerate(self.counts) if n]}
+
+
+class Metrics(object):
+    def __init__(self):
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pdus_in = {}
+        self.pdus_out = {}
+        self.connects = 0
+        self.reconnects = 0
+        self.connecting_time = 0.0
+        self.last_connecting_time = None
+        self.ack_latency = {}
+        # reply action -> histogram of its request action
+        self._ack_latency_by_reply = {}
+        self.publish_ack_latency = self.ack_latency_of(u'rtm/publish')
+        self.ack_timeouts = 0
+        self.ping_rtt = Histogram()
+        self.last_ping_rtt = None
+        # name -> function returning the current value, filled in by the
+        # Connection and the Client this object belongs to
+        self.gauges = {}
+        self._exporter_thread = None
+        self._stop_exporting = None
+
+    def record_pdu_in(self, action):
+        self.pdus_in[action] = self.pdus_in.get(action, 0) + 1
+
+    def record_pdu_out(self, action):
+        self.pdus_out[action] = self.pdus_out.get(action, 0) + 1
+
+    def ack_latency_of(self, action):
+        histogram = self.ack_latency.get(action)
+        if histogram is None:
+            histogram = self.ack_latency[action] = Histogram()
+        return histogram
+
+    def take_ack_latency(self, action):
+        """
+Description
+    Puts an empty ack latency histogram in place of the one of `action` and
+    returns the old one, so that it can be read while the connection
+    keeps recording into the new one. Use it to report latencies per
+    interval instead of calling reset, which can race with recording.
+        """
+        histogram = Histogram()
+        old = self.ack_latency.get(action)
+        self.ack_latency[action] = histogram
+        for reply_action, h in list(self._ack_latency_by_reply.items()):
+            if h is old:
+                self._ack_latency_by_reply[reply_action] = histogram
+        if action == u'rtm/publish':
+            self.publish_ack_latency = histogram
+        return old if old is not None else Histogram()
+
+    def record_ack(self, reply_action, latency):
+        histogram = self._ack_latency_by_reply.get(reply_action)
+        if histogram is None:
+            # rtm/publish/ok -> rtm/publish
+            histogram = self._ack_latency_by_reply[reply_action] =\
+                self.ack_latency_of(reply_action.rpartition(u'/')[0])
+        histogram.record(latency)
+
+    def record_ping_rtt(self, rtt):
+        self.ping_rtt.record(rtt)
+        self.last_ping_rtt = rtt
+
+    def record_connect(self, duration, reconnect=False):
+        self.connects += 1
+        if reconnect:
+            self.reconnects += 1
+        self.connecting_time += duration
+        self.last_connecting_time = duration
+
+    def snapshot(self):
+        """
+Description
+    Returns the current values of all metrics as a dict.
+        """
+        result = {
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'pdus_in': dict(self.pdus_in),
+            'pdus_out': dict(self.pdus_out),
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'connecting_time': self.connecting_time,
+            'last_connecting_time': self.last_connecting_time,
+            'ack_timeouts': self.ack_timeouts,
+            'ping_rtt': self.ping_rtt.snapshot(),
+            'last_ping_rtt': self.last_ping_rtt,
+            'ack_latency': dict(
+                (action, histogram.snapshot())
+                for action, histogram in list(self.ack_latency.items())
+                if histogram.count)}
+        for name, gauge in list(self.gauges.items()):
+            try:
+                result[name] = gauge()
+            except Exception as e:
+                logger.exception(e)
+                result[name] = None
+        return result
+
+    def export(self, exporter):
+        """
+Description
+    Passes a snapshot to the exporter, a callable taking a dict.
+        """
+        exporter(self.snapshot())
+
+    def start_exporting(self, exporter, interval=10):
+        """
+Description
+    Exports a snapshot every `interval` seconds from a daemon thread until
+    `stop_exporting` is called. Only one exporter runs at a time.
+        """
+        self.stop_exporting()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.export(exporter)
+                except Exception as e:
+                    logger.error('Exception in metrics exporter')
+                    logger.exception(e)
+
+        self._stop_exporting = stop
+        self._exporter_thread = threading.Thread(
+            target=run, name='MetricsExporter')
+        self._exporter_thread.daemon = True
+        self._exporter_thread.start()
+
+    def stop_exporting(self):
+        """
+Description
+    Stops the exporter started with `start_exporting`, if any.
+        """
+        if self._stop_exporting:
+            self._stop_exporting.set()
+            self._exporter_thread.join()
+            self._stop_exporting = None
+            self._exporter_thread = None
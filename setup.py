@@ -9,6 +9,12 @@ if sys.version_info < (2, 7, 9):
     install_requires.append('PyOpenSSL>=0.15')
     install_requires.append('backports.ssl>=0.0.9')
 
+exclude_packages = ['doc', 'test', 'examples', 'tutorials']
+
+if sys.version_info < (3, 5):
+    # async/await syntax
+    exclude_packages.append('satori.rtm.aio')
+
 classifiers = [
     'Development Status :: 5 - Production/Stable',
     'Intended Audience :: Developers',
@@ -37,7 +43,7 @@ setup(
     author='Satori Worldwide, Inc.',
     author_email='sdk@satori.com',
     url='https://www.satori.com/',
-    packages=find_packages(exclude=['doc', 'test', 'examples', 'tutorials']),
+    packages=find_packages(exclude=exclude_packages),
     install_requires=install_requires,
     classifiers=classifiers,
     license='Proprietary',
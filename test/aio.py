@@ -0,0 +1,111 @@
+from __future__ import print_function
+import sys
+import unittest
+
+import satori.rtm.connection as sc
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from satori.rtm.aio import Connection, SubscriptionMode, make_client
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+@unittest.skipUnless(sys.version_info >= (3, 5), 'asyncio is required')
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 60))
+
+    def test_connection_write_read(self):
+        connection = Connection(endpoint, appkey)
+        self.run_(connection.start())
+        try:
+            channel = make_channel_name('aio_kv')
+            position = self.run_(connection.write(channel, 'value'))
+            self.assertTrue(position)
+            self.assertEqual(self.run_(connection.read(channel)), 'value')
+            self.run_(connection.delete(channel))
+            self.assertEqual(self.run_(connection.read(channel)), None)
+        finally:
+            self.run_(connection.stop())
+
+    def test_connection_flow_control(self):
+        watermark = sc.high_ack_count_watermark
+        sc.high_ack_count_watermark = 3
+        connection = Connection(endpoint, appkey)
+        self.run_(connection.start())
+        in_flight = []
+        send = connection._pdu.send
+
+        def recording_send(payload):
+            in_flight.append(len(connection._pdu.ack_callbacks_by_id))
+            send(payload)
+
+        connection._pdu.send = recording_send
+        try:
+            channel = make_channel_name('aio_flow_control')
+            positions = self.run_(asyncio.gather(*[
+                connection.publish(channel, i) for i in range(20)]))
+            self.assertEqual(len(positions), 20)
+            self.assertEqual(len(in_flight), 20)
+            self.assertLessEqual(max(in_flight), 3)
+        finally:
+            sc.high_ack_count_watermark = watermark
+            self.run_(connection.stop())
+
+    def test_client_publish_subscribe(self):
+        context = make_client(endpoint, appkey)
+        client = self.run_(context.__aenter__())
+        try:
+            channel = make_channel_name('aio_subscribe')
+            subscription = self.run_(
+                client.subscribe(channel, SubscriptionMode.SIMPLE))
+            self.run_(client.publish(channel, 'hello'))
+            self.run_(client.publish(channel, 'world', ack=False))
+
+            received = []
+            while len(received) < 2:
+                data = self.run_(subscription.__anext__())
+                received.extend(data['messages'])
+            self.assertEqual(received, ['hello', 'world'])
+
+            self.run_(client.unsubscribe(channel))
+            self.assertRaises(
+                StopAsyncIteration,
+                self.run_, subscription.__anext__())
+        finally:
+            self.run_(context.__aexit__(None, None, None))
+
+    def test_publish_error(self):
+        context = make_client(endpoint, appkey)
+        client = self.run_(context.__aenter__())
+        try:
+            self.assertRaises(
+                RuntimeError,
+                self.run_, client.publish('$system', 'nope'))
+        finally:
+            self.run_(context.__aexit__(None, None, None))
+
+    def test_publish_before_start(self):
+        context = make_client(endpoint, appkey)
+        client = self.run_(context.__aenter__())
+        try:
+            channel = make_channel_name('aio_offline')
+            client.stop()
+            publish = self.loop.create_task(client.publish(channel, 'later'))
+            client.start()
+            self.assertTrue(self.run_(publish))
+        finally:
+            self.run_(context.__aexit__(None, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
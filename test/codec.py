@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import json
+import unittest
+
+import cbor2
+
+from satori.rtm.codec import Codec, get_codec, register_codec
+from satori.rtm.connection import Connection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Delegate(object):
+    def __init__(self):
+        self.data = []
+
+    def on_subscription_data(self, data):
+        self.data.append(data)
+
+
+data_pdu = {
+    u'action': u'rtm/subscription/data',
+    u'body': {
+        u'position': u'1479315802:0',
+        u'messages': [{u'text': u'привет'}, 42],
+        u'subscription_id': u'channel'}}
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_defaults(self):
+        self.assertEqual(get_codec().protocol, 'json')
+        self.assertEqual(get_codec(protocol='cbor').dumps, cbor2.dumps)
+        self.assertEqual(get_codec('stdlib-json').dumps, json.dumps)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, lambda: get_codec('bogus'))
+        self.assertRaises(
+            ValueError,
+            lambda: Connection('ws://localhost', 'appkey', codec='bogus'))
+
+    def test_protocol_mismatch(self):
+        self.assertRaises(ValueError, lambda: get_codec('cbor', 'json'))
+        self.assertRaises(
+            ValueError,
+            lambda: register_codec('msgpack', 'msgpack', None, None))
+
+    def test_registered_codec_decodes_incoming_pdus(self):
+        decoded = []
+
+        def loads(text):
+            decoded.append(text)
+            return json.loads(text)
+
+        register_codec('recording-json', 'json', json.dumps, loads)
+        conn = Connection(
+            'ws://localhost', 'appkey', codec='recording-json')
+        conn.delegate = Delegate()
+        conn.on_incoming_text_frame(json.dumps(data_pdu))
+        self.assertEqual(len(decoded), 1)
+        self.assertEqual(conn.delegate.data, [data_pdu[u'body']])
+
+    def test_publish_pdu_from_text_and_bytes(self):
+        def dumps_bytes(value):
+            return json.dumps(value).encode('utf8')
+
+        text = Connection('ws://localhost', 'appkey')
+        binary = Connection(
+            'ws://localhost', 'appkey',
+            codec=Codec('json', dumps_bytes, json.loads))
+        message = {u'text': u'привет'}
+        for conn in [text, binary]:
+            payload = conn._make_channel_payload(
+                u'rtm/publish', u'channel', conn._dumps(message), None)
+            self.assertEqual(json.loads(payload.decode('utf8')), {
+                u'action': u'rtm/publish',
+                u'body': {u'channel': u'channel', u'message': message}})
+
+    @unittest.skipUnless(orjson, 'orjson is not installed')
+    def test_orjson(self):
+        conn = Connection('ws://localhost', 'appkey', codec='orjson')
+        self.assertEqual(conn.codec.dumps, orjson.dumps)
+        conn.delegate = Delegate()
+        conn.on_incoming_text_frame(json.dumps(data_pdu))
+        self.assertEqual(conn.delegate.data, [data_pdu[u'body']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import itertools
+import json
+import unittest
+
+import cbor2
+
+import satori.rtm.connection as sc
+
+loads = {
+    'json': lambda payload: json.loads(payload.decode('utf8')),
+    'cbor': cbor2.loads}
+
+
+def callback(ack):
+    pass
+
+
+class TestEnvelope(unittest.TestCase):
+
+    def check_payloads(self, protocol):
+        conn = sc.Connection('ws://localhost', 'appkey', protocol=protocol)
+        # ids of all CBOR integer sizes
+        ids = [0, 23, 24, 255, 256, 65535, 65536, 2 ** 32]
+        message = {u'text': u'привет'}
+        encoded = conn._dumps(message)
+        for action_id in ids:
+            conn.action_id_iterator = itertools.count(action_id)
+            for name in [u'rtm/publish', u'rtm/write']:
+                for channel in [u'channel', u'канал']:
+                    body = {u'channel': channel, u'message': message}
+
+                    payload = conn._make_channel_payload(
+                        name, channel, encoded, None)
+                    self.assertEqual(
+                        loads[protocol](payload),
+                        {u'action': name, u'body': body})
+
+                    payload = conn._make_channel_payload(
+                        name, channel, encoded, callback)
+                    self.assertEqual(
+                        loads[protocol](payload),
+                        {u'action': name, u'id': action_id, u'body': body})
+                    action_id += 1
+
+            payload = conn._make_payload(
+                u'rtm/subscribe', conn._dumps({u'channel': u'c'}), callback)
+            self.assertEqual(loads[protocol](payload), {
+                u'action': u'rtm/subscribe', u'id': action_id,
+                u'body': {u'channel': u'c'}})
+            self.assertEqual(conn.ack_callbacks_by_id[action_id], callback)
+
+    def test_json(self):
+        self.check_payloads('json')
+
+    def test_cbor(self):
+        self.check_payloads('cbor')
+
+    def test_bytes_like_messages(self):
+        conn = sc.Connection('ws://localhost', 'appkey')
+        recording = b'[1,{"a":2}]'
+        for message in [memoryview(recording)[1:2], bytearray(b'{"a":2}')]:
+            payload = conn._make_channel_payload(
+                u'rtm/publish', u'channel', message, None)
+            self.assertEqual(
+                loads['json'](payload)[u'body'][u'message'],
+                json.loads(bytes(message).decode('utf8')))
+
+    def test_channel_escaping(self):
+        conn = sc.Connection('ws://localhost', 'appkey')
+        conn.action_id_iterator = itertools.count(0)
+        channels = [
+            u'with "quotes"', u'back\\slash', u'new\nline\ttab\x00nul',
+            u'</script>']
+        for action_id, channel in enumerate(channels):
+            payload = conn._make_channel_payload(
+                u'rtm/publish', channel, b'1', callback)
+            self.assertEqual(loads['json'](payload), {
+                u'action': u'rtm/publish', u'id': action_id,
+                u'body': {u'channel': channel, u'message': 1}})
+
+    def test_channel_cache_is_bounded(self):
+        conn = sc.Connection('ws://localhost', 'appkey')
+        limit = sc.max_cached_channel_envelopes
+        try:
+            sc.max_cached_channel_envelopes = 10
+            for i in range(25):
+                conn._make_channel_payload(
+                    u'rtm/publish', u'channel{0}'.format(i), b'1', None)
+            self.assertLessEqual(
+                len(conn._channel_envelopes[u'rtm/publish']), 10)
+        finally:
+            sc.max_cached_channel_envelopes = limit
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import struct
+import unittest
+
+from miniws4py.exc import MessageTooBigException
+from miniws4py.framing import FrameReader
+from miniws4py.websocket import WebSocket
+
+
+def server_frame(opcode, payload, fin=1):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', (fin << 7) | opcode, length)
+    elif length < (1 << 16):
+        header = struct.pack('!BBH', (fin << 7) | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', (fin << 7) | opcode, 127, length)
+    return header + payload
+
+
+def close_code(client_frame):
+    # client frames are masked, the key follows the two byte header
+    key = bytearray(client_frame[2:6])
+    payload = bytearray(client_frame[6:8])
+    return struct.unpack(
+        '!H', bytes(bytearray(b ^ key[i] for i, b in enumerate(payload))))[0]
+
+
+class ChunkedSocket(object):
+    '''Hands out the given bytes in chunks of at most chunk_size'''
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.written = []
+
+    def recv(self, size, flags=0):
+        size = min(size, self.chunk_size)
+        result, self.data = self.data[:size], self.data[size:]
+        return result
+
+    def recv_into(self, buf):
+        chunk = self.recv(len(buf))
+        buf[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data, flags=0):
+        self.written.append(data)
+
+    def setblocking(self, flag):
+        pass
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingWebSocket(WebSocket):
+    def __init__(self, sock):
+        WebSocket.__init__(self, sock)
+        self.received = []
+
+    def received_message(self, message):
+        self.received.append(message.data)
+
+
+stream = b''.join([
+    server_frame(0x1, u'привет'.encode('utf8')),
+    server_frame(0x2, b'\x00\x01\x02'),
+    server_frame(0x9, b'ping'),
+    server_frame(0x1, b'x' * 300),
+    server_frame(0x1, b'frag', fin=0),
+    server_frame(0x0, b'ment', fin=0),
+    server_frame(0x0, b'ed', fin=1),
+    server_frame(0x2, b'y' * 70000),
+    server_frame(0x1, b'{}'),
+])
+
+expected = [
+    u'привет'.encode('utf8'), b'\x00\x01\x02', b'x' * 300,
+    b'fragmented', b'y' * 70000, b'{}']
+
+
+class TestFrameReader(unittest.TestCase):
+
+    def test_frames_across_reads(self):
+        for chunk_size in [1, 3, 100, 4096, len(stream)]:
+            ws = RecordingWebSocket(ChunkedSocket(stream, chunk_size))
+            while ws.sock.data:
+                self.assertTrue(ws.receive())
+            self.assertEqual(ws.received, expected)
+            self.assertEqual(len(ws.sock.written), 1)
+
+    def test_same_result_as_stream_parser(self):
+        ws = RecordingWebSocket(ChunkedSocket(stream, 4096))
+        while ws.sock.data:
+            self.assertTrue(ws.once())
+        self.assertEqual(ws.received, expected)
+
+    def test_payload_slices(self):
+        reader = FrameReader(16)
+        reader.feed(server_frame(0x1, b'hello') + server_frame(0x1, b'wo'))
+        frames = [
+            (fin, opcode, bytes(payload))
+            for fin, opcode, payload in reader.frames()]
+        self.assertEqual(frames, [(1, 1, b'hello'), (1, 1, b'wo')])
+        self.assertEqual(reader.start, reader.end)
+
+    def test_masked_frame_is_rejected(self):
+        data = b'\x81\x82\x00\x00\x00\x00hi'
+        ws = RecordingWebSocket(ChunkedSocket(data, 100))
+        self.assertFalse(ws.receive())
+        self.assertEqual(ws.received, [])
+        self.assertEqual(len(ws.sock.written), 1)
+
+    def test_bogus_length_is_rejected(self):
+        # a header announcing 2**62 bytes is rejected before any payload
+        data = struct.pack('!BBQ', 0x82, 127, 1 << 62)
+        ws = RecordingWebSocket(ChunkedSocket(data, 100))
+        self.assertFalse(ws.receive())
+        self.assertLessEqual(len(ws.reader.buffer), 65536)
+        self.assertEqual(close_code(ws.sock.written[0]), 1009)
+
+    def test_fragmented_message_too_big(self):
+        data = server_frame(0x2, b'x' * 10, fin=0) +\
+            server_frame(0x0, b'x' * 10)
+        ws = RecordingWebSocket(ChunkedSocket(data, 100))
+        ws.stream.max_message_size = 15
+        self.assertFalse(ws.receive())
+        self.assertEqual(ws.received, [])
+        self.assertEqual(close_code(ws.sock.written[0]), 1009)
+
+    def test_buffer_shrinks_after_large_frame(self):
+        reader = FrameReader(16, max_frame_size=1000)
+        reader.feed(server_frame(0x2, b'y' * 500))
+        self.assertGreater(len(reader.buffer), 500)
+        self.assertEqual(
+            [bytes(p) for (_, _, p) in reader.frames()], [b'y' * 500])
+        reader.feed(server_frame(0x1, b'hi'))
+        self.assertEqual(len(reader.buffer), 16)
+        self.assertEqual(
+            [bytes(p) for (_, _, p) in reader.frames()], [b'hi'])
+
+        reader.feed(struct.pack('!BBH', 0x82, 126, 1001))
+        self.assertRaises(MessageTooBigException, list, reader.frames())
+
+    def test_close_frame(self):
+        data = server_frame(0x8, struct.pack('!H', 1000))
+        ws = RecordingWebSocket(ChunkedSocket(data, 100))
+        self.assertFalse(ws.receive())
+        self.assertEqual(ws.stream.closing.code, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+import satori.rtm.internal_client_action as a
+import satori.rtm.internal_queue as queue
+
+
+class TestInternalQueue(unittest.TestCase):
+
+    def test_only_user_actions_are_limited(self):
+        q = queue.Queue(maxsize=2)
+        q.put(a.Publish('channel', '1', None))
+        q.put(a.Publish('channel', '2', None))
+        self.assertRaises(
+            queue.Full, lambda: q.put(a.Publish('channel', '3', None)))
+        q.put(a.Tick())
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(q.get().message, '1')
+        self.assertEqual(q.get().message, '2')
+        self.assertEqual(type(q.get()), a.Tick)
+        self.assertTrue(q.empty())
+
+    def test_get_timeout(self):
+        q = queue.Queue(maxsize=10)
+        origin = time.time()
+        self.assertRaises(queue.Empty, lambda: q.get(timeout=0.05))
+        self.assertGreaterEqual(time.time() - origin, 0.04)
+        self.assertRaises(queue.Empty, lambda: q.get(block=False))
+
+    def test_many_producers(self):
+        q = queue.Queue(maxsize=float('inf'))
+        producers, count = 4, 20000
+
+        def produce(producer):
+            for i in range(count):
+                q.put((producer, i))
+
+        threads = [
+            threading.Thread(target=produce, args=(p,))
+            for p in range(producers)]
+        for t in threads:
+            t.start()
+
+        last = [-1] * producers
+        for _ in range(producers * count):
+            producer, i = q.get(timeout=10)
+            self.assertEqual(i, last[producer] + 1)
+            last[producer] = i
+        for t in threads:
+            t.join()
+        self.assertTrue(q.empty())
+
+    def test_join_waits_until_handled(self):
+        q = queue.Queue(maxsize=10)
+        handled = []
+
+        def consume():
+            while True:
+                item = q.get()
+                if item is None:
+                    return
+                time.sleep(0.01)
+                handled.append(item)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for i in range(5):
+            q.put(i)
+        q.join()
+        self.assertEqual(handled, list(range(5)))
+        q.put(None)
+        consumer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import struct
+import unittest
+
+from miniws4py.framing import Frame, OPCODE_TEXT, mask, mask_implementations
+from miniws4py.websocket import WebSocket
+
+
+def unmask(frame):
+    length = struct.unpack_from('!B', frame, 1)[0] & 0x7f
+    offset = 2
+    if length == 126:
+        length = struct.unpack_from('!H', frame, 2)[0]
+        offset = 4
+    elif length == 127:
+        length = struct.unpack_from('!Q', frame, 2)[0]
+        offset = 10
+    key = bytearray(frame[offset:offset + 4])
+    body = bytearray(frame[offset + 4:])
+    assert len(body) == length
+    for i in range(length):
+        body[i] ^= key[i % 4]
+    return bytes(key), bytes(body)
+
+
+def masked_with(implementation, data, key, offset=0):
+    buf = bytearray(offset + len(data))
+    implementation(buf, offset, data, key)
+    return bytes(buf[offset:])
+
+
+class TestMasking(unittest.TestCase):
+
+    def test_implementations_agree(self):
+        reference = mask_implementations['loop']
+        key = b'\x01\x7f\x80\xfe'
+        for size in [0, 1, 3, 4, 5, 125, 126, 127, 511, 512, 65536, 100001]:
+            data = os.urandom(size)
+            expected = masked_with(reference, data, key)
+            for name, implementation in mask_implementations.items():
+                for offset in [0, 2, 7]:
+                    self.assertEqual(
+                        masked_with(implementation, data, key, offset),
+                        expected,
+                        '{0} differs on {1} bytes'.format(name, size))
+
+    def test_accepts_bytearray_and_memoryview(self):
+        data = b'hello world'
+        key = os.urandom(4)
+        expected = mask(data, key)
+        for name, implementation in mask_implementations.items():
+            for d in [bytearray(data), memoryview(data)]:
+                self.assertEqual(
+                    masked_with(implementation, d, key), expected, name)
+
+    def test_masking_twice_restores_data(self):
+        data = os.urandom(1000)
+        key = os.urandom(4)
+        self.assertEqual(mask(mask(data, key), key), data)
+        self.assertEqual(
+            mask(data), bytes(bytearray(b ^ 0xFF for b in bytearray(data))))
+
+    def test_masked_frame(self):
+        keys = set()
+        for size in [0, 10, 300, 70000]:
+            body = os.urandom(size)
+            frame = Frame(
+                opcode=OPCODE_TEXT, body=body, fin=1, masked=True).build()
+            key, unmasked = unmask(frame)
+            self.assertEqual(unmasked, body)
+            keys.add(key)
+        self.assertEqual(len(keys), 4)
+
+    def test_websocket_masks_when_asked(self):
+        ws = WebSocket(None)
+        self.assertEqual(unmask(ws.frame(b'abc'))[0], b'\x00\x00\x00\x00')
+        ws.masked = True
+        key, body = unmask(ws.frame(b'abc'))
+        self.assertNotEqual(key, b'\x00\x00\x00\x00')
+        self.assertEqual(body, b'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
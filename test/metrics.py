@@ -0,0 +1,152 @@
+from __future__ import print_function
+import json
+import threading
+import time
+import unittest
+
+import satori.rtm.connection as sc
+from satori.rtm.client import make_client
+from satori.rtm.metrics import Histogram, Metrics
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+from test.utils import sync_publish, RecordingWebSocket
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        h = Histogram(resolution=0.001, highest=10)
+        for value in [0.0005, 0.0015, 0.003, 0.5, 60]:
+            h.record(value)
+        snapshot = h.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['min'], 0.0005)
+        self.assertEqual(snapshot['max'], 60)
+        self.assertEqual([n for _, n in snapshot['buckets']], [1] * 5)
+        self.assertLessEqual(snapshot['buckets'][-1][0], 10)
+
+    def test_percentiles(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(50), None)
+        for i in range(1, 100001):
+            h.record(i * 0.000001)
+        for percentile in [1, 50, 90, 99, 99.9]:
+            expected = percentile / 1000.0
+            self.assertLessEqual(
+                abs(h.percentile(percentile) - expected) / expected, 0.04)
+        self.assertEqual(h.percentile(100), h.max)
+        h.reset()
+        self.assertEqual(h.count, 0)
+        self.assertEqual(sum(h.counts), 0)
+
+    def test_merge(self):
+        a, b = Histogram(), Histogram()
+        for i in range(1, 1001):
+            (a if i % 2 else b).record(i * 0.001)
+        a.merge(b)
+        self.assertEqual(a.count, 1000)
+        self.assertEqual(a.min, 0.001)
+        self.assertEqual(a.max, 1.0)
+        self.assertLessEqual(abs(a.percentile(50) - 0.5) / 0.5, 0.04)
+        self.assertRaises(
+            ValueError, a.merge, Histogram(resolution=0.001))
+
+    def test_take_ack_latency(self):
+        metrics = Metrics()
+        metrics.record_ack(u'rtm/publish/ok', 0.01)
+        metrics.record_ack(u'rtm/publish/error', 0.02)
+        old = metrics.take_ack_latency(u'rtm/publish')
+        self.assertEqual(old.count, 2)
+        metrics.record_ack(u'rtm/publish/ok', 0.03)
+        self.assertEqual(old.count, 2)
+        self.assertEqual(metrics.publish_ack_latency.count, 1)
+        self.assertEqual(metrics.ack_latency[u'rtm/publish'].count, 1)
+        self.assertEqual(metrics.take_ack_latency(u'rtm/read').count, 0)
+
+    def test_connection_counters(self):
+        conn = sc.Connection('ws://localhost', 'appkey', protocol='json')
+        conn.ws = RecordingWebSocket()
+        acks = []
+        conn.publish(u'channel', {u'text': u'hi'}, acks.append)
+        conn.publish_many(u'channel', [1, 2])
+        conn.publisher(u'channel').publish(3)
+        conn.read(u'channel', callback=acks.append)
+
+        self.assertEqual(conn.metrics.snapshot()['in_flight_acks'], 2)
+        ack = json.dumps({
+            u'action': u'rtm/publish/ok', u'id': 0, u'body': {}})
+        conn.on_incoming_text_frame(ack)
+        data = json.dumps({
+            u'action': u'rtm/subscription/data',
+            u'body': {
+                u'subscription_id': u'channel',
+                u'position': u'1',
+                u'messages': [1, 2, 3]}})
+        conn.on_incoming_text_frame(data)
+
+        snapshot = conn.metrics.snapshot()
+        self.assertEqual(snapshot['messages_out'], 4)
+        self.assertEqual(snapshot['messages_in'], 3)
+        self.assertEqual(
+            snapshot['pdus_out'], {u'rtm/publish': 4, u'rtm/read': 1})
+        self.assertEqual(
+            snapshot['pdus_in'],
+            {u'rtm/publish/ok': 1, u'rtm/subscription/data': 1})
+        self.assertEqual(
+            snapshot['bytes_out'], sum(len(p) for p in conn.ws.sent))
+        self.assertEqual(snapshot['bytes_in'], len(ack) + len(data))
+        self.assertEqual(snapshot['in_flight_acks'], 1)
+        self.assertEqual(
+            list(snapshot['ack_latency'].keys()), [u'rtm/publish'])
+        self.assertEqual(snapshot['ack_latency'][u'rtm/publish']['count'], 1)
+        self.assertEqual(len(acks), 1)
+
+        conn.on_incoming_text_frame(json.dumps({
+            u'action': u'rtm/read/ok', u'id': 1, u'body': {}}))
+        latency = conn.metrics.ack_latency_of(u'rtm/read')
+        self.assertEqual(latency.count, 1)
+        self.assertLessEqual(latency.percentile(99), latency.max)
+
+    def test_exporters(self):
+        metrics = Metrics()
+        metrics.gauges['answer'] = lambda: 42
+        exported = []
+        metrics.export(exported.append)
+        self.assertEqual(exported[0]['answer'], 42)
+
+        got_three = threading.Event()
+
+        def exporter(snapshot):
+            exported.append(snapshot)
+            if len(exported) >= 3:
+                got_three.set()
+
+        metrics.start_exporting(exporter, interval=0.01)
+        self.assertTrue(got_three.wait(10))
+        metrics.stop_exporting()
+        count = len(exported)
+        time.sleep(0.05)
+        self.assertEqual(len(exported), count)
+
+    def test_client_metrics(self):
+        with make_client(endpoint, appkey) as client:
+            channel = make_channel_name('metrics')
+            sync_publish(client, channel, u'message')
+            snapshot = client.metrics.snapshot()
+            self.assertEqual(snapshot['connects'], 1)
+            self.assertEqual(snapshot['reconnects'], 0)
+            self.assertGreater(snapshot['last_connecting_time'], 0)
+            self.assertEqual(snapshot['messages_out'], 1)
+            self.assertEqual(
+                snapshot['ack_latency'][u'rtm/publish']['count'], 1)
+            self.assertIsNotNone(
+                snapshot['ack_latency'][u'rtm/publish']['p99'])
+            self.assertEqual(snapshot['offline_queue_depth'], 0)
+            self.assertIn('queue_depth', snapshot)
+            self.assertIn('in_flight_acks', snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
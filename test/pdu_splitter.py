@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import json
+import unittest
+
+import cbor2
+
+from satori.rtm.connection import Connection
+from satori.rtm.internal_pdu_splitter import split_cbor_pdu, split_json_pdu
+
+messages = [
+    {u'text': u'привет', u'nested': {u'list': [1, 2.5, None, True]}},
+    u'just a string with "quotes" and \\ and ]',
+    42,
+    [],
+]
+
+
+def data_pdu(messages):
+    return {
+        u'action': u'rtm/subscription/data',
+        u'body': {
+            u'position': u'1479315802:0',
+            u'messages': messages,
+            u'subscription_id': u'channel'}}
+
+
+class Delegate(object):
+    def __init__(self):
+        self.data = []
+
+    def on_subscription_data(self, data):
+        self.data.append(data)
+
+
+class TestPduSplitter(unittest.TestCase):
+
+    def test_json(self):
+        for separators in [(',', ':'), (', ', ': ')]:
+            text = json.dumps(data_pdu(messages), separators=separators)
+            pdu = split_json_pdu(text)
+            self.assertEqual(pdu, data_pdu(messages))
+            raw = pdu[u'body'][u'messages'].raw
+            self.assertEqual([json.loads(m) for m in raw], messages)
+            self.assertEqual(
+                raw, [json.dumps(m, separators=separators) for m in messages])
+
+    def test_json_whitespace(self):
+        text = u' {\n "action" : "rtm/subscription/data" ,\t"body" : {' +\
+            u' "messages" : [ 1 , { "a" : [ ] } ] } } '
+        pdu = split_json_pdu(text)
+        self.assertEqual(pdu[u'body'][u'messages'], [1, {u'a': []}])
+        self.assertEqual(
+            pdu[u'body'][u'messages'].raw, [u'1', u'{ "a" : [ ] }'])
+
+    def test_cbor(self):
+        cbor_messages = messages + [{u'binary': b'\x00\xff'}, 2 ** 40, -1.5]
+        pdu = split_cbor_pdu(cbor2.dumps(data_pdu(cbor_messages)))
+        self.assertEqual(pdu, data_pdu(cbor_messages))
+        raw = pdu[u'body'][u'messages'].raw
+        self.assertEqual(raw, [cbor2.dumps(m) for m in cbor_messages])
+
+    def test_other_pdus_are_left_alone(self):
+        pdus = [
+            {u'action': u'rtm/publish/ok', u'id': 1, u'body': {}},
+            {u'body': {u'messages': []}, u'action': u'rtm/publish/ok'},
+            {u'action': u'rtm/subscription/data', u'body': {u'messages': {}}},
+        ]
+        for pdu in pdus:
+            self.assertEqual(split_json_pdu(json.dumps(pdu)), None)
+            self.assertEqual(split_cbor_pdu(cbor2.dumps(pdu)), None)
+
+    def test_malformed_pdus(self):
+        text = json.dumps(data_pdu(messages))
+        for bad in [text[:-1], text[:40], text + u'{}', u'[]', u'',
+                    text.replace(u'[', u'[1,,', 1)]:
+            self.assertEqual(split_json_pdu(bad), None, bad)
+        binary = cbor2.dumps(data_pdu(messages))
+        for bad in [binary[:-1], binary[:20], binary + b'\x00', b'']:
+            self.assertEqual(split_cbor_pdu(bad), None, bad)
+
+    def test_connection_keeps_raw_messages(self):
+        for protocol in ['json', 'cbor']:
+            connection = Connection(
+                'ws://localhost', 'appkey', protocol=protocol,
+                keep_raw_messages=True)
+            connection.delegate = Delegate()
+            if protocol == 'json':
+                connection.on_incoming_text_frame(
+                    json.dumps(data_pdu(messages)))
+                loads = json.loads
+            else:
+                connection.on_incoming_binary_frame(
+                    cbor2.dumps(data_pdu(messages)))
+                loads = cbor2.loads
+            data, = connection.delegate.data
+            self.assertEqual(data[u'messages'], messages)
+            self.assertEqual(
+                [loads(m) for m in data[u'messages'].raw], messages)
+
+    def test_pdus_in_any_order(self):
+        body = data_pdu(messages)[u'body']
+        # body before action, and an indefinite length CBOR map
+        text = u'{{"body":{0},"action":"rtm/subscription/data"}}'.format(
+            json.dumps(body))
+        binary = b''.join([
+            b'\xbf', cbor2.dumps(u'body'), cbor2.dumps(body),
+            cbor2.dumps(u'action'), cbor2.dumps(u'rtm/subscription/data'),
+            b'\xff'])
+        for pdu in [split_json_pdu(text), split_cbor_pdu(binary)]:
+            self.assertEqual(pdu, data_pdu(messages))
+        self.assertEqual(
+            split_json_pdu(text)[u'body'][u'messages'].raw,
+            [json.dumps(m) for m in messages])
+        self.assertEqual(
+            split_cbor_pdu(binary)[u'body'][u'messages'].raw,
+            [cbor2.dumps(m) for m in messages])
+
+    def test_raw_is_what_came_from_rtm(self):
+        # float and escapes that a decode and encode would change
+        raw = [u'1.50', u'"\\u00e9"', u'{"b":1,  "a":[ ]}']
+        text = (u'{"action":"rtm/subscription/data","body":'
+                u'{"messages":[' + u','.join(raw) + u']}}')
+        messages = split_json_pdu(text)[u'body'][u'messages']
+        self.assertEqual(messages.raw, raw)
+        self.assertEqual(messages, [1.5, u'\xe9', {u'a': [], u'b': 1}])
+
+        # half float, non minimal integer, indefinite text and array
+        raw = [b'\xf9\x3e\x00', b'\x19\x00\x01', b'\x7f\x61a\x61b\xff',
+               b'\x9f\x01\xff']
+        binary = b''.join([
+            b'\xa2', cbor2.dumps(u'action'),
+            cbor2.dumps(u'rtm/subscription/data'), cbor2.dumps(u'body'),
+            b'\xa1', cbor2.dumps(u'messages'), b'\x84'] + raw)
+        messages = split_cbor_pdu(binary)[u'body'][u'messages']
+        self.assertEqual(messages.raw, raw)
+        self.assertEqual(messages, [1.5, 1, u'ab', [1]])
+
+    def test_connection_keeps_raw_messages_of_any_order(self):
+        raw = [u'1.50', u'{"b":1,  "a":[ ]}']
+        text = (u'{"body":{"messages":[' + u','.join(raw) + u'],'
+                u'"subscription_id":"channel"},'
+                u'"action":"rtm/subscription/data"}')
+        connection = Connection(
+            'ws://localhost', 'appkey', keep_raw_messages=True)
+        connection.delegate = Delegate()
+        connection.on_incoming_text_frame(text)
+        data, = connection.delegate.data
+        self.assertEqual(data[u'messages'], [1.5, {u'a': [], u'b': 1}])
+        self.assertEqual(data[u'messages'].raw, raw)
+
+    def test_connection_without_raw_messages(self):
+        connection = Connection('ws://localhost', 'appkey')
+        connection.delegate = Delegate()
+        connection.on_incoming_text_frame(json.dumps(data_pdu(messages)))
+        data, = connection.delegate.data
+        self.assertEqual(type(data[u'messages']), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
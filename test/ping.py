@@ -0,0 +1,113 @@
+from __future__ import print_function
+import socket
+import threading
+import time
+import unittest
+
+from satori.rtm.connection import Connection
+from satori.rtm.internal_connection_miniws4py import RtmWsClient
+
+from test.utils import get_test_endpoint_and_appkey
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+class ClosedDelegate(object):
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def on_connection_closed(self):
+        self.closed.set()
+
+
+class TestPing(unittest.TestCase):
+
+    def test_rtt(self):
+        conn = Connection(endpoint, appkey, ping_interval=0.05)
+        conn.start()
+        try:
+            origin = time.time()
+            while conn.metrics.ping_rtt.count < 2\
+                    and time.time() < origin + 5:
+                time.sleep(0.05)
+            self.assertGreaterEqual(conn.metrics.ping_rtt.count, 2)
+            self.assertGreaterEqual(conn.metrics.last_ping_rtt, 0)
+            self.assertIsNotNone(
+                conn.metrics.snapshot()['ping_rtt']['p99'])
+        finally:
+            conn.stop()
+
+    def test_dead_connection_is_closed(self):
+        delegate = ClosedDelegate()
+        conn = Connection(
+            endpoint, appkey, delegate=delegate,
+            ping_interval=0.05, ping_timeout=0.1)
+        conn.start()
+        # emulate the absence of server pongs and silence in the socket
+        conn.on_ws_ponged = lambda: None
+        origin = time.time()
+        self.assertTrue(delegate.closed.wait(5))
+        self.assertLess(time.time() - origin, 2)
+        # the delegate hears about it before the socket is closed
+        while conn.ws is not None and time.time() < origin + 5:
+            time.sleep(0.01)
+        self.assertIsNone(conn.ws)
+
+    def socket_pair(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        return a, b
+
+    def test_full_socket_skips_ping(self):
+        a, b = self.socket_pair()
+        a.setblocking(False)
+        try:
+            while True:
+                a.send(b'x' * 65536)
+        except socket.error:
+            pass
+        a.setblocking(True)
+        ws = RtmWsClient('ws://localhost')
+        ws.sock = a
+
+        conn = Connection('ws://localhost', 'appkey', ping_interval=60)
+        conn.ws = ws
+        self.addCleanup(setattr, conn, '_time_to_stop_pinging', True)
+        origin = time.time()
+        conn._ping()
+        self.assertLess(time.time() - origin, 1)
+        conn._ping_timer.cancel()
+        self.assertFalse(ws.send_ping('1', block=False))
+
+        b.setblocking(False)
+        try:
+            while b.recv(65536):
+                pass
+        except socket.error:
+            pass
+        self.assertTrue(ws.send_ping('2', block=False))
+
+    def test_dead_connection_is_closed_by_the_reader(self):
+        a, b = self.socket_pair()
+        delegate = ClosedDelegate()
+        conn = Connection('ws://localhost', 'appkey', delegate=delegate)
+        ws = RtmWsClient('ws://localhost')
+        ws.sock = a
+        ws.delegate = conn
+        conn.ws = ws
+        reader = threading.Thread(target=ws.run)
+        reader.daemon = True
+        reader.start()
+
+        before = threading.active_count()
+        conn._check_pong(time.time())
+        self.assertLessEqual(threading.active_count(), before)
+        self.assertTrue(delegate.closed.wait(5))
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+        self.assertIsNone(conn.ws)
+
+
+if __name__ == '__main__':
+    unittest.main()
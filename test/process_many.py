@@ -0,0 +1,108 @@
+from __future__ import print_function
+import unittest
+
+import satori.rtm.internal_client_action as a
+from satori.rtm.internal_client import InternalClient
+from satori.rtm.internal_pdu_splitter import Messages
+import satori.rtm.internal_queue as queue
+
+
+class RecordingSubscription(object):
+    def __init__(self):
+        self.received = []
+
+    def on_subscription_data(self, data):
+        self.received.append(data)
+
+    def disconnect(self):
+        pass
+
+
+def data(channel, messages, position):
+    return a.ChannelData({
+        u'subscription_id': channel,
+        u'messages': messages,
+        u'position': position})
+
+
+class TestProcessMany(unittest.TestCase):
+
+    def make_client(self, merge):
+        q = queue.Queue(maxsize=100)
+        client = InternalClient(
+            q, 'ws://localhost', 'appkey', merge_subscription_data=merge)
+        self.first = client.subscriptions[u'first'] = RecordingSubscription()
+        self.second = client.subscriptions[u'second'] = RecordingSubscription()
+        return client, q
+
+    def test_handles_everything_queued(self):
+        client, q = self.make_client(merge=False)
+        for i in range(5):
+            q.put(data(u'first', [i], i))
+        self.assertFalse(client.process_many(timeout=0))
+        self.assertTrue(q.empty())
+        self.assertEqual(
+            [d[u'messages'] for d in self.first.received],
+            [[0], [1], [2], [3], [4]])
+
+    def test_limit(self):
+        client, q = self.make_client(merge=False)
+        for i in range(5):
+            q.put(data(u'first', [i], i))
+        client.process_many(timeout=0, limit=2)
+        self.assertEqual(len(self.first.received), 2)
+        self.assertEqual(q.qsize(), 3)
+
+    def test_empty_queue(self):
+        client, q = self.make_client(merge=False)
+        self.assertFalse(client.process_many(timeout=0))
+
+    def test_merges_runs_of_one_subscription(self):
+        client, q = self.make_client(merge=True)
+        q.put(data(u'first', [1], 1))
+        q.put(data(u'first', [2, 3], 2))
+        q.put(data(u'second', [4], 3))
+        q.put(data(u'first', [5], 4))
+        q.put(data(u'first', [6], 5))
+        client.process_many(timeout=0)
+        self.assertEqual(
+            [(d[u'messages'], d[u'position']) for d in self.first.received],
+            [([1, 2, 3], 2), ([5, 6], 5)])
+        self.assertEqual(
+            [d[u'messages'] for d in self.second.received], [[4]])
+
+    def test_merge_keeps_raw_messages(self):
+        client, q = self.make_client(merge=True)
+        for i in range(3):
+            messages = Messages()
+            messages.append(i)
+            messages.raw.append(str(i))
+            q.put(data(u'first', messages, i))
+        client.process_many(timeout=0)
+        self.assertEqual(len(self.first.received), 1)
+        merged = self.first.received[0][u'messages']
+        self.assertEqual(merged, [0, 1, 2])
+        self.assertEqual(merged.raw, ['0', '1', '2'])
+
+    def test_stops_at_dispose(self):
+        client, q = self.make_client(merge=False)
+        q.put(data(u'first', [1], 1))
+        q.put(a.Dispose())
+        q.put(data(u'first', [2], 2))
+        self.assertTrue(client.process_many(timeout=0))
+        self.assertEqual(len(self.first.received), 1)
+
+    def test_exception_does_not_lose_the_batch(self):
+        client, q = self.make_client(merge=False)
+        q.put(data(u'first', [1], 1))
+        # there is no connection to read from, so the handler raises
+        q.put(a.Read(u'key', None, None))
+        q.put(data(u'first', [2], 2))
+        self.assertFalse(client.process_many(timeout=0))
+        self.assertTrue(q.empty())
+        self.assertEqual(
+            [d[u'messages'] for d in self.first.received], [[1], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+import satori.rtm.connection as sc
+from satori.rtm.client import make_client
+from satori.rtm.internal_timers import timers
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+from test.utils import sync_subscribe, RecordingWebSocket
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+class TestPublishMany(unittest.TestCase):
+
+    def test_connection_publish_many(self):
+        self.check_connection_publish_many()
+
+    def test_connection_publish_many_with_coalescing(self):
+        self.check_connection_publish_many(coalesce_writes=(16384, 0.01))
+
+    def check_connection_publish_many(self, coalesce_writes=None):
+        conn = sc.Connection(
+            endpoint, appkey, coalesce_writes=coalesce_writes)
+        conn.start()
+        channel = make_channel_name('publish_many')
+        conn.subscribe_sync(channel, timeout=5)
+
+        mailbox = []
+        done = threading.Event()
+
+        class Delegate(object):
+            def on_subscription_data(this, data):
+                mailbox.extend(data['messages'])
+                if len(mailbox) == 100:
+                    done.set()
+
+            def on_connection_closed(this):
+                pass
+
+        conn.delegate = Delegate()
+
+        acks = []
+        messages = [u'message-{0}'.format(i) for i in range(100)]
+        conn.publish_many(channel, messages, callback=acks.append)
+
+        self.assertTrue(done.wait(10))
+        conn.stop()
+        self.assertEqual(mailbox, messages)
+        self.assertEqual(len(acks), 100)
+        self.assertTrue(
+            all(ack['action'] == 'rtm/publish/ok' for ack in acks))
+
+    def test_coalesced_writes_are_flushed_on_interval(self):
+        conn = sc.Connection(
+            endpoint, appkey, coalesce_writes=(1000000, 0.05))
+        conn.start()
+        channel = make_channel_name('coalesced_publish')
+        try:
+            origin = time.time()
+            conn.publish_sync(channel, u'message', 5)
+            self.assertLess(time.time() - origin, 5)
+        finally:
+            conn.stop()
+
+    def test_coalesced_writes_use_shared_timers(self):
+        conn = sc.Connection(
+            'ws://localhost', 'appkey', coalesce_writes=(1000000, 0.05))
+        conn.ws = RecordingWebSocket()
+        self.addCleanup(conn.on_ws_closed)
+        # the shared timer thread is running from now on
+        timers.call_later(0, lambda: None)
+        time.sleep(0.01)
+        before = threading.active_count()
+        for i in range(3):
+            conn.publish(u'channel', i)
+        self.assertEqual(threading.active_count(), before)
+        origin = time.time()
+        while not conn.ws.sent and time.time() < origin + 5:
+            time.sleep(0.01)
+        self.assertEqual(len(conn.ws.sent), 3)
+
+    def test_client_publish_many(self):
+        with make_client(endpoint, appkey) as client:
+            channel = make_channel_name('client_publish_many')
+            so = sync_subscribe(client, channel)
+
+            acks = []
+            done = threading.Event()
+
+            def callback(ack):
+                acks.append(ack)
+                if len(acks) == 3:
+                    done.set()
+
+            client.publish_many(channel, [1, u'two', {u'three': 3}], callback)
+            self.assertTrue(done.wait(10))
+
+            origin = time.time()
+            while time.time() < origin + 5:
+                messages = [
+                    m for e in so.log if e[0] == 'data'
+                    for m in e[1]['messages']]
+                if len(messages) == 3:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(messages, [1, u'two', {u'three': 3}])
+            self.assertTrue(
+                all(ack['action'] == 'rtm/publish/ok' for ack in acks))
+
+
+if __name__ == '__main__':
+    unittest.main()
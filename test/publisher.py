@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import json
+import threading
+import time
+import unittest
+
+import cbor2
+
+import satori.rtm.connection as sc
+from satori.rtm.client import make_client
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+from test.utils import sync_subscribe, RecordingWebSocket
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+channels = [
+    u'plain',
+    u'with "quotes"',
+    u'back\\slash',
+    u'new\nline\ttab\x00nul',
+    u'</script>',
+    u'юникод   \U0001f600',
+]
+
+loads = {
+    'json': lambda payload: json.loads(payload.decode('utf8')),
+    'cbor': cbor2.loads}
+
+
+def callback(ack):
+    pass
+
+
+class TestPublisher(unittest.TestCase):
+
+    def check_publisher(self, protocol):
+        conn = sc.Connection('ws://localhost', 'appkey', protocol=protocol)
+        conn.ws = RecordingWebSocket()
+        message = {u'text': u'привет'}
+        for channel in channels:
+            body = {u'channel': channel, u'message': message}
+            conn.ws.sent = []
+
+            publisher = conn.publisher(channel)
+            publisher.publish(message)
+            publisher.publish(message, callback)
+            publisher.publish_many([message, message], callback)
+            conn.publish(channel, message)
+            conn.write(channel, message)
+
+            pdus = [loads[protocol](p) for p in conn.ws.sent]
+            self.assertEqual(
+                [p[u'body'] for p in pdus], [body] * len(pdus))
+            self.assertEqual(
+                [p[u'action'] for p in pdus],
+                [u'rtm/publish'] * 5 + [u'rtm/write'])
+            self.assertEqual(
+                [u'id' in p for p in pdus],
+                [False, True, True, True, False, False])
+            self.assertEqual(
+                set(conn.ws.binary), set([protocol == 'cbor']))
+
+    def test_json(self):
+        self.check_publisher('json')
+
+    def test_cbor(self):
+        self.check_publisher('cbor')
+
+    def test_client_publisher(self):
+        with make_client(endpoint, appkey) as client:
+            channel = make_channel_name('client_publisher')
+            so = sync_subscribe(client, channel)
+
+            acks = []
+            done = threading.Event()
+
+            def on_ack(ack):
+                acks.append(ack)
+                if len(acks) == 3:
+                    done.set()
+
+            publisher = client.publisher(channel)
+            publisher.publish(1, on_ack)
+            publisher.publish_many([u'two', {u'three': 3}], on_ack)
+            self.assertTrue(done.wait(10))
+
+            origin = time.time()
+            while time.time() < origin + 5:
+                messages = so.extract_received_messages()
+                if len(messages) == 3:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(messages, [1, u'two', {u'three': 3}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import print_function
+import json
+import threading
+import time
+import unittest
+
+import cbor2
+
+from satori.rtm.client import make_client
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+from test.utils import sync_subscribe, SubscriptionObserver
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+messages = [1, u'two', {u'three': [3, None]}]
+
+
+class RawSubscriptionObserver(SubscriptionObserver):
+    def __init__(self):
+        SubscriptionObserver.__init__(self)
+        self.raw_messages = []
+        self.done = threading.Event()
+
+    def on_subscription_raw_data(self, data):
+        self.log.append(('raw_data', data))
+        self.raw_messages.extend(data['messages'])
+        if len(self.raw_messages) == len(messages):
+            self.done.set()
+
+
+def wait_for_messages(so, count):
+    origin = time.time()
+    while time.time() < origin + 5:
+        received = [
+            m for e in so.log if e[0] == 'data'
+            for m in e[1]['messages']]
+        if len(received) == count:
+            break
+        time.sleep(0.1)
+    return received
+
+
+class TestRawSubscription(unittest.TestCase):
+
+    def test_relay_json(self):
+        self.check_relay('json', json.loads)
+
+    def test_relay_cbor(self):
+        self.check_relay('cbor', cbor2.loads)
+
+    def check_relay(self, protocol, loads):
+        with make_client(
+                endpoint=endpoint, appkey=appkey,
+                protocol=protocol) as client:
+            source = make_channel_name('raw_source')
+            target = make_channel_name('raw_target')
+
+            raw_so = sync_subscribe(
+                client, source, observer=RawSubscriptionObserver())
+            so = sync_subscribe(client, target)
+
+            client.publish_many(source, messages)
+            self.assertTrue(raw_so.done.wait(10))
+            self.assertNotIn('data', [e[0] for e in raw_so.log])
+
+            raw_data = [e[1] for e in raw_so.log if e[0] == 'raw_data']
+            self.assertTrue(all('position' in d for d in raw_data))
+            self.assertEqual(
+                [loads(m) for m in raw_so.raw_messages], messages)
+
+            client.publish_preserialized_message(
+                target, raw_so.raw_messages[0])
+            client.publish_many_preserialized_messages(
+                target, raw_so.raw_messages[1:])
+            self.assertEqual(wait_for_messages(so, 3), messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+from satori.rtm.client import make_client, SubscriptionMode
+import satori.rtm.internal_client_action as a
+from satori.rtm.internal_client import InternalClient
+import satori.rtm.internal_queue as queue
+from satori.rtm.internal_subscription import Subscription
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+from test.utils import SubscriptionObserver
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+class BatchObserver(SubscriptionObserver):
+    def __init__(self):
+        SubscriptionObserver.__init__(self)
+        self.batches = []
+        self.got_batch = threading.Event()
+
+    def on_subscription_data_batch(self, messages, last_position):
+        self.log.append(('batch', messages, last_position))
+        self.batches.append(messages)
+        self.got_batch.set()
+
+
+def data(messages, position):
+    return {
+        u'subscription_id': u'channel',
+        u'messages': messages,
+        u'position': position}
+
+
+class TestSubscriptionBatch(unittest.TestCase):
+
+    def make_subscription(self, batch, observer):
+        flushes = []
+        subscription = Subscription(
+            SubscriptionMode.ADVANCED,
+            lambda args: None, lambda: None,
+            observer=observer, batch=batch,
+            request_flush=lambda: flushes.append(a.FlushBatch(u'channel')))
+        subscription.connect()
+        subscription.on_subscribe_ok({u'body': {}})
+        return subscription, flushes
+
+    def test_flushes_at_max_messages(self):
+        so = BatchObserver()
+        subscription, _ = self.make_subscription((3, 60), so)
+        subscription.on_subscription_data(data([1, 2], u'p1'))
+        self.assertEqual(so.batches, [])
+        subscription.on_subscription_data(data([3, 4], u'p2'))
+        subscription.on_subscription_data(data([5], u'p3'))
+        self.assertEqual(so.batches, [[1, 2, 3, 4]])
+        self.assertEqual(so.log[-1][2], u'p2')
+        self.assertNotIn('data', [e[0] for e in so.log])
+
+    def test_timer_requests_a_flush(self):
+        so = BatchObserver()
+        subscription, flushes = self.make_subscription((100, 0.05), so)
+        subscription.on_subscription_data(data([1], u'p1'))
+        subscription.on_subscription_data(data([2], u'p2'))
+        origin = time.time()
+        while not flushes and time.time() < origin + 5:
+            time.sleep(0.01)
+        self.assertEqual(len(flushes), 1)
+        self.assertEqual(so.batches, [])
+        subscription.flush_batch()
+        self.assertEqual(so.log[-1], ('batch', [1, 2], u'p2'))
+
+    def test_disconnect_delivers_pending(self):
+        so = BatchObserver()
+        subscription, _ = self.make_subscription((100, 60), so)
+        subscription.on_subscription_data(data([1], u'p1'))
+        subscription.disconnect()
+        self.assertEqual(so.batches, [[1]])
+
+    def test_raising_observer_does_not_stop_disconnect(self):
+        class RaisingObserver(BatchObserver):
+            def on_subscription_data_batch(self, messages, last_position):
+                raise ValueError('observer failure')
+
+        so = BatchObserver()
+        client = InternalClient(
+            queue.Queue(maxsize=100), 'ws://localhost', 'appkey')
+        failing, _ = self.make_subscription((100, 60), RaisingObserver())
+        working, _ = self.make_subscription((100, 60), so)
+        client.subscriptions[u'failing'] = failing
+        client.subscriptions[u'working'] = working
+        failing.on_subscription_data(data([1], u'p1'))
+        working.on_subscription_data(data([2], u'p2'))
+
+        client._disconnect_subscriptions()
+        for subscription in [failing, working]:
+            self.assertFalse(subscription._is_connected())
+            self.assertEqual(
+                subscription._sm.get_state_name(), 'Subscription.Unsubscribed')
+        self.assertEqual(so.batches, [[2]])
+
+        failing.on_subscription_data(data([3], u'p3'))
+        failing.flush_batch()
+
+    def test_without_batch_method(self):
+        so = SubscriptionObserver()
+        subscription, _ = self.make_subscription((100, 60), so)
+        subscription.on_subscription_data(data([1], u'p1'))
+        self.assertEqual(so.extract_received_messages(), [1])
+
+    def test_client_batch(self):
+        with make_client(endpoint, appkey) as client:
+            channel = make_channel_name('subscription_batch')
+            so = BatchObserver()
+            client.subscribe(
+                channel, SubscriptionMode.ADVANCED, so, batch=(1000, 0.2))
+            self.assertTrue(so.subscribed.wait(10))
+
+            client.publish_many(channel, [1, 2, 3])
+            self.assertTrue(so.got_batch.wait(10))
+            self.assertEqual(so.batches, [[1, 2, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
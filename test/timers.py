@@ -0,0 +1,145 @@
+from __future__ import print_function
+import json
+import threading
+import time
+import unittest
+
+import satori.rtm.connection as sc
+import satori.rtm.internal_timers as internal_timers
+from satori.rtm.internal_timers import Timers
+
+from test.utils import RecordingWebSocket
+
+
+class TestTimers(unittest.TestCase):
+
+    def test_order_and_cancel(self):
+        timers = Timers()
+        fired = []
+        done = threading.Event()
+        timers.call_later(0.06, fired.append, 3)
+        timers.call_later(0.02, fired.append, 1)
+        cancelled = timers.call_later(0.04, fired.append, 2)
+        timers.call_later(0.08, done.set)
+        cancelled.cancel()
+        self.assertTrue(done.wait(10))
+        self.assertEqual(fired, [1, 3])
+
+    def test_callback_exception_does_not_stop_timers(self):
+        timers = Timers()
+        done = threading.Event()
+        timers.call_later(0, lambda: 1 / 0)
+        timers.call_later(0.01, done.set)
+        self.assertTrue(done.wait(10))
+
+    def test_cancelled_timers_are_compacted(self):
+        timers = Timers()
+        keep = timers.call_later(60, lambda: None)
+        count = internal_timers.min_cancelled_to_compact * 2
+        for _ in range(count):
+            timers.call_later(60, lambda: None).cancel()
+        self.assertLess(len(timers), count)
+        self.assertFalse(keep.cancelled)
+        keep.cancel()
+
+    def test_wall_clock_jump(self):
+        timers = Timers()
+        fired = []
+        done = threading.Event()
+        timers.call_later(60, fired.append, 1)
+        wall_clock = time.time
+        time.time = lambda: wall_clock() + 3600
+        try:
+            timers.call_later(0.05, done.set)
+            self.assertTrue(done.wait(10))
+        finally:
+            time.time = wall_clock
+        self.assertEqual(fired, [])
+
+    def test_single_thread(self):
+        timers = Timers()
+        done = threading.Event()
+        before = threading.active_count()
+        for i in range(100):
+            timers.call_later(0.01 + i * 0.0001, lambda: None)
+        timers.call_later(0.05, done.set)
+        self.assertLessEqual(threading.active_count(), before + 1)
+        self.assertTrue(done.wait(10))
+
+
+class TestAckTimeout(unittest.TestCase):
+
+    def test_ack_timeout(self):
+        conn = sc.Connection(
+            'ws://localhost', 'appkey', protocol='json', ack_timeout=0.1)
+        conn.ws = RecordingWebSocket()
+        conn.on_ws_opened()
+        replies = []
+        threads = []
+        got_reply = threading.Event()
+
+        def callback(reply):
+            replies.append(reply)
+            threads.append(threading.current_thread().name)
+            got_reply.set()
+
+        try:
+            conn.publish(u'channel', u'late', callback)
+            conn.read(u'channel', callback=callback)
+            self.assertTrue(got_reply.wait(10))
+            origin = time.time()
+            while len(replies) < 2 and time.time() < origin + 5:
+                time.sleep(0.01)
+            self.assertEqual(
+                sorted(r[u'action'] for r in replies),
+                [u'rtm/publish/error', u'rtm/read/error'])
+            self.assertEqual(
+                set(r[u'body'][u'error'] for r in replies),
+                set([u'ack_timeout']))
+            self.assertEqual(conn.ack_callbacks_by_id, {})
+            self.assertEqual(conn.metrics.ack_timeouts, 2)
+            self.assertEqual(threads, ['SatoriTimers'] * 2)
+
+            # a reply that comes after the timeout is dropped
+            conn.on_incoming_text_frame(json.dumps({
+                u'action': u'rtm/publish/ok', u'id': 0, u'body': {}}))
+            self.assertEqual(len(replies), 2)
+        finally:
+            conn.on_ws_closed()
+
+    def test_subscribe_does_not_time_out(self):
+        conn = sc.Connection(
+            'ws://localhost', 'appkey', protocol='json', ack_timeout=0.05)
+        conn.ws = RecordingWebSocket()
+        conn.on_ws_opened()
+        replies = []
+        try:
+            conn.subscribe(u'channel', callback=replies.append)
+            conn.unsubscribe(u'channel', callback=replies.append)
+            time.sleep(0.3)
+            self.assertEqual(replies, [])
+            self.assertEqual(len(conn.ack_callbacks_by_id), 2)
+            self.assertEqual(conn.metrics.ack_timeouts, 0)
+        finally:
+            conn.on_ws_closed()
+
+    def test_reply_in_time(self):
+        conn = sc.Connection(
+            'ws://localhost', 'appkey', protocol='json', ack_timeout=0.1)
+        conn.ws = RecordingWebSocket()
+        conn.on_ws_opened()
+        replies = []
+        try:
+            conn.publish(u'channel', u'message', replies.append)
+            conn.on_incoming_text_frame(json.dumps({
+                u'action': u'rtm/publish/ok', u'id': 0, u'body': {}}))
+            time.sleep(0.3)
+            self.assertEqual(
+                [r[u'action'] for r in replies], [u'rtm/publish/ok'])
+            self.assertEqual(conn.metrics.ack_timeouts, 0)
+        finally:
+            conn.on_ws_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
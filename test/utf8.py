@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import struct
+import unittest
+
+from miniws4py.utf8validator import IncrementalUtf8Validator, Utf8Validator
+from satori.rtm.internal_connection_miniws4py import RtmWsClient
+from test.frame_reader import ChunkedSocket, RecordingWebSocket, server_frame
+
+samples = [
+    b'',
+    b'hello',
+    u'привет, 世界, 😀'.encode('utf8'),
+    b'\xc0\xaf',  # overlong slash
+    b'\xed\xa0\x80',  # surrogate
+    b'\xf4\x90\x80\x80',  # above U+10FFFF
+    b'abc\xffdef',
+    b'\xe2\x82',  # truncated euro sign
+    u'€'.encode('utf8') * 3,
+]
+
+
+def run(validator, chunks):
+    result = None
+    for chunk in chunks:
+        result = validator.validate(bytearray(chunk))[:2]
+        if not result[0]:
+            break
+    return result
+
+
+class DecodingWebSocket(RecordingWebSocket):
+    def received_message(self, message):
+        self.received.append(message.data.decode('utf8'))
+
+
+class TestUtf8Validation(unittest.TestCase):
+
+    def test_incremental_validator_agrees_with_dfa(self):
+        for sample in samples:
+            for split in range(len(sample) + 1):
+                chunks = [sample[:split], sample[split:]]
+                self.assertEqual(
+                    run(IncrementalUtf8Validator(), chunks),
+                    run(Utf8Validator(), chunks),
+                    '{0!r} split at {1}'.format(sample, split))
+
+    def test_reset(self):
+        validator = IncrementalUtf8Validator()
+        self.assertEqual(validator.validate(b'\xe2\x82')[:2], (True, False))
+        validator.reset()
+        self.assertEqual(validator.validate(b'abc')[:2], (True, True))
+
+    def test_invalid_text_is_rejected(self):
+        for validate in [True, False]:
+            data = server_frame(0x1, b'fine') + server_frame(0x1, b'\xff')
+            ws = DecodingWebSocket(ChunkedSocket(data, 100))
+            ws.stream.validate_utf8 = validate
+            self.assertFalse(ws.receive())
+            self.assertEqual(ws.received, [u'fine'])
+            self.assertEqual(len(ws.sock.written), 1)
+            close = bytes(ws.sock.written[0])
+            self.assertEqual(struct.unpack('!H', close[6:8])[0], 1007)
+
+    def test_application_decode_error_is_not_invalid_utf8(self):
+        class FailingWebSocket(RecordingWebSocket):
+            def received_message(self, message):
+                b'\xff'.decode('utf8')
+
+        for validate in [True, False]:
+            ws = FailingWebSocket(
+                ChunkedSocket(server_frame(0x1, b'fine'), 100))
+            ws.stream.validate_utf8 = validate
+            self.assertRaises(UnicodeDecodeError, ws.receive)
+            self.assertEqual(ws.sock.written, [])
+
+    def test_text_is_decoded_once(self):
+        ws = RecordingWebSocket(ChunkedSocket(server_frame(0x1, b'fine'), 100))
+        ws.stream.validate_utf8 = False
+        messages = []
+        ws.received_message = messages.append
+        self.assertTrue(ws.receive())
+        self.assertEqual(messages[0].text, u'fine')
+
+    def test_rtm_client_rejects_surrogates(self):
+        # the Python 2 decoder accepts them, so the stream has to check
+        client = RtmWsClient('ws://localhost')
+        data = server_frame(0x1, b'\xed\xa0\x80')
+        ws = DecodingWebSocket(ChunkedSocket(data, 100))
+        ws.stream.validate_utf8 = client.stream.validate_utf8
+        self.assertFalse(ws.receive())
+        self.assertEqual(ws.received, [])
+        close = bytes(ws.sock.written[0])
+        self.assertEqual(struct.unpack('!H', close[6:8])[0], 1007)
+
+    def test_fragmented_text(self):
+        text = u'€uro'.encode('utf8')
+        data = server_frame(0x1, text[:2], fin=0) +\
+            server_frame(0x0, text[2:], fin=1)
+        ws = DecodingWebSocket(ChunkedSocket(data, 100))
+        self.assertTrue(ws.receive())
+        self.assertEqual(ws.received, [u'€uro'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -231,6 +231,25 @@ class SubscriptionObserver(object):
         raise AttributeError('SubscriptionObserver.{0}'.format(name))
 
 
+class RecordingWebSocket(object):
+    '''Stands in for connection.ws and keeps what is sent'''
+
+    def __init__(self):
+        self.sent = []
+        self.binary = []
+
+    def send(self, payload, binary=False):
+        self.sent.append(payload)
+        self.binary.append(binary)
+
+    def send_many(self, payloads, binary=False):
+        self.sent.extend(payloads)
+        self.binary.extend([binary] * len(payloads))
+
+    def close(self):
+        pass
+
+
 def print_all_stacktraces():
     print("\n*** STACKTRACE - START ***\n")
     code = []
@@ -0,0 +1,197 @@
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+import satori.rtm.connection as sc
+from satori.rtm.internal_writer import Writer
+
+from test.utils import make_channel_name, get_test_endpoint_and_appkey
+
+endpoint, appkey = get_test_endpoint_and_appkey()
+
+
+class BlockedSocket(object):
+    def __init__(self):
+        self.written = []
+        self.unblocked = threading.Event()
+
+    def write_frames(self, frames):
+        self.unblocked.wait(10)
+        self.written.extend(frames)
+
+
+class TestWriter(unittest.TestCase):
+
+    def make_writer(self, backpressure, sock=None, errors=None):
+        sock = sock or BlockedSocket()
+        writer = Writer(
+            sock.write_frames, 3, backpressure,
+            errors.append if errors is not None else None)
+        self.addCleanup(writer.join, 10)
+        self.addCleanup(writer.stop)
+        self.addCleanup(sock.unblocked.set)
+        return writer, sock
+
+    def test_frames_are_written_in_order(self):
+        writer, sock = self.make_writer('block')
+        sock.unblocked.set()
+        for i in range(100):
+            writer.put_many([str(i).encode('utf8')])
+        writer.stop()
+        writer.join(10)
+        self.assertEqual(
+            sock.written, [str(i).encode('utf8') for i in range(100)])
+
+    def test_raise(self):
+        writer, sock = self.make_writer('raise')
+        writer.put_many([b'first'])
+        while writer.qsize():
+            time.sleep(0.01)
+        writer.put_many([b'1', b'2', b'3'])
+        self.assertRaises(sc.Full, lambda: writer.put_many([b'4']))
+
+        # control frames bypass the limit
+        writer.put_many([b'pong'], block=False)
+        sock.unblocked.set()
+        writer.stop()
+        writer.join(10)
+        self.assertEqual(sock.written, [b'first', b'1', b'2', b'3', b'pong'])
+
+    def test_drop_oldest(self):
+        writer, sock = self.make_writer('drop-oldest')
+        writer.put_many([b'first'])
+        while writer.qsize():
+            time.sleep(0.01)
+        writer.put_many([b'1', b'2', b'3'])
+        writer.put_many([b'4', b'5'])
+        self.assertEqual(writer.dropped, 2)
+        sock.unblocked.set()
+        writer.stop()
+        writer.join(10)
+        self.assertEqual(sock.written, [b'first', b'3', b'4', b'5'])
+
+    def test_drop_oldest_keeps_control_frames(self):
+        writer, sock = self.make_writer('drop-oldest')
+        writer.put_many([b'first'])
+        while writer.qsize():
+            time.sleep(0.01)
+        writer.put_many([b'1'])
+        writer.put_many([b'pong'], block=False, control=True)
+        writer.put_many([b'2'])
+        writer.put_many([b'3', b'4', b'5'])
+        self.assertEqual(writer.dropped, 2)
+        sock.unblocked.set()
+        writer.stop()
+        writer.join(10)
+        self.assertEqual(
+            sock.written, [b'first', b'pong', b'3', b'4', b'5'])
+
+    def test_block(self):
+        writer, sock = self.make_writer('block')
+        writer.put_many([b'first'])
+        while writer.qsize():
+            time.sleep(0.01)
+        writer.put_many([b'1', b'2', b'3'])
+
+        done = threading.Event()
+
+        def put():
+            writer.put_many([b'4'])
+            done.set()
+
+        threading.Thread(target=put).start()
+        self.assertFalse(done.wait(0.2))
+        sock.unblocked.set()
+        self.assertTrue(done.wait(10))
+        writer.stop()
+        writer.join(10)
+        self.assertEqual(sock.written, [b'first', b'1', b'2', b'3', b'4'])
+
+    def test_write_error_stops_writer(self):
+        errors = []
+
+        def fail(frames):
+            raise IOError('fake broken pipe')
+
+        writer = Writer(fail, 3, 'block', errors.append)
+        writer.put_many([b'1'])
+        writer.join(10)
+        self.assertEqual(len(errors), 1)
+        self.assertRaises(RuntimeError, lambda: writer.put_many([b'2']))
+
+    def test_invalid_policy(self):
+        self.assertRaises(
+            ValueError,
+            lambda: Writer(None, 3, 'whatever', None))
+
+
+class FramingWebSocket(object):
+    def frame(self, payload, binary=False):
+        return payload
+
+
+class TestConnectionWithWriter(unittest.TestCase):
+
+    def test_dropped_requests_fail(self):
+        conn = sc.Connection(
+            'ws://localhost', 'appkey', outbound_queue_size=3,
+            backpressure='drop-oldest')
+        sock = BlockedSocket()
+        conn.ws = FramingWebSocket()
+        conn._writer = Writer(
+            sock.write_frames, 3, 'drop-oldest', None,
+            conn._on_payloads_dropped)
+        self.addCleanup(conn._writer.join, 10)
+        self.addCleanup(conn._writer.stop)
+        self.addCleanup(sock.unblocked.set)
+
+        mailbox = []
+        for i in range(100):
+            conn.publish(u'channel', i, callback=mailbox.append)
+            self.assertLessEqual(len(conn.ack_callbacks_by_id), 4)
+        # what is still queued or being written keeps its callback
+        self.assertEqual(len(mailbox), 100 - len(conn.ack_callbacks_by_id))
+        self.assertEqual(
+            set(reply[u'action'] for reply in mailbox),
+            set([u'rtm/publish/error']))
+        self.assertEqual(
+            set(reply[u'body'][u'error'] for reply in mailbox),
+            set([u'dropped']))
+        self.assertEqual(conn._writer.dropped, len(mailbox))
+
+    def test_publish_sync(self):
+        conn = sc.Connection(endpoint, appkey, outbound_queue_size=1000)
+        conn.start()
+        channel = make_channel_name('writer_thread')
+        try:
+            conn.subscribe_sync(channel, timeout=5)
+            conn.publish_sync(channel, u'message', 5)
+            conn.unsubscribe_sync(channel, 5)
+        finally:
+            conn.stop()
+
+    def test_flow_control(self):
+        wm = sc.high_ack_count_watermark
+        sc.high_ack_count_watermark = 3
+        mailbox = []
+        conn = sc.Connection(endpoint, appkey, outbound_queue_size=10)
+        try:
+            conn.start()
+            channel = make_channel_name('writer_flow_control')
+            for i in range(1000):
+                conn.publish(channel, u'message', callback=mailbox.append)
+                self.assertLessEqual(len(conn.ack_callbacks_by_id), 3)
+
+            origin = time.time()
+            while time.time() < origin + 5 and len(mailbox) < 1000:
+                time.sleep(0.1)
+        finally:
+            conn.stop()
+            sc.high_ack_count_watermark = wm
+
+        self.assertEqual(len(mailbox), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()